@@ -0,0 +1,438 @@
+"""Benchmarks for ``node.ext.fs``.
+
+Generates a synthetic tree in a temporary directory and measures throughput
+and file system backend operation counts of common operations::
+
+    python benchmarks/bench_fs.py --width 10 --depth 3 --file-size 1024
+
+Run with ``--help`` for all options.
+"""
+from node.ext.fs import Directory
+from node.ext.fs.backend import InstrumentedBackend
+from node.ext.fs.backend import IOStats
+from node.ext.fs.backend import MemoryBackend
+from node.ext.fs.backend import os_backend
+from node.ext.fs.compact import CompactDirectory
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+###############################################################################
+# Tree generation
+###############################################################################
+
+def create_tree(backend, path, width, depth, file_size):
+    """Create tree with ``width`` files and ``width`` subdirectories per
+    directory up to ``depth`` directory levels. Returns number of files and
+    directories created.
+    """
+    content = b'x' * file_size
+    files = directories = 0
+    backend.mkdir(path)
+    directories += 1
+    for i in range(width):
+        file_path = os.path.join(path, 'file{}.txt'.format(i))
+        with backend.open(file_path, 'wb') as f:
+            f.write(content)
+        files += 1
+    if depth > 1:
+        for i in range(width):
+            sub_files, sub_directories = create_tree(
+                backend,
+                os.path.join(path, 'dir{}'.format(i)),
+                width,
+                depth - 1,
+                file_size
+            )
+            files += sub_files
+            directories += sub_directories
+    return files, directories
+
+
+def walk_directories(directory):
+    yield directory
+    for name in directory:
+        if name.startswith('dir'):
+            for child in walk_directories(directory[name]):
+                yield child
+
+
+def walk_files(directory):
+    for directory in walk_directories(directory):
+        for name in directory:
+            if name.startswith('file'):
+                yield directory[name]
+
+
+###############################################################################
+# Benchmarks
+###############################################################################
+
+class Result(object):
+
+    def __init__(self, name, ops, seconds, operations, unit='ops'):
+        self.name = name
+        self.ops = ops
+        self.seconds = seconds
+        self.operations = operations
+        self.unit = unit
+
+    @property
+    def throughput(self):
+        return self.ops / self.seconds if self.seconds else float('inf')
+
+    def as_dict(self):
+        return dict(
+            name=self.name,
+            ops=self.ops,
+            unit=self.unit,
+            seconds=self.seconds,
+            throughput=self.throughput,
+            operations=self.operations
+        )
+
+
+class MemoryResult(object):
+
+    def __init__(self, name, nodes, size, target):
+        self.name = name
+        self.nodes = nodes
+        self.size = size
+        self.target = target
+
+    @property
+    def per_node(self):
+        return self.size / self.nodes
+
+    @property
+    def ok(self):
+        return self.per_node <= self.target
+
+    def as_dict(self):
+        return dict(
+            name=self.name,
+            nodes=self.nodes,
+            bytes=self.size,
+            bytes_per_node=self.per_node,
+            target=self.target,
+            ok=self.ok
+        )
+
+
+def measure(options, name, func, ops, unit='ops'):
+    stats = options.stats
+    stats.reset()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    operations = {
+        operation: count
+        for operation, (count, _) in stats.operations.items()
+    }
+    return Result(name, ops, seconds, operations, unit=unit)
+
+
+def bench_cold_listing(root, options):
+    directory = Directory(name=root, fs_backend=options.backend)
+
+    def run():
+        for node in walk_directories(directory):
+            list(node)
+
+    return measure(options, 'cold listing', run, options.directories, 'dirs')
+
+
+def bench_warm_lookup(root, options):
+    directory = Directory(name=root, fs_backend=options.backend)
+    files = list(walk_files(directory))
+    paths = [file.path[1:] for file in files]
+
+    def run():
+        for _ in range(options.repeat):
+            for path in paths:
+                node = directory
+                for name in path:
+                    node = node[name]
+
+    return measure(
+        options,
+        'warm lookup',
+        run,
+        len(paths) * options.repeat,
+        'lookups'
+    )
+
+
+def bench_full_read(root, options):
+    directory = Directory(name=root, fs_backend=options.backend)
+
+    def run():
+        for file in walk_files(directory):
+            file.data
+
+    return measure(
+        options,
+        'full tree read',
+        run,
+        options.files * options.file_size,
+        'bytes'
+    )
+
+
+def bench_prefetch_read(root, options):
+    directory = Directory(name=root, fs_backend=options.backend)
+
+    def run():
+        directory.prefetch_data()
+        for file in walk_files(directory):
+            file.data
+
+    return measure(
+        options,
+        'prefetched tree read',
+        run,
+        options.files * options.file_size,
+        'bytes'
+    )
+
+
+def bench_modify_flush(root, options):
+    directory = Directory(name=root, fs_backend=options.backend)
+    files = list(walk_files(directory))
+    file = files[len(files) // 2]
+
+    def run():
+        for i in range(options.repeat):
+            file.data = str(i)
+            directory()
+
+    return measure(
+        options,
+        'single file modify+flush',
+        run,
+        options.repeat,
+        'flushes'
+    )
+
+
+def bench_bulk_rename(root, options):
+    path = os.path.join(root, 'bulk')
+    create_bulk_files(options.backend, path, options.bulk)
+    directory = Directory(name=path, fs_backend=options.backend)
+
+    def run():
+        for i in range(options.bulk):
+            directory.rename('bulk{}'.format(i), 'renamed{}'.format(i))
+        directory()
+
+    return measure(options, 'bulk rename', run, options.bulk, 'renames')
+
+
+def bench_bulk_delete(root, options):
+    path = os.path.join(root, 'bulk')
+    directory = Directory(name=path, fs_backend=options.backend)
+
+    def run():
+        for i in range(options.bulk):
+            del directory['renamed{}'.format(i)]
+        directory()
+
+    return measure(options, 'bulk delete', run, options.bulk, 'deletes')
+
+
+def measure_memory(root, options, name, factory):
+    """Measure memory allocated for loading the whole tree including file
+    data access, which resolves file system paths.
+    """
+    def load():
+        directory = factory(name=root, fs_backend=options.backend)
+        nodes = 0
+        for node in walk_directories(directory):
+            nodes += 1
+        for file in walk_files(directory):
+            file.data
+            nodes += 1
+        return directory, nodes
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        directory, nodes = load()
+        size = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    return MemoryResult(name, nodes, size, options.node_bytes_target)
+
+
+def bench_memory_per_node(root, options):
+    return measure_memory(root, options, 'memory per node', Directory)
+
+
+def bench_compact_memory_per_node(root, options):
+    return measure_memory(
+        root,
+        options,
+        'compact memory per node',
+        CompactDirectory
+    )
+
+
+def create_bulk_files(backend, path, count):
+    backend.mkdir(path)
+    for i in range(count):
+        with backend.open(os.path.join(path, 'bulk{}'.format(i)), 'wb'):
+            pass
+
+
+BENCHMARKS = [
+    bench_cold_listing,
+    bench_warm_lookup,
+    bench_full_read,
+    bench_prefetch_read,
+    bench_modify_flush,
+    bench_bulk_rename,
+    bench_bulk_delete,
+    bench_memory_per_node,
+    bench_compact_memory_per_node,
+]
+
+
+###############################################################################
+# Runner
+###############################################################################
+
+def parse_options(args=None):
+    parser = argparse.ArgumentParser(description='node.ext.fs benchmarks')
+    parser.add_argument(
+        '--width',
+        type=int,
+        default=10,
+        help='Number of files and subdirectories per directory'
+    )
+    parser.add_argument(
+        '--depth',
+        type=int,
+        default=3,
+        help='Number of directory levels'
+    )
+    parser.add_argument(
+        '--file-size',
+        type=int,
+        default=1024,
+        help='Size of generated files in bytes'
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=10,
+        help='Number of repetitions for lookup and flush benchmarks'
+    )
+    parser.add_argument(
+        '--bulk',
+        type=int,
+        default=1000,
+        help='Number of files for bulk rename and delete benchmarks'
+    )
+    parser.add_argument(
+        '--dir',
+        default=None,
+        help='Directory to create benchmark tree in. Defaults to temp dir'
+    )
+    parser.add_argument(
+        '--node-bytes-target',
+        type=int,
+        default=512,
+        help='Target for memory allocated per loaded node in bytes'
+    )
+    parser.add_argument(
+        '--memory',
+        action='store_true',
+        help='Use in-memory file system backend'
+    )
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='Output results as JSON'
+    )
+    return parser.parse_args(args)
+
+
+def format_result(result):
+    if isinstance(result, MemoryResult):
+        return '{:<26} {:>10} {:<8} {:>26.1f} bytes/node  [{} {}]'.format(
+            result.name,
+            result.nodes,
+            'nodes',
+            result.per_node,
+            'target={}'.format(result.target),
+            'ok' if result.ok else 'exceeded'
+        )
+    operations = ', '.join(
+        '{}={}'.format(name, count)
+        for name, count in sorted(result.operations.items())
+    )
+    return '{:<26} {:>10} {:<8} {:>9.4f}s {:>14.1f} {}/s  [{}]'.format(
+        result.name,
+        result.ops,
+        result.unit,
+        result.seconds,
+        result.throughput,
+        result.unit,
+        operations
+    )
+
+
+def run(options):
+    tempdir = tempfile.mkdtemp(dir=options.dir)
+    if options.memory:
+        backend = MemoryBackend()
+        backend.makedirs(tempdir)
+    else:
+        backend = os_backend
+    options.stats = IOStats()
+    options.backend = InstrumentedBackend(backend, [options.stats])
+    try:
+        root = os.path.join(tempdir, 'tree')
+        options.files, options.directories = create_tree(
+            backend,
+            root,
+            options.width,
+            options.depth,
+            options.file_size
+        )
+        return [benchmark(root, options) for benchmark in BENCHMARKS]
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def main(args=None):
+    options = parse_options(args)
+    results = run(options)
+    if options.json:
+        json.dump([result.as_dict() for result in results], sys.stdout)
+        sys.stdout.write('\n')
+        return
+    print((
+        'Tree: width={} depth={} file size={} ({} files, {} dirs, {} backend)'
+    ).format(
+        options.width,
+        options.depth,
+        options.file_size,
+        options.files,
+        options.directories,
+        'memory' if options.memory else 'os'
+    ))
+    for result in results:
+        print(format_result(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,21 @@
+from node.ext.fs.aio import AsyncDirectory
+from node.ext.fs.aio import AsyncFileNode
+from node.ext.fs.aio import AsyncNode
+from node.ext.fs.compact import CompactDirectory
+from node.ext.fs.compact import CompactFile
 from node.ext.fs.directory import Directory
 from node.ext.fs.directory import DirectoryStorage
 from node.ext.fs.file import File
 from node.ext.fs.file import FileNode
+from node.ext.fs.file import track_writes
+from node.ext.fs.interfaces import CACHE_LRU
+from node.ext.fs.interfaces import CACHE_NONE
+from node.ext.fs.interfaces import CACHE_UNBOUNDED
+from node.ext.fs.interfaces import FS_DIRECTORY
+from node.ext.fs.interfaces import FS_FILE
+from node.ext.fs.interfaces import LOCK_DIRECTORY
+from node.ext.fs.interfaces import LOCK_FILE
+from node.ext.fs.interfaces import LOCK_ROOT
 from node.ext.fs.interfaces import MODE_BINARY
 from node.ext.fs.interfaces import MODE_TEXT
 from node.ext.fs.location import FSLocation
@@ -0,0 +1,75 @@
+from node.ext.fs.interfaces import IAsyncDirectory
+from node.ext.fs.interfaces import IAsyncFileNode
+from node.ext.fs.interfaces import IAsyncNode
+from plumber import Behavior
+from plumber import default
+from zope.interface import implementer
+import asyncio
+import functools
+
+
+def get_async_executor(node):
+    """Lookup executor for running blocking operations of node. Executor is
+    acquired from parents if not set on node. ``None`` means the default
+    executor of the event loop.
+    """
+    while node is not None:
+        executor = getattr(node, 'async_executor', None)
+        if executor is not None:
+            return executor
+        node = getattr(node, 'parent', None)
+    return None
+
+
+def run_blocking(node, func, *args, **kw):
+    """Run blocking function in executor of node. Returns awaitable."""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(
+        get_async_executor(node),
+        functools.partial(func, *args, **kw)
+    )
+
+
+@implementer(IAsyncNode)
+class AsyncNode(Behavior):
+    async_executor = default(None)
+
+    @default
+    async def acall(self):
+        await run_blocking(self, self)
+
+
+@implementer(IAsyncFileNode)
+class AsyncFileNode(AsyncNode):
+
+    @default
+    async def aread(self):
+        return await run_blocking(self, getattr, self, 'data')
+
+    @default
+    async def awrite(self, data):
+        def write():
+            self.data = data
+            self()
+        await run_blocking(self, write)
+
+
+async def _aiter_keys(directory):
+    for key in await run_blocking(directory, list, directory):
+        yield key
+
+
+@implementer(IAsyncDirectory)
+class AsyncDirectory(AsyncNode):
+
+    @default
+    def __aiter__(self):
+        return _aiter_keys(self)
+
+    @default
+    async def aitems(self):
+        return await run_blocking(self, self.items)
+
+    @default
+    async def aget(self, name, default=None):
+        return await run_blocking(self, self.get, name, default)
@@ -0,0 +1,530 @@
+from node.ext.fs.interfaces import IFSBackend
+from zope.interface import implementer
+import errno
+import io
+import mmap
+import os
+import shutil
+import stat
+import threading
+import time
+
+
+BACKEND_OPERATIONS = (
+    'exists',
+    'isdir',
+    'stat',
+    'scandir',
+    'open',
+    'mkdir',
+    'chmod',
+    'rename',
+    'replace',
+    'remove',
+    'rmtree',
+    'fsync',
+    'fsync_directory',
+    'mmap',
+)
+
+
+def _fsync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _fsync_directory(path):
+    fd = os.open(path or os.curdir, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _mmap(path):
+    with open(path, 'rb') as f:
+        # Empty files cannot be mapped
+        if not os.fstat(f.fileno()).st_size:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@implementer(IFSBackend)
+class OSBackend(object):
+    """File system backend using the ``os`` module.
+
+    Operations are the plain functions of the standard library, thus using
+    this backend adds no overhead.
+    """
+    native = True
+    exists = staticmethod(os.path.exists)
+    isdir = staticmethod(os.path.isdir)
+    stat = staticmethod(os.stat)
+    scandir = staticmethod(os.scandir)
+    open = staticmethod(open)
+    mkdir = staticmethod(os.mkdir)
+    chmod = staticmethod(os.chmod)
+    rename = staticmethod(os.rename)
+    replace = staticmethod(os.replace)
+    remove = staticmethod(os.remove)
+    rmtree = staticmethod(shutil.rmtree)
+    fsync = staticmethod(_fsync)
+    fsync_directory = staticmethod(_fsync_directory)
+    mmap = staticmethod(_mmap)
+
+
+os_backend = OSBackend()
+
+
+# Generation of values acquired from parents. Gets incremented if an
+# acquired value gets set or a subtree gets moved, which invalidates values
+# cached on descendants
+_acquired_generation = 0
+
+
+def invalidate_acquired():
+    """Invalidate values acquired from parents cached by ``acquire``."""
+    global _acquired_generation
+    _acquired_generation += 1
+
+
+def acquire(ob, name, cache_name, default=None):
+    """Lookup attribute ``name`` on object or its parents. Returns tuple of
+    the value and the object it has been found on, or ``default`` and
+    ``None`` if not found.
+
+    The result is cached on the object in attribute ``cache_name`` unless
+    ``fs_path_cache`` is disabled. The cache is valid as long as the parent
+    is the same object and ``invalidate_acquired`` has not been called, thus
+    lookups are not depending on the depth of the object.
+    """
+    value = getattr(ob, name, None)
+    if value is not None:
+        return value, ob
+    generation = _acquired_generation
+    parent = getattr(ob, 'parent', None)
+    cache = getattr(ob, cache_name, None)
+    if cache is not None and cache[0] == generation and cache[1] is parent:
+        return cache[2]
+    if parent is None:
+        result = (default, None)
+    else:
+        result = acquire(parent, name, cache_name, default)
+    if getattr(ob, 'fs_path_cache', True):
+        try:
+            setattr(ob, cache_name, (generation, parent, result))
+        except AttributeError:
+            pass
+    return result
+
+
+def get_fs_backend(ob):
+    """Lookup file system backend of object. Backend is acquired from
+    parents if not set on object. Defaults to ``os_backend``.
+    """
+    return acquire(ob, '_fs_backend', '_fs_backend_cache', os_backend)[0]
+
+
+class IOStats(object):
+    """Collect counts and timings of backend operations.
+
+    Instances are used as hooks of ``InstrumentedBackend``. Operations are
+    accounted in total and per label of the instrumented backend, which
+    allows collecting stats per subtree.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __call__(self, operation, label, seconds):
+        with self._lock:
+            self._record(self.operations, operation, seconds)
+            if label is not None:
+                subtree = self.subtrees.setdefault(label, dict())
+                self._record(subtree, operation, seconds)
+
+    def _record(self, operations, operation, seconds):
+        stats = operations.get(operation)
+        if stats is None:
+            operations[operation] = [1, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+
+    def reset(self):
+        self.operations = dict()
+        self.subtrees = dict()
+
+    def count(self, operation, label=None):
+        operations = (
+            self.operations if label is None
+            else self.subtrees.get(label, {})
+        )
+        return operations.get(operation, [0, 0.])[0]
+
+    def as_dict(self):
+        def export(operations):
+            return {
+                operation: dict(count=count, seconds=seconds)
+                for operation, (count, seconds) in operations.items()
+            }
+        return dict(
+            operations=export(self.operations),
+            subtrees={
+                label: export(operations)
+                for label, operations in self.subtrees.items()
+            }
+        )
+
+
+def _instrument(func, operation, label, hooks):
+    def instrumented(*args, **kw):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kw)
+        finally:
+            seconds = time.perf_counter() - start
+            for hook in hooks:
+                hook(operation, label, seconds)
+    return instrumented
+
+
+@implementer(IFSBackend)
+class InstrumentedBackend(object):
+    """Backend wrapper calling hooks with operation name, label and elapsed
+    time in seconds for each operation of the wrapped backend.
+
+    Set it as ``fs_backend`` of a root node or of subtrees to collect stats.
+    Use distinct labels for collecting stats per subtree.
+    """
+
+    def __init__(self, backend, hooks, label=None):
+        self.backend = backend
+        self.hooks = hooks
+        self.label = label
+        self.native = backend.native
+        for operation in BACKEND_OPERATIONS:
+            setattr(self, operation, _instrument(
+                getattr(backend, operation),
+                operation,
+                label,
+                hooks
+            ))
+
+
+def _os_error(cls, code, path):
+    return cls(code, os.strerror(code), path)
+
+
+class _MemoryEntry(object):
+    """File or directory of ``MemoryBackend``."""
+    __slots__ = ('data', 'children', 'mode', 'ino', 'mtime_ns')
+
+    def __init__(self, ino, mtime_ns, directory=False):
+        self.data = b''
+        self.children = dict() if directory else None
+        self.mode = 0o755 if directory else 0o644
+        self.ino = ino
+        self.mtime_ns = mtime_ns
+
+    @property
+    def is_dir(self):
+        return self.children is not None
+
+    def stat(self):
+        mtime = self.mtime_ns / 1e9
+        return os.stat_result(
+            (
+                (stat.S_IFDIR if self.is_dir else stat.S_IFREG) | self.mode,
+                self.ino,
+                0,
+                2 if self.is_dir else 1,
+                0,
+                0,
+                len(self.data),
+                int(mtime),
+                int(mtime),
+                int(mtime)
+            ),
+            dict(
+                st_atime=mtime,
+                st_mtime=mtime,
+                st_ctime=mtime,
+                st_atime_ns=self.mtime_ns,
+                st_mtime_ns=self.mtime_ns,
+                st_ctime_ns=self.mtime_ns
+            )
+        )
+
+
+class _MemoryDirEntry(object):
+    """``os.DirEntry`` like object returned by ``MemoryBackend.scandir``."""
+    __slots__ = ('name', 'path', '_entry')
+
+    def __init__(self, name, path, entry):
+        self.name = name
+        self.path = path
+        self._entry = entry
+
+    def is_dir(self):
+        return self._entry.is_dir
+
+    def is_file(self):
+        return not self._entry.is_dir
+
+    def is_symlink(self):
+        return False
+
+    def stat(self):
+        return self._entry.stat()
+
+
+class _MemoryScandir(object):
+    """Iterator of ``_MemoryDirEntry`` objects usable as context manager."""
+
+    def __init__(self, entries):
+        self._entries = iter(entries)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+
+class _MemoryWriter(io.BytesIO):
+    """Buffer writing it's contents to a ``MemoryBackend`` file on flush and
+    close.
+    """
+
+    def __init__(self, backend, entry):
+        super().__init__()
+        self._backend = backend
+        self._entry = entry
+
+    def flush(self):
+        super().flush()
+        if not self.closed:
+            self._backend._write(self._entry, self.getvalue())
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+        super().close()
+
+
+class _MemoryMap(bytes):
+    """Read only buffer returned by ``MemoryBackend.mmap``."""
+
+    def close(self):
+        pass
+
+
+@implementer(IFSBackend)
+class MemoryBackend(object):
+    """File system backend keeping all files and directories in memory.
+
+    Intended for tests and dry runs. Paths are normalized with
+    ``os.path.abspath``, the file system initially only contains the root
+    directory. Use ``makedirs`` to create the location of a tree. Operations
+    raise the same ``OSError`` subclasses as their ``os`` counterparts. Text
+    files are encoded with UTF-8.
+    """
+    native = False
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ino = 0
+        self._mtime_ns = 0
+        self._root = self._create(directory=True)
+
+    def _create(self, directory=False):
+        self._ino += 1
+        return _MemoryEntry(self._ino, self._now(), directory=directory)
+
+    def _now(self):
+        # Modification times are strictly increasing, so changes are always
+        # detectable by stat
+        self._mtime_ns = max(time.time_ns(), self._mtime_ns + 1)
+        return self._mtime_ns
+
+    def _write(self, entry, data):
+        with self._lock:
+            entry.data = data
+            entry.mtime_ns = self._now()
+
+    def _parts(self, path):
+        return [part for part in os.path.abspath(path).split(os.sep) if part]
+
+    def _lookup(self, path):
+        entry = self._root
+        for part in self._parts(path):
+            if not entry.is_dir:
+                raise _os_error(NotADirectoryError, errno.ENOTDIR, path)
+            entry = entry.children.get(part)
+            if entry is None:
+                raise _os_error(FileNotFoundError, errno.ENOENT, path)
+        return entry
+
+    def _lookup_parent(self, path):
+        parts = self._parts(path)
+        if not parts:
+            raise _os_error(PermissionError, errno.EPERM, path)
+        parent = self._lookup(os.sep + os.sep.join(parts[:-1]))
+        if not parent.is_dir:
+            raise _os_error(NotADirectoryError, errno.ENOTDIR, path)
+        return parent, parts[-1]
+
+    def _pop(self, path, directory):
+        parent, name = self._lookup_parent(path)
+        entry = parent.children.get(name)
+        if entry is None:
+            raise _os_error(FileNotFoundError, errno.ENOENT, path)
+        if directory and not entry.is_dir:
+            raise _os_error(NotADirectoryError, errno.ENOTDIR, path)
+        if not directory and entry.is_dir:
+            raise _os_error(IsADirectoryError, errno.EISDIR, path)
+        del parent.children[name]
+        parent.mtime_ns = self._now()
+        return entry
+
+    def exists(self, path):
+        try:
+            with self._lock:
+                self._lookup(path)
+        except OSError:
+            return False
+        return True
+
+    def isdir(self, path):
+        try:
+            with self._lock:
+                return self._lookup(path).is_dir
+        except OSError:
+            return False
+
+    def stat(self, path):
+        with self._lock:
+            return self._lookup(path).stat()
+
+    def scandir(self, path):
+        with self._lock:
+            entry = self._lookup(path)
+            if not entry.is_dir:
+                raise _os_error(NotADirectoryError, errno.ENOTDIR, path)
+            return _MemoryScandir([
+                _MemoryDirEntry(name, os.path.join(path, name), child)
+                for name, child in entry.children.items()
+            ])
+
+    def open(self, path, mode='r'):
+        kind = mode.replace('b', '').replace('t', '')
+        with self._lock:
+            if kind == 'r':
+                entry = self._lookup(path)
+                if entry.is_dir:
+                    raise _os_error(IsADirectoryError, errno.EISDIR, path)
+                stream = io.BytesIO(entry.data)
+            elif kind in ('w', 'x'):
+                parent, name = self._lookup_parent(path)
+                entry = parent.children.get(name)
+                if entry is None:
+                    entry = parent.children[name] = self._create()
+                    parent.mtime_ns = self._now()
+                elif kind == 'x':
+                    raise _os_error(FileExistsError, errno.EEXIST, path)
+                elif entry.is_dir:
+                    raise _os_error(IsADirectoryError, errno.EISDIR, path)
+                else:
+                    self._write(entry, b'')
+                stream = _MemoryWriter(self, entry)
+            else:
+                raise ValueError('Unsupported mode: {}'.format(mode))
+        if 'b' in mode:
+            return stream
+        return io.TextIOWrapper(stream, encoding='utf-8')
+
+    def mkdir(self, path):
+        with self._lock:
+            parent, name = self._lookup_parent(path)
+            if name in parent.children:
+                raise _os_error(FileExistsError, errno.EEXIST, path)
+            parent.children[name] = self._create(directory=True)
+            parent.mtime_ns = self._now()
+
+    def makedirs(self, path):
+        """Create directory at path including missing intermediate
+        directories. Existing directories are ignored.
+        """
+        with self._lock:
+            entry = self._root
+            for part in self._parts(path):
+                if not entry.is_dir:
+                    raise _os_error(NotADirectoryError, errno.ENOTDIR, path)
+                child = entry.children.get(part)
+                if child is None:
+                    child = entry.children[part] = self._create(
+                        directory=True
+                    )
+                    entry.mtime_ns = self._now()
+                entry = child
+            if not entry.is_dir:
+                raise _os_error(FileExistsError, errno.EEXIST, path)
+
+    def chmod(self, path, mode):
+        with self._lock:
+            self._lookup(path).mode = stat.S_IMODE(mode)
+
+    def rename(self, src, dst):
+        with self._lock:
+            entry = self._lookup(src)
+            parent, name = self._lookup_parent(dst)
+            existing = parent.children.get(name)
+            if existing is entry:
+                return
+            if existing is not None:
+                if existing.is_dir and not entry.is_dir:
+                    raise _os_error(IsADirectoryError, errno.EISDIR, dst)
+                if not existing.is_dir and entry.is_dir:
+                    raise _os_error(NotADirectoryError, errno.ENOTDIR, dst)
+                if existing.is_dir and existing.children:
+                    raise _os_error(OSError, errno.ENOTEMPTY, dst)
+            self._pop(src, entry.is_dir)
+            parent.children[name] = entry
+            parent.mtime_ns = self._now()
+
+    replace = rename
+
+    def remove(self, path):
+        with self._lock:
+            self._pop(path, False)
+
+    def rmtree(self, path):
+        with self._lock:
+            self._pop(path, True)
+
+    def fsync(self, f):
+        f.flush()
+
+    def fsync_directory(self, path):
+        with self._lock:
+            self._lookup(path)
+
+    def mmap(self, path):
+        with self._lock:
+            entry = self._lookup(path)
+            if entry.is_dir:
+                raise _os_error(IsADirectoryError, errno.EISDIR, path)
+            if not entry.data:
+                return None
+            return _MemoryMap(entry.data)
@@ -0,0 +1,152 @@
+from collections import OrderedDict
+from node.ext.fs.dirty import is_dirty
+from node.ext.fs.interfaces import CACHE_LRU
+from node.ext.fs.interfaces import CACHE_NONE
+from node.ext.fs.interfaces import CACHE_UNBOUNDED
+from weakref import WeakValueDictionary
+import threading
+
+
+def fs_signature(stat_result):
+    """Return signature of stat result used for detecting file system changes.
+    """
+    return (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+
+
+def stat_signature(backend, path):
+    """Return signature of path or ``None`` if path not exists."""
+    try:
+        return fs_signature(backend.stat(path))
+    except OSError:
+        return None
+
+
+def evict_child(child):
+    """Remove child from it's parent storage unless it is dirty.
+
+    Evicted children get flagged, so they are put back to parent storage if
+    they get modified later on. See ``node.ext.fs.dirty.mark_dirty``. As long
+    as an evicted child is referenced elsewhere, e.g. by a loaded descendant,
+    it is kept in a weak mapping of the parent and reused if the child gets
+    looked up again, thus there is never more than one node per entry.
+    """
+    parent = child.parent
+    if parent is None or is_dirty(child):
+        return False
+    storage = parent.storage
+    name = child.name
+    if storage.get(name) is not child:
+        return False
+    del storage[name]
+    child._fs_evicted = True
+    evicted = parent._fs_evicted_children
+    if evicted is None:
+        evicted = parent._fs_evicted_children = WeakValueDictionary()
+    evicted[name] = child
+    return True
+
+
+def revive_child(parent, name):
+    """Return evicted child of parent by name if still referenced, otherwise
+    ``None``. The child is no longer considered evicted.
+    """
+    evicted = parent._fs_evicted_children
+    if not evicted:
+        return None
+    child = evicted.pop(name, None)
+    if child is not None:
+        child._fs_evicted = False
+    return child
+
+
+def forget_child(parent, name):
+    """Drop evicted child of parent by name, it must not be reused."""
+    evicted = parent._fs_evicted_children
+    if evicted:
+        evicted.pop(name, None)
+
+
+def pin_child(child):
+    """Put evicted child and it's evicted ancestors back to parent storage.
+
+    Used for children holding prefetched content, which would get lost with
+    the node otherwise. Pinned children stay in parent storage until the
+    child cache evicts them again after being accessed or persisted.
+    """
+    while getattr(child, '_fs_evicted', False):
+        parent = child.parent
+        child._fs_evicted = False
+        forget_child(parent, child.name)
+        if parent.storage.setdefault(child.name, child) is not child:
+            # Child has been replaced meanwhile
+            break
+        child = parent
+
+
+class ChildCache(object):
+    """Unbounded child cache. Loaded children are kept in memory."""
+
+    def loaded(self, child):
+        """Called after child has been loaded from file system."""
+
+    def accessed(self, child):
+        """Called if already loaded child gets accessed."""
+
+    def flushed(self, child):
+        """Called after child has been persisted."""
+
+
+class NoChildCache(ChildCache):
+    """Children are not kept in memory unless they contain changes."""
+
+    def loaded(self, child):
+        evict_child(child)
+
+    def flushed(self, child):
+        evict_child(child)
+
+
+class LRUChildCache(ChildCache):
+    """Bounded cache evicting least recently used children.
+
+    Dirty children are dropped from the cache entries but remain in their
+    parent storage until they get persisted and accessed again.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def loaded(self, child):
+        self.accessed(child)
+
+    def accessed(self, child):
+        with self._lock:
+            entries = self._entries
+            key = id(child)
+            if key in entries:
+                entries.move_to_end(key)
+                return
+            entries[key] = child
+            while len(entries) > self.size:
+                evict_child(entries.popitem(last=False)[1])
+
+    flushed = accessed
+
+
+_unbounded_child_cache = ChildCache()
+
+
+def create_child_cache(policy, size):
+    """Create child cache for policy."""
+    if policy == CACHE_UNBOUNDED:
+        return _unbounded_child_cache
+    if policy == CACHE_NONE:
+        return NoChildCache()
+    if policy == CACHE_LRU:
+        return LRUChildCache(size)
+    raise ValueError('Unknown child cache policy: {}'.format(policy))
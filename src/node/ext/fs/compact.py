@@ -0,0 +1,110 @@
+from node.behaviors import DefaultInit
+from node.behaviors import MappingAdopt
+from node.behaviors import MappingNode
+from node.ext.fs.aio import AsyncDirectory
+from node.ext.fs.aio import AsyncFileNode
+from node.ext.fs.directory import DirectoryStorage
+from node.ext.fs.file import FileNode
+from node.ext.fs.mode import FSMode
+from plumber import plumbing
+
+
+class DefaultSlot(object):
+    """Descriptor wrapping a slot, returning a default value if the slot is
+    unset.
+
+    Behaviors define defaults of instance attributes as class attributes,
+    which would shadow slots of the same name. Plumbing classes using slots
+    declare these attributes with this descriptor instead.
+    """
+
+    def __init__(self, cls, name, default=None):
+        self.slot = vars(cls)[name]
+        self.default = default
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            return self.slot.__get__(obj, objtype)
+        except AttributeError:
+            return self.default
+
+    def __set__(self, obj, value):
+        self.slot.__set__(obj, value)
+
+    def __delete__(self, obj):
+        self.slot.__delete__(obj)
+
+
+class CompactFileSlots(object):
+    """Slots of attributes set on each loaded file."""
+
+    __slots__ = (
+        '__name__',
+        '__parent__',
+        '_fs_dirty',
+    )
+
+
+class CompactDirectorySlots(object):
+    """Slots of attributes set on each loaded directory."""
+
+    __slots__ = (
+        '__name__',
+        '__parent__',
+        '_fs_dirty',
+        '_fs_path_cache',
+        '_fs_path_joined',
+        '_storage',
+        '_fs_listing',
+        '_fs_listing_signature',
+        '_fs_child_cache',
+        '_fs_backend_cache',
+        '_fs_locks_cache',
+        '_fs_evicted_children',
+    )
+
+
+@plumbing(
+    DefaultInit,
+    FSMode,
+    FileNode,
+    AsyncFileNode)
+class CompactFile(CompactFileSlots):
+    """File optimized for memory consumption in huge trees.
+
+    Attributes set on each node are stored in slots, other attributes only
+    allocate an instance dict once set. The resolved path is not cached.
+    """
+    __name__ = DefaultSlot(CompactFileSlots, '__name__')
+    __parent__ = DefaultSlot(CompactFileSlots, '__parent__')
+    fs_path_cache = False
+
+
+@plumbing(
+    MappingAdopt,
+    MappingNode,
+    FSMode,
+    DirectoryStorage,
+    AsyncDirectory)
+class CompactDirectory(CompactDirectorySlots):
+    """Directory optimized for memory consumption in huge trees.
+
+    Attributes set on each node are stored in slots. Bookkeeping containers
+    for deletes and renames are allocated on first modification. Children
+    get created as ``CompactFile`` and ``CompactDirectory`` by default.
+    """
+    __name__ = DefaultSlot(CompactDirectorySlots, '__name__')
+    __parent__ = DefaultSlot(CompactDirectorySlots, '__parent__')
+    _fs_listing = DefaultSlot(CompactDirectorySlots, '_fs_listing')
+    _fs_child_cache = DefaultSlot(CompactDirectorySlots, '_fs_child_cache')
+    _fs_evicted_children = DefaultSlot(
+        CompactDirectorySlots,
+        '_fs_evicted_children'
+    )
+    default_file_factory = CompactFile
+
+    @property
+    def default_directory_factory(self):
+        return CompactDirectory
@@ -1,25 +1,83 @@
+from concurrent.futures import FIRST_EXCEPTION
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from contextlib import ExitStack
 from contextlib import contextmanager
 from node.behaviors import DictStorage
 from node.behaviors import MappingAdopt
 from node.behaviors import MappingNode
 from node.behaviors import WildcardFactory
 from node.compat import IS_PY2
+from node.ext.fs.aio import AsyncDirectory
+from node.ext.fs.backend import invalidate_acquired
+from node.ext.fs.cache import create_child_cache
+from node.ext.fs.cache import evict_child
+from node.ext.fs.cache import forget_child
+from node.ext.fs.cache import pin_child
+from node.ext.fs.cache import revive_child
+from node.ext.fs.cache import stat_signature
+from node.ext.fs.dirty import is_dirty
+from node.ext.fs.dirty import mark_clean
+from node.ext.fs.dirty import mark_dirty
+from node.ext.fs.factory import compile_factories
+from node.ext.fs.factory import translate_pattern
+from node.ext.fs.file import batch_directory_sync
+from node.ext.fs.file import cached_data
+from node.ext.fs.file import data_size
+from node.ext.fs.file import drop_file_cache
 from node.ext.fs.file import File
+from node.ext.fs.file import open_file
+from node.ext.fs.file import persist_file
+from node.ext.fs.file import read_file_content
+from node.ext.fs.file import record_write
+from node.ext.fs.file import track_writes
+from node.ext.fs.file import unchanged_signature
+from node.ext.fs.file import write_data
+from node.ext.fs.interfaces import CACHE_UNBOUNDED
+from node.ext.fs.interfaces import FS_DIRECTORY
+from node.ext.fs.interfaces import FS_FILE
 from node.ext.fs.interfaces import IDirectory
 from node.ext.fs.interfaces import IFile
+from node.ext.fs.interfaces import IFileNode
+from node.ext.fs.interfaces import IFSMode
+from node.ext.fs.interfaces import MODE_BINARY
+from node.ext.fs.journal import CHMOD
+from node.ext.fs.journal import DELETE
+from node.ext.fs.journal import Journal
+from node.ext.fs.journal import JOURNAL_NAME
+from node.ext.fs.journal import MKDIR
+from node.ext.fs.journal import recover
+from node.ext.fs.journal import RENAME
+from node.ext.fs.journal import WRITE
 from node.ext.fs.location import FSLocation
 from node.ext.fs.location import get_fs_name
 from node.ext.fs.location import join_fs_path
+from node.ext.fs.locking import file_lock
+from node.ext.fs.locking import LOCK_NAME
+from node.ext.fs.locking import lockmutation
+from node.ext.fs.locking import locksubtree
+from node.ext.fs.locking import mutation_lock
+from node.ext.fs.locking import subtree_lock
+from node.ext.fs.mode import apply_fs_mode
 from node.ext.fs.mode import FSMode
-from node.locking import locktree
+from node.ext.fs.plan import Plan
+from node.utils import UNSET
 from plumber import default
 from plumber import finalize
 from plumber import plumbing
 from zope.interface import implementer
-import inspect
 import os
-import shutil
+import re
+import stat
 import threading
+import types
+import uuid
+
+
+# Shared immutable empty containers. Bookkeeping containers of directories
+# are allocated on first modification.
+_NO_NAMES = frozenset()
+_NO_RENAMES = types.MappingProxyType(dict())
 
 
 def _encode_name(fs_encoding, name):
@@ -31,6 +89,774 @@ def _encode_name(fs_encoding, name):
     return name
 
 
+class _StatEntry(object):
+    """Minimal ``os.DirEntry`` like object wrapping a stat result."""
+
+    __slots__ = ('name', 'path', '_stat')
+
+    def __init__(self, name, path, stat_result):
+        self.name = name
+        self.path = path
+        self._stat = stat_result
+
+    def is_dir(self):
+        return stat.S_ISDIR(self._stat.st_mode)
+
+    def is_file(self):
+        return stat.S_ISREG(self._stat.st_mode)
+
+    def stat(self):
+        return self._stat
+
+
+_recovery_lock = threading.Lock()
+
+
+def _recover_transaction(directory):
+    """Finish transaction of transactional directory interrupted by a crash.
+    Done once before the file system gets accessed first.
+    """
+    if not directory.transactional or directory._fs_recovered:
+        return
+    with _recovery_lock:
+        if not directory._fs_recovered:
+            recover(join_fs_path(directory), directory.fs_backend)
+            directory._fs_recovered = True
+
+
+def _fs_listing(directory):
+    """Return cached listing of directory as dict containing ``os.DirEntry``
+    objects by name. Listing gets read with ``scandir`` of the file system
+    backend if not cached yet. Unless ``listing_cache`` is set, a cached
+    listing gets read again if the directory has been changed on file system.
+    """
+    listing = directory._fs_listing
+    signature = UNSET
+    if listing is not None and not directory.listing_cache:
+        signature = stat_signature(
+            directory.fs_backend,
+            join_fs_path(directory)
+        )
+        if signature != directory._fs_listing_signature:
+            listing = None
+    if listing is None:
+        _recover_transaction(directory)
+        listing = dict()
+        backend = directory.fs_backend
+        path = join_fs_path(directory)
+        # Stat before reading, thus the signature is outdated rather than
+        # the listing if the directory gets changed meanwhile
+        if signature is UNSET:
+            signature = stat_signature(backend, path)
+        directory._fs_listing_signature = signature
+        try:
+            with backend.scandir(path) as entries:
+                for entry in entries:
+                    listing[entry.name] = entry
+        except OSError:
+            pass
+        listing.pop(LOCK_NAME, None)
+        if JOURNAL_NAME in listing:
+            del listing[JOURNAL_NAME]
+            # Finish transaction interrupted before and read listing again
+            if directory.transactional and recover(path, backend):
+                return _fs_listing(directory)
+        directory._fs_listing = listing
+    return listing
+
+
+def _refresh_listing(directory):
+    """Drop listing cache of directory if the directory has been changed on
+    file system and evict unmodified children which no longer exist.
+    """
+    listing = directory._fs_listing
+    storage = directory.storage
+    if listing is None and not storage:
+        return
+    signature = stat_signature(directory.fs_backend, join_fs_path(directory))
+    if listing is not None and directory._fs_listing_signature == signature:
+        return
+    directory._fs_listing = None
+    if not storage:
+        return
+    listing = _fs_listing(directory)
+    for name, child in list(storage.items()):
+        entry = listing.get(get_fs_name(directory, name))
+        if entry is None or entry.is_dir() != IDirectory.providedBy(child):
+            evict_child(child)
+
+
+def _fs_entry(directory, fs_name):
+    """Lookup file system entry of directory child by file system name.
+
+    Consults the listing cache if present, otherwise or if the child is not
+    contained in the listing does a single ``stat`` call. Returns ``None`` if
+    child not exists.
+    """
+    if directory._fs_listing is not None:
+        entry = _fs_listing(directory).get(fs_name)
+        if entry is not None:
+            return entry
+    _recover_transaction(directory)
+    path = join_fs_path(directory, [fs_name])
+    try:
+        return _StatEntry(fs_name, path, directory.fs_backend.stat(path))
+    except OSError:
+        return None
+
+
+def loaded_child(directory, fs_name):
+    """Return child of directory by file system name if loaded, otherwise
+    ``None``. Children never get loaded from file system.
+    """
+    name = directory._renamed_fs_children.get(fs_name, fs_name)
+    return directory.storage.get(name)
+
+
+class WalkEntry(object):
+    """File system entry yielded by ``DirectoryStorage.walk``."""
+
+    __slots__ = ('path', 'names', 'type', 'node', '_entry')
+
+    def __init__(self, path, names, type_, entry, node=None):
+        self.path = path
+        self.names = names
+        self.type = type_
+        self.node = node
+        self._entry = entry
+
+    @property
+    def stat(self):
+        return self._entry.stat()
+
+    def __repr__(self):
+        return '<WalkEntry {} {}>'.format(self.type, self.path)
+
+
+def _match_patterns(patterns):
+    if patterns is None:
+        return None
+    return re.compile(
+        '|'.join(translate_pattern(pattern) for pattern in patterns)
+    ).match
+
+
+def _walk(
+    root,
+    path,
+    names,
+    directory,
+    template,
+    depth,
+    match,
+    materialize,
+    followlinks
+):
+    """Walk file system at path. ``directory`` is the loaded directory node
+    at path or ``None``. ``template`` is the directory node at path if
+    loaded, otherwise a node created by the factories of the parent but not
+    added to it, or ``None`` if no directory based on ``DirectoryStorage``
+    would be created. Ignores and factories are taken from the template, thus
+    walking yields the same entries whether directories are loaded or not.
+    """
+    if directory is not None:
+        listing = _fs_listing(directory)
+        renamed = directory._renamed_fs_children
+        deleted = directory._deleted_fs_children
+    else:
+        listing = dict()
+        try:
+            with root.fs_backend.scandir(path) as entries:
+                for entry in entries:
+                    listing[entry.name] = entry
+        except OSError:
+            pass
+        renamed = deleted = {}
+    ignores = template.ignores if template is not None else ()
+    matcher = None
+    for fs_name, entry in listing.items():
+        name = renamed.get(fs_name, fs_name)
+        if (
+            name in deleted
+            or name in ignores
+            or name in (JOURNAL_NAME, LOCK_NAME)
+        ):
+            continue
+        child_path = os.path.join(path, fs_name)
+        child_names = names + (name,)
+        child = directory.storage.get(name) if directory is not None else None
+        is_dir = entry.is_dir()
+        if match is None or match(name):
+            if materialize and child is None:
+                if directory is None:
+                    directory = root
+                    for directory_name in names:
+                        directory = directory[directory_name]
+                child = directory[name]
+            yield WalkEntry(
+                child_path,
+                child_names,
+                FS_DIRECTORY if is_dir else FS_FILE,
+                entry,
+                child
+            )
+        if not is_dir or (depth is not None and depth <= 1):
+            continue
+        if not followlinks and entry.is_symlink():
+            continue
+        if not IDirectory.providedBy(child):
+            child = None
+        if child is not None:
+            child_template = child
+        elif template is not None:
+            if matcher is None:
+                matcher = compile_factories(
+                    template.factories,
+                    template.pattern_weighting
+                )
+            child_template = _new_child(template, matcher, name, True)
+        else:
+            child_template = None
+        if (
+            child_template is not None
+            and not _is_directory_storage(child_template)
+        ):
+            child_template = None
+        for walk_entry in _walk(
+            root,
+            child_path,
+            child_names,
+            child,
+            child_template,
+            depth - 1 if depth is not None else None,
+            match,
+            materialize,
+            followlinks
+        ):
+            yield walk_entry
+
+
+# Whether classes are based on ``DirectoryStorage`` by class
+_directory_storage_classes = dict()
+
+
+def _is_directory_storage(node):
+    """Check whether node is a directory based on ``DirectoryStorage``. Such
+    directories get processed by the functions of this module directly.
+    """
+    class_ = node.__class__
+    try:
+        return _directory_storage_classes[class_]
+    except KeyError:
+        result = _directory_storage_classes[class_] = any(
+            DirectoryStorage in getattr(base, '__plumbing__', ())
+            for base in class_.__mro__
+        )
+        return result
+
+
+def _child_cache(directory):
+    """Return child cache of directory. If directory does not define a child
+    cache policy, the cache of the parent directory is used.
+    """
+    cache = directory._fs_child_cache
+    if cache is None:
+        policy = directory.child_cache
+        parent = directory.parent
+        if policy is None and IDirectory.providedBy(parent):
+            cache = _child_cache(parent)
+        else:
+            cache = create_child_cache(
+                CACHE_UNBOUNDED if policy is None else policy,
+                directory.child_cache_size
+            )
+        directory._fs_child_cache = cache
+    return cache
+
+
+def _persist_structure(directory):
+    """Create directory if not exists and apply pending deletes and renames
+    of children.
+    """
+    backend = directory.fs_backend
+    if IDirectory.providedBy(directory):
+        path = join_fs_path(directory)
+        try:
+            is_dir = stat.S_ISDIR(backend.stat(path).st_mode)
+        except OSError:
+            backend.mkdir(path)
+            is_dir = True
+        if not is_dir:
+            raise KeyError((
+                'Attempt to create directory with name '
+                '"{}" which already exists as file.'
+            ).format(directory.name))
+    while directory._deleted_fs_children:
+        name = directory._deleted_fs_children.pop()
+        path = join_fs_path(directory, [name])
+        if backend.exists(path):
+            if backend.isdir(path):
+                backend.rmtree(path)
+            else:
+                backend.remove(path)
+    directory._deleted_fs_children = _NO_NAMES
+    path = os.path.join(*directory.fs_path)
+    renames = [
+        (name, new_name)
+        for name, new_name in directory._renamed_fs_children.items()
+        if backend.exists(os.path.join(path, name))
+    ]
+    for name, new_name in _rename_steps(renames):
+        backend.rename(os.path.join(path, name), os.path.join(path, new_name))
+    _reset_structure(directory)
+
+
+def _rename_steps(renames):
+    """Return ``(name, new_name)`` tuples renaming children of a directory
+    in order. If a new name is the name of another renamed child, e.g. when
+    swapping names, all children get renamed to temporary names first.
+    """
+    if not {new_name for _, new_name in renames}.intersection(
+        name for name, _ in renames
+    ):
+        return renames
+    temporary = [
+        (name, '.node.ext.fs.rename.{}'.format(uuid.uuid4().hex))
+        for name, _ in renames
+    ]
+    return temporary + [
+        (temporary_name, new_name)
+        for (_, temporary_name), (_, new_name) in zip(temporary, renames)
+    ]
+
+
+def _reset_structure(directory):
+    """Reset pending deletes and renames of directory."""
+    directory._deleted_fs_children = _NO_NAMES
+    directory._renamed_fs_children = _NO_RENAMES
+    directory._renamed_fs_names = _NO_RENAMES
+
+
+def _flush_done(directory):
+    # Listing has changed, read it again on next access
+    directory._fs_listing = None
+
+
+def _flush_parallel(directory, workers, sync_directories, written):
+    """Persist directory and it's dirty descendants using a thread pool.
+
+    Directory creation, deletes and renames are done in the calling thread
+    top down, thus children are persisted after their parent directory is in
+    place. Dirty ``IFileNode`` children are written by worker threads as soon
+    as their directory has been processed. Subdirectories get processed by
+    this function directly, thus custom ``__call__`` extensions of
+    subdirectories and files providing ``IFileNode`` are not invoked. Other
+    ``IFile`` and ``IDirectory`` implementations are called in the calling
+    thread. File system modes of subdirectories are applied after all files
+    have been written. The first error occurred gets raised after pending
+    writes have been cancelled. Paths of written files get appended to
+    ``written``.
+    """
+    flushed = list()
+    # Locks of visited subdirectories get held until all files are written
+    locks = ExitStack()
+
+    def write_file(node):
+        with batch_directory_sync(sync_directories), track_writes(written):
+            persist_file(node)
+            if IFSMode.providedBy(node):
+                apply_fs_mode(node)
+
+    def visit(node, futures):
+        locks.enter_context(subtree_lock(node))
+        # Changes made from now on mark the directory dirty again
+        mark_clean(node)
+        children = list()
+        flushed.append((node, children))
+        _persist_structure(node)
+        for child in list(node.storage.values()):
+            if not is_dirty(child):
+                continue
+            # Subdirectories based on ``DirectoryStorage`` get processed
+            # directly
+            if _is_directory_storage(child):
+                visit(child, futures)
+            elif IFileNode.providedBy(child):
+                futures.append(executor.submit(write_file, child))
+            elif IDirectory.providedBy(child) or IFile.providedBy(child):
+                child()
+            else:
+                continue
+            children.append(child)
+
+    with locks:
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = list()
+                try:
+                    visit(directory, futures)
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+                wait(futures, return_when=FIRST_EXCEPTION)
+                for future in futures:
+                    if future.done() and future.exception() is not None:
+                        for pending in futures:
+                            pending.cancel()
+                        raise future.exception()
+        except BaseException:
+            for node, _ in flushed:
+                mark_dirty(node)
+            raise
+        # Apply modes bottom up. Mode of directory itself is applied by
+        # ``FSMode``
+        for node, children in reversed(flushed):
+            cache = _child_cache(node)
+            for child in children:
+                cache.flushed(child)
+            if node is not directory and IFSMode.providedBy(node):
+                apply_fs_mode(node)
+            _flush_done(node)
+
+
+class _Planner(object):
+    """Collect changes of a directory tree as ``Plan``.
+
+    Paths of operations are the paths valid at execution time. They get
+    built from the names of the nodes, as all renames planned before have
+    been applied at that time. Nodes added under a name which is renamed
+    away are ``vacated``, the file system entry currently at their path gets
+    moved before they get persisted.
+    """
+
+    def __init__(self, directory):
+        self.backend = directory.fs_backend
+        self.plan = Plan(self.backend)
+
+    def stat(self, current, vacated):
+        """Return stat result of file system entry at current path or
+        ``None`` if not exists or vacated.
+        """
+        if vacated:
+            return None
+        try:
+            return self.backend.stat(current)
+        except OSError:
+            return None
+
+    def collect(self, directory, path, vacated=False):
+        backend = self.backend
+        plan = self.plan
+        current = join_fs_path(directory)
+        stat_result = self.stat(current, vacated)
+        if stat_result is None:
+            plan.add(MKDIR, path, node=directory)
+        elif not stat.S_ISDIR(stat_result.st_mode):
+            raise KeyError((
+                'Attempt to create directory with name '
+                '"{}" which already exists as file.'
+            ).format(directory.name))
+        renamed = directory._renamed_fs_children
+        renamed_names = directory._renamed_fs_names
+        if not vacated:
+            for name in directory._deleted_fs_children:
+                child_stat = self.stat(join_fs_path(directory, [name]), False)
+                if child_stat is None:
+                    continue
+                plan.add(
+                    DELETE,
+                    os.path.join(path, name),
+                    is_dir=stat.S_ISDIR(child_stat.st_mode)
+                )
+            renames = [
+                (name, new_name)
+                for name, new_name in renamed.items()
+                if backend.exists(join_fs_path(directory, [name]))
+            ]
+            for name, new_name in _rename_steps(renames):
+                plan.add(
+                    RENAME,
+                    os.path.join(path, name),
+                    target=os.path.join(path, new_name)
+                )
+        children = list()
+        plan.directories.append((directory, children))
+        plan.states.append((directory, _plan_state(directory)))
+        for child in list(directory.storage.values()):
+            if not is_dirty(child):
+                continue
+            name = child.name
+            child_path = os.path.join(path, name)
+            # Entry at path of child gets renamed away before
+            child_vacated = vacated or (
+                name not in renamed_names and name in renamed
+            )
+            if _is_directory_storage(child):
+                self.collect(child, child_path, child_vacated)
+            elif IFileNode.providedBy(child):
+                self.collect_file(child, child_path, child_vacated)
+            elif IDirectory.providedBy(child) or IFile.providedBy(child):
+                plan.nodes.append(child)
+            else:
+                continue
+            children.append(child)
+        self.collect_mode(directory, path, stat_result)
+
+    def collect_file(self, node, path, vacated):
+        pending = data = getattr(node, '_data', UNSET)
+        stat_result = None
+        if (
+            data is UNSET
+            or node.skip_unchanged
+            or getattr(node, '_fs_mode_changed', False)
+        ):
+            stat_result = self.stat(join_fs_path(node), vacated)
+        size = None
+        verify = False
+        if data is not UNSET:
+            size = data_size(node, data)
+            # Contents get compared on execution if sizes match
+            verify = (
+                node.skip_unchanged
+                and size is not None
+                and stat_result is not None
+                and stat_result.st_size == size
+            )
+        elif stat_result is None:
+            data = node.data
+            size = data_size(node, data)
+        if data is not UNSET:
+            self.plan.add(
+                WRITE,
+                path,
+                node=node,
+                data=data,
+                size=size,
+                verify=verify
+            )
+        self.plan.files.append((node, pending))
+        self.plan.states.append((node, _plan_state(node)))
+        self.collect_mode(node, path, stat_result)
+
+    def collect_mode(self, node, path, stat_result):
+        if (
+            not IFSMode.providedBy(node)
+            or not getattr(node, '_fs_mode_changed', False)
+        ):
+            return
+        self.plan.modes.append(node)
+        fs_mode = node._fs_mode
+        if fs_mode is None:
+            return
+        old_mode = None
+        if stat_result is not None:
+            old_mode = stat_result.st_mode & 0o777
+        if getattr(node, 'skip_unchanged', False) and old_mode == fs_mode:
+            return
+        self.plan.add(
+            CHMOD,
+            path,
+            node=node,
+            mode=fs_mode,
+            old_mode=old_mode
+        )
+
+
+def _plan(directory):
+    """Return ``Plan`` persisting directory and it's dirty descendants."""
+    planner = _Planner(directory)
+    planner.collect(directory, join_fs_path(directory))
+    return planner.plan
+
+
+def _plan_state(node):
+    """Return state of planned node, which must not change until the plan
+    gets executed.
+    """
+    state = (
+        getattr(node, '_fs_mode_changed', False),
+        getattr(node, '_fs_mode', None)
+    )
+    if not _is_directory_storage(node):
+        return state
+    return state + (
+        frozenset(node._deleted_fs_children),
+        frozenset(node._renamed_fs_children.items()),
+        frozenset(
+            id(child) for child in node.storage.values() if is_dirty(child)
+        )
+    )
+
+
+def _check_plan(plan):
+    """Raise ``RuntimeError`` if planned nodes changed after planning."""
+    for node, pending in plan.files:
+        if getattr(node, '_data', UNSET) is not pending:
+            raise RuntimeError(
+                'Data of "{}" changed after planning.'.format(node.name)
+            )
+    for node, state in plan.states:
+        if _plan_state(node) != state:
+            raise RuntimeError(
+                '"{}" changed after planning.'.format(node.name)
+            )
+
+
+def _plan_done(plan):
+    """Update nodes after plan has been executed."""
+    # Paths of nodes resolve to their new location from now on
+    for directory, _ in plan.directories:
+        _reset_structure(directory)
+    for operation in plan:
+        if operation.kind == WRITE and operation.written:
+            record_write(operation.path)
+    for node, _ in plan.files:
+        node._data = UNSET
+        mark_clean(node)
+    for node in plan.modes:
+        node._fs_mode_changed = False
+    for node in plan.nodes:
+        node()
+    for directory, children in reversed(plan.directories):
+        cache = _child_cache(directory)
+        for child in children:
+            cache.flushed(child)
+        _flush_done(directory)
+
+
+def _drop_written_caches(plan):
+    # Memory maps get invalid when files get written
+    for operation in plan:
+        if operation.kind == WRITE:
+            drop_file_cache(operation.node)
+
+
+@contextmanager
+def _executing_plan(plan):
+    """Context manager for executing plan.
+
+    Directories of plan get locked top down and the plan gets checked.
+    Planned directories get marked clean before, thus changes made while
+    executing mark them dirty again. If executing fails, they get marked
+    dirty.
+    """
+    with ExitStack() as locks:
+        for directory, _ in plan.directories:
+            locks.enter_context(subtree_lock(directory))
+        _check_plan(plan)
+        for directory, _ in plan.directories:
+            mark_clean(directory)
+        try:
+            yield
+        except BaseException:
+            for directory, _ in plan.directories:
+                mark_dirty(directory)
+            raise
+
+
+def _apply_plan(plan):
+    """Execute plan without journal."""
+    with _executing_plan(plan):
+        _drop_written_caches(plan)
+        plan.apply()
+        _plan_done(plan)
+
+
+def _commit_plan(directory, plan):
+    """Execute plan as a single transaction.
+
+    New file contents get staged and the journal gets written first. Then
+    the operations get applied. If applying fails, the operations already
+    applied get reverted. Raises ``RuntimeError`` if an interrupted
+    transaction had to be recovered, as the plan is outdated then.
+    """
+    if recover(join_fs_path(directory), directory.fs_backend):
+        raise RuntimeError(
+            'Interrupted transaction recovered after planning.'
+        )
+    with _executing_plan(plan):
+        if not plan.operations:
+            _plan_done(plan)
+            return
+        backend = directory.fs_backend
+        path = join_fs_path(directory)
+        if not backend.exists(path):
+            backend.mkdir(path)
+        journal = Journal(path, backend)
+        journal.begin()
+        try:
+            for operation in plan:
+                _journal_operation(journal, operation, path)
+        except BaseException:
+            journal.close()
+            raise
+        if journal.operations:
+            journal.commit()
+            _drop_written_caches(plan)
+            journal.apply()
+            _sync_directories(backend, journal.operations)
+        journal.close()
+        _plan_done(plan)
+
+
+def _journal_operation(journal, operation, root):
+    """Add plan operation to journal. New file contents get staged."""
+    kind = operation.kind
+    path = operation.path
+    if kind == MKDIR:
+        # Directory committing the transaction has been created already
+        if path != root:
+            journal.add(MKDIR, path)
+    elif kind == DELETE:
+        journal.add(DELETE, path, journal.stage_path('trash'))
+    elif kind == RENAME:
+        journal.add(RENAME, path, operation.target)
+    elif kind == WRITE:
+        node = operation.node
+        data = operation.data
+        backend = journal.backend
+        # Renames are not applied yet, thus the node path is the current one
+        current = join_fs_path(node)
+        if operation.verify and unchanged_signature(node, data):
+            return
+        stage = journal.stage_path('stage')
+        with open_file(
+            stage,
+            'wb' if node.mode == MODE_BINARY else 'w',
+            backend
+        ) as f:
+            write_data(node, f, data)
+            backend.fsync(f)
+        # Preserve permissions of existing file
+        try:
+            fs_mode = stat.S_IMODE(backend.stat(current).st_mode)
+        except OSError:
+            pass
+        else:
+            backend.chmod(stage, fs_mode)
+        journal.add(WRITE, path, stage, journal.stage_path('backup'))
+        operation.written = True
+    elif kind == CHMOD:
+        journal.add(CHMOD, path, operation.mode, operation.old_mode)
+
+
+def _sync_directories(backend, operations):
+    """Sync directories containing entries changed by journal operations to
+    disk, each one once.
+    """
+    directories = set()
+    for operation in operations:
+        kind = operation[0]
+        if kind == RENAME:
+            directories.add(os.path.dirname(operation[1]))
+            directories.add(os.path.dirname(operation[2]))
+        elif kind != CHMOD:
+            directories.add(os.path.dirname(operation[1]))
+    for path in sorted(directories):
+        backend.fsync_directory(path)
+
+
 class DirectoryContext(threading.local):
     validate_child = True
 
@@ -48,11 +874,152 @@ def _skip_validate_child():
         _directory_context.validate_child = True
 
 
+def _new_child(directory, matcher, name, is_dir):
+    """Create child of directory without adding it to the directory.
+    ``matcher`` is the compiled factories of the directory.
+    """
+    pattern = matcher.pattern_for(name)
+    if pattern is not None:
+        child = matcher.factories[pattern](name=name, parent=directory)
+        matcher.created(pattern, child)
+        return child
+    factory = (
+        directory.default_directory_factory
+        if is_dir
+        else directory.default_file_factory
+    )
+    return factory(name=name, parent=directory)
+
+
+def _create_child(directory, matcher, name, entry):
+    """Create child of directory read from file system and add it to the
+    directory. ``matcher`` is the compiled factories of the directory.
+    Evicted children still referenced elsewhere get reused.
+    """
+    child = revive_child(directory, name)
+    if child is not None and IDirectory.providedBy(child) != entry.is_dir():
+        child = None
+    if child is None:
+        child = _new_child(directory, matcher, name, entry.is_dir())
+        # Child has been read from file system, thus it's in sync
+        mark_clean(child)
+    with _skip_validate_child():
+        directory[name] = child
+    return child
+
+
+def _load_children(directory, depth, files):
+    """Create nodes for all children of directory not loaded yet from a single
+    listing. Subdirectories get loaded recursively up to ``depth``. File
+    nodes without pending or cached data get appended to ``files`` if given.
+    """
+    listing = _fs_listing(directory)
+    storage = directory.storage
+    renamed = directory._renamed_fs_children
+    deleted = directory._deleted_fs_children
+    ignores = directory.ignores
+    matcher = compile_factories(
+        directory.factories,
+        directory.pattern_weighting
+    )
+    cache = _child_cache(directory)
+    for fs_name, entry in listing.items():
+        name = renamed.get(fs_name, fs_name)
+        if name in deleted or name in ignores:
+            continue
+        child = storage.get(name)
+        if child is None:
+            child = _create_child(directory, matcher, name, entry)
+            cache.loaded(child)
+        if IFileNode.providedBy(child):
+            if files is not None and _needs_content(child):
+                files.append(child)
+        elif (
+            _is_directory_storage(child)
+            and (depth is None or depth > 1)
+        ):
+            _load_children(
+                child,
+                depth - 1 if depth is not None else None,
+                files
+            )
+
+
+def _needs_content(node):
+    """Check whether data of file node is neither pending nor cached."""
+    return (
+        IFileNode.providedBy(node)
+        and getattr(node, '_data', UNSET) is UNSET
+        and cached_data(node) is UNSET
+    )
+
+
+def _prefetch_content(files, workers):
+    """Read data of file nodes into their content cache using a thread pool.
+    File nodes evicted by the child cache meanwhile get pinned, otherwise the
+    content read would be dropped together with the node.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(read_file_content, files):
+            pass
+    for node in files:
+        pin_child(node)
+
+
+def _persist_directory(directory):
+    """Persist directory and it's dirty descendants."""
+    if directory.transactional:
+        # Finish interrupted transaction before planning
+        recover(join_fs_path(directory), directory.fs_backend)
+        _commit_plan(directory, _plan(directory))
+        return
+    with batch_directory_sync() as sync_directories:
+        if directory.flush_workers:
+            with track_writes() as written:
+                _flush_parallel(
+                    directory,
+                    directory.flush_workers,
+                    sync_directories,
+                    written
+                )
+            return
+        # Changes made from now on mark the directory dirty again
+        mark_clean(directory)
+        try:
+            _persist_structure(directory)
+            # Only children with pending changes need to be persisted
+            cache = _child_cache(directory)
+            for value in list(directory.storage.values()):
+                if not is_dirty(value):
+                    continue
+                if IDirectory.providedBy(value) or IFile.providedBy(value):
+                    value()
+                    cache.flushed(value)
+        except BaseException:
+            mark_dirty(directory)
+            raise
+        _flush_done(directory)
+
+
 @implementer(IDirectory)
 class DirectoryStorage(DictStorage, WildcardFactory, FSLocation):
     fs_encoding = default('utf-8')
     default_file_factory = default(File)
     ignores = default(list())
+    child_cache = default(None)
+    child_cache_size = default(10000)
+    flush_workers = default(0)
+    prefetch_workers = default(4)
+    transactional = default(False)
+    listing_cache = default(False)
+    _fs_recovered = default(False)
+    _deleted_fs_children = default(_NO_NAMES)
+    # Mapping of file system names to new names and the reverse index
+    _renamed_fs_children = default(_NO_RENAMES)
+    _renamed_fs_names = default(_NO_RENAMES)
+    _fs_listing = default(None)
+    _fs_child_cache = default(None)
+    _fs_evicted_children = default(None)
 
     @default
     @property
@@ -66,17 +1033,44 @@ class DirectoryStorage(DictStorage, WildcardFactory, FSLocation):
         parent=None,
         fs_path=None,
         factories=None,
-        ignores=None
+        ignores=None,
+        child_cache=None,
+        child_cache_size=None,
+        flush_workers=None,
+        fs_backend=None,
+        transactional=None,
+        fs_locks=None,
+        listing_cache=None
     ):
         self.__name__ = name
         self.__parent__ = parent
-        self.fs_path = fs_path
+        if fs_path is not None:
+            self.fs_path = fs_path
         if factories is not None:
             self.factories = factories
         if ignores is not None:
             self.ignores = ignores
-        self._deleted_fs_children = list()
-        self._renamed_fs_children = dict()
+        if child_cache is not None:
+            self.child_cache = child_cache
+        if child_cache_size is not None:
+            self.child_cache_size = child_cache_size
+        if flush_workers is not None:
+            self.flush_workers = flush_workers
+        if fs_backend is not None:
+            self.fs_backend = fs_backend
+        if transactional is not None:
+            self.transactional = transactional
+        if fs_locks is not None:
+            self.fs_locks = fs_locks
+        if listing_cache is not None:
+            self.listing_cache = listing_cache
+
+    @default
+    def factory_for_pattern(self, name):
+        return compile_factories(
+            self.factories,
+            self.pattern_weighting
+        ).factory_for(name)
 
     @finalize
     def __getitem__(self, name):
@@ -84,21 +1078,24 @@ class DirectoryStorage(DictStorage, WildcardFactory, FSLocation):
         if name in self._deleted_fs_children:
             raise KeyError(name)
         try:
-            return self.storage[name]
+            child = self.storage[name]
         except KeyError:
-            filepath = join_fs_path(self, [name])
-            if not os.path.exists(filepath):
+            fs_name = get_fs_name(self, name)
+            # Name has been renamed to something else
+            if fs_name == name and name in self._renamed_fs_children:
                 raise KeyError(name)
-            factory = self.factory_for_pattern(name)
-            if not factory:
-                factory = (
-                    self.default_directory_factory
-                    if os.path.isdir(filepath)
-                    else self.default_file_factory
-                )
-            with _skip_validate_child():
-                self[name] = factory(name=name, parent=self)
-        return self.storage[name]
+            entry = _fs_entry(self, fs_name)
+            if entry is None:
+                raise KeyError(name)
+            matcher = compile_factories(
+                self.factories,
+                self.pattern_weighting
+            )
+            child = _create_child(self, matcher, name, entry)
+            _child_cache(self).loaded(child)
+            return child
+        _child_cache(self).accessed(child)
+        return child
 
     @finalize
     def __setitem__(self, name, value):
@@ -113,78 +1110,83 @@ class DirectoryStorage(DictStorage, WildcardFactory, FSLocation):
                     'Incompatible child node. ``IDirectory`` or ``IFile`` '
                     'must be implemented.'
                 )
-            factory = self.factory_for_pattern(name)
-            if factory:
-                if not inspect.isclass(factory):
-                    class_ = factory(name=name, parent=self).__class__
-                else:
-                    class_ = factory
+            class_ = compile_factories(
+                self.factories,
+                self.pattern_weighting
+            ).class_for(name, self)
+            if class_ is not None:
                 if not isinstance(value, class_):
                     raise ValueError((
                         'Given child node has wrong type. Expected ``{}``, '
                         'got ``{}``'
                     ).format(class_, type(value)))
+            # Descendants of a moved subtree may have cached values acquired
+            # from former ancestors
+            if getattr(value, 'storage', None):
+                invalidate_acquired()
+            with mutation_lock(self):
+                # Former evicted child must not be reused
+                forget_child(self, name)
+                # Child gets added from outside, thus it needs to be persisted
+                mark_dirty(value)
+                if name in self._deleted_fs_children:
+                    self._deleted_fs_children.discard(name)
+                self.storage[name] = value
+            return
         if name in self._deleted_fs_children:
-            self._deleted_fs_children.remove(name)
+            self._deleted_fs_children.discard(name)
         self.storage[name] = value
 
     @finalize
+    def __contains__(self, name):
+        name = _encode_name(self.fs_encoding, name)
+        if name in self._deleted_fs_children or name in self.ignores:
+            return False
+        if name in self.storage:
+            return True
+        fs_name = get_fs_name(self, name)
+        if fs_name == name and name in self._renamed_fs_children:
+            return False
+        return _fs_entry(self, fs_name) is not None
+
+    @finalize
+    @lockmutation
     def __delitem__(self, name):
         name = _encode_name(self.fs_encoding, name)
         if name in self.ignores:
             raise KeyError('Name is contained in ignores')
         fs_name = get_fs_name(self, name)
-        if name in self._renamed_fs_children.values():
+        if name in self._renamed_fs_names:
+            del self._renamed_fs_names[name]
             del self._renamed_fs_children[fs_name]
-        if os.path.exists(join_fs_path(self, [fs_name])):
-            self._deleted_fs_children.append(fs_name)
+        if _fs_entry(self, fs_name) is not None:
+            if self._deleted_fs_children is _NO_NAMES:
+                self._deleted_fs_children = set()
+            self._deleted_fs_children.add(fs_name)
         if name in self.storage:
             del self.storage[name]
+        forget_child(self, name)
+        mark_dirty(self)
 
     @finalize
     def __iter__(self):
-        try:
-            existing = set(os.listdir(join_fs_path(self)))
-        except OSError:
-            existing = set()
+        existing = set(_fs_listing(self))
         existing.update(self.storage)
         return iter(existing
             .difference(self._deleted_fs_children)
             .difference(self.ignores)
             .difference(self._renamed_fs_children)
-            .union(self._renamed_fs_children.values())
+            .union(self._renamed_fs_names)
         )
 
     @finalize
-    @locktree
+    @locksubtree
     def __call__(self):
-        if IDirectory.providedBy(self):
-            path = join_fs_path(self)
-            if not os.path.exists(path):
-                os.mkdir(path)
-            elif not os.path.isdir(path):
-                raise KeyError((
-                    'Attempt to create directory with name '
-                    '"{}" which already exists as file.'
-                ).format(self.name))
-        while self._deleted_fs_children:
-            path = join_fs_path(self, [self._deleted_fs_children.pop()])
-            if os.path.exists(path):
-                if os.path.isdir(path):
-                    shutil.rmtree(path)
-                else:
-                    os.remove(path)
-        for name, new_name in self._renamed_fs_children.items():
-            src = os.path.join(*self.fs_path + [name])
-            if os.path.exists(src):
-                dst = os.path.join(os.path.dirname(src), new_name)
-                os.rename(src, dst)
-        self._renamed_fs_children = dict()
-        for value in self.values():
-            if IDirectory.providedBy(value) or IFile.providedBy(value):
-                value()
+        with file_lock(self):
+            _persist_directory(self)
 
     @default
+    @lockmutation
     def rename(self, name, new_name):
         name = _encode_name(self.fs_encoding, name)
         new_name = _encode_name(self.fs_encoding, new_name)
@@ -196,6 +1198,11 @@ class DirectoryStorage(DictStorage, WildcardFactory, FSLocation):
             raise KeyError('File or directory with new name already exists')
         if new_name in self.ignores:
             raise KeyError('New name is contained in ignores')
+        forget_child(self, new_name)
+        # Evicted child still referenced elsewhere gets renamed as well
+        child = revive_child(self, name)
+        if child is not None and name not in self.storage:
+            self.storage[name] = child
         if name in self.storage:
             child = self[name]
             child.__name__ = new_name
@@ -203,13 +1210,85 @@ class DirectoryStorage(DictStorage, WildcardFactory, FSLocation):
                 self[new_name] = child
             del self.storage[name]
         fs_name = get_fs_name(self, name)
-        self._renamed_fs_children[fs_name] = new_name
+        if self._renamed_fs_children is _NO_RENAMES:
+            self._renamed_fs_children = dict()
+            self._renamed_fs_names = dict()
+        self._renamed_fs_names.pop(name, None)
+        if fs_name == new_name:
+            # Renamed back to the name on file system
+            del self._renamed_fs_children[fs_name]
+        else:
+            self._renamed_fs_children[fs_name] = new_name
+            self._renamed_fs_names[new_name] = fs_name
+        mark_dirty(self)
+
+    @default
+    def walk(
+        self,
+        depth=None,
+        patterns=None,
+        materialize=False,
+        followlinks=False
+    ):
+        return _walk(
+            self,
+            join_fs_path(self),
+            (),
+            self,
+            self,
+            depth,
+            _match_patterns(patterns),
+            materialize,
+            followlinks
+        )
+
+    @default
+    def plan(self):
+        return _plan(self)
+
+    @default
+    @locksubtree
+    def apply_plan(self, plan):
+        with file_lock(self):
+            if self.transactional:
+                _commit_plan(self, plan)
+            else:
+                _apply_plan(plan)
+
+    @default
+    def load(self, depth=1, data=False, workers=None):
+        files = list() if data else None
+        _load_children(self, depth, files)
+        if files:
+            _prefetch_content(files, workers or self.prefetch_workers)
+
+    @default
+    def prefetch_data(self, patterns=None, depth=None, workers=None):
+        files = [
+            entry.node for entry in self.walk(
+                depth=depth,
+                patterns=patterns,
+                materialize=True
+            )
+            if entry.type == FS_FILE and _needs_content(entry.node)
+        ]
+        if files:
+            _prefetch_content(files, workers or self.prefetch_workers)
+
+    @default
+    def refresh(self):
+        _refresh_listing(self)
+        for child in list(self.storage.values()):
+            refresh = getattr(child, 'refresh', None)
+            if refresh is not None:
+                refresh()
 
 
 @plumbing(
     MappingAdopt,
     MappingNode,
     FSMode,
-    DirectoryStorage)
+    DirectoryStorage,
+    AsyncDirectory)
 class Directory(object):
     """Object mapping a file system directory."""
@@ -0,0 +1,38 @@
+from node.ext.fs.interfaces import IDirectory
+
+
+def is_dirty(node):
+    """Check whether node contains changes not written to file system yet.
+
+    Nodes without dirty information are considered dirty.
+    """
+    return getattr(node, '_fs_dirty', True)
+
+
+def mark_dirty(node):
+    """Mark node and it's ancestors dirty.
+
+    A dirty ancestor implies all further ancestors being dirty as well, thus
+    propagation stops there. Nodes which have been evicted from their parent
+    storage get put back, so the changes get persisted. A node never replaces
+    another node of the same name in parent storage.
+    """
+    while True:
+        node._fs_dirty = True
+        parent = getattr(node, 'parent', None)
+        if parent is None or not IDirectory.providedBy(parent):
+            break
+        if getattr(node, '_fs_evicted', False):
+            node._fs_evicted = False
+            storage = parent.storage
+            if storage.setdefault(node.name, node) is not node:
+                # Node has been replaced meanwhile
+                break
+        if is_dirty(parent):
+            break
+        node = parent
+
+
+def mark_clean(node):
+    """Mark node as in sync with file system."""
+    node._fs_dirty = False
@@ -0,0 +1,254 @@
+from functools import lru_cache
+import fnmatch
+import inspect
+import re
+
+
+_WILDCARD_CHARS = frozenset('*?[')
+_PATTERN_TYPE = type(re.compile(''))
+_REGEX_FLAGS = (
+    ('i', re.IGNORECASE),
+    ('m', re.MULTILINE),
+    ('s', re.DOTALL),
+    ('x', re.VERBOSE)
+)
+
+
+def translate_pattern(pattern):
+    """Translate child factory pattern to regular expression.
+
+    Patterns are either ``fnmatch`` style wildcard patterns or compiled
+    regular expressions, which must match the whole name.
+    """
+    if isinstance(pattern, _PATTERN_TYPE):
+        flags = ''.join(
+            char for char, flag in _REGEX_FLAGS if pattern.flags & flag
+        )
+        return '(?{}:{})\\Z'.format(flags, pattern.pattern)
+    return fnmatch.translate(pattern)
+
+
+def _pattern_weight(pattern):
+    """Return sort key of wildcard pattern, ordering patterns the same way as
+    ``node.behaviors.WildcardFactory`` does with ``pattern_weighting``.
+
+    Patterns without wildcards rank first, followed by patterns with
+    sequences only, patterns with sequences and question marks and patterns
+    containing asterisks. Within these groups, patterns with more characters
+    rank first. A sequence counts as one character.
+    """
+    chars = asterisks = question_marks = sequences = 0
+    in_sequence = 0
+    for char in pattern:
+        if not in_sequence and char == '[':
+            in_sequence += 1
+            continue
+        if in_sequence:
+            if in_sequence < 2 or char != ']':
+                in_sequence += 1
+                continue
+            in_sequence = 0
+            sequences += 1
+        if char == '*':
+            asterisks += 1
+        elif char == '?':
+            question_marks += 1
+        chars += 1
+    if in_sequence:
+        raise ValueError('Pattern contains non-closing sequence')
+    if asterisks:
+        group = 3
+    elif question_marks:
+        group = 2
+    elif sequences:
+        group = 1
+    else:
+        group = 0
+    return (
+        group,
+        0 - chars
+        + sequences / 1000000.
+        + question_marks / 10000.
+        + asterisks / 100.
+    )
+
+
+def _patterns_by_specificity(patterns):
+    return sorted(patterns, key=_pattern_weight)
+
+
+def _pattern_kind(pattern):
+    """Return ``'exact'`` for names without wildcards, ``'suffix'`` for
+    patterns like ``*.txt`` and ``'regex'`` for all other patterns.
+    """
+    if isinstance(pattern, _PATTERN_TYPE):
+        return 'regex'
+    if not _WILDCARD_CHARS.intersection(pattern):
+        return 'exact'
+    if (
+        pattern.startswith('*')
+        and not _WILDCARD_CHARS.intersection(pattern[1:])
+    ):
+        return 'suffix'
+    return 'regex'
+
+
+class FactoryMatcher(object):
+    """Compiled child factory patterns.
+
+    Patterns are split into consecutive runs of the same kind in match order.
+    Runs of exact names and suffix patterns get resolved by dictionary
+    lookups, all other runs by a single combined regular expression.
+    """
+
+    def __init__(self, factories, pattern_weighting=True):
+        self.factories = factories
+        self.classes = dict()
+        wildcards = [p for p in factories if not isinstance(p, _PATTERN_TYPE)]
+        regexes = [p for p in factories if isinstance(p, _PATTERN_TYPE)]
+        if pattern_weighting:
+            wildcards = _patterns_by_specificity(wildcards)
+            # Exact names rank first, regular expressions before wildcards
+            index = len([
+                pattern for pattern in wildcards
+                if _pattern_kind(pattern) == 'exact'
+            ])
+            patterns = wildcards[:index] + regexes + wildcards[index:]
+        else:
+            patterns = list(factories)
+        segments = list()
+        for pattern in patterns:
+            kind = _pattern_kind(pattern)
+            if not segments or segments[-1][0] != kind:
+                segments.append((kind, list()))
+            segments[-1][1].append(pattern)
+        self.segments = [
+            getattr(self, '_compile_{}'.format(kind))(patterns)
+            for kind, patterns in segments
+        ]
+
+    def _compile_exact(self, patterns):
+        table = dict()
+        for pattern in patterns:
+            table.setdefault(pattern, pattern)
+        return table.get
+
+    def _compile_suffix(self, patterns):
+        tables = dict()
+        for index, pattern in enumerate(patterns):
+            table = tables.setdefault(len(pattern) - 1, dict())
+            table.setdefault(pattern[1:], (index, pattern))
+        tables = sorted(tables.items())
+
+        def match(name):
+            # Several suffixes may match, the first one in match order wins
+            found = None
+            for length, table in tables:
+                if length > len(name):
+                    break
+                candidate = table.get(name[len(name) - length:])
+                if candidate is not None and (
+                    found is None or candidate[0] < found[0]
+                ):
+                    found = candidate
+            if found is not None:
+                return found[1]
+        return match
+
+    def _compile_regex(self, patterns):
+        groups = dict()
+        expression = re.compile('|'.join(
+            '(?P<p{}>{})'.format(index, translate_pattern(pattern))
+            for index, pattern in enumerate(patterns)
+        ))
+        for index, pattern in enumerate(patterns):
+            groups['p{}'.format(index)] = pattern
+
+        def match(name):
+            result = expression.match(name)
+            if result is not None:
+                return groups[result.lastgroup]
+        return match
+
+    def pattern_for(self, name):
+        """Return first pattern matching name or ``None``."""
+        for match in self.segments:
+            pattern = match(name)
+            if pattern is not None:
+                return pattern
+
+    def factory_for(self, name):
+        """Return factory for name or ``None``."""
+        pattern = self.pattern_for(name)
+        if pattern is not None:
+            return self.factories[pattern]
+
+    def class_for(self, name, parent):
+        """Return class of children created for name or ``None``.
+
+        Factories which are no classes get called once per pattern to
+        determine the class, unless it already has been recorded by
+        ``created``.
+        """
+        pattern = self.pattern_for(name)
+        if pattern is None:
+            return None
+        try:
+            return self.classes[pattern]
+        except KeyError:
+            factory = self.factories[pattern]
+            if inspect.isclass(factory):
+                class_ = factory
+            else:
+                class_ = factory(name=name, parent=parent).__class__
+            self.classes[pattern] = class_
+            return class_
+
+    def created(self, pattern, child):
+        """Record class of child created by factory for pattern."""
+        self.classes.setdefault(pattern, child.__class__)
+
+
+@lru_cache(maxsize=128)
+def _cached_matcher(items, pattern_weighting):
+    return FactoryMatcher(dict(items), pattern_weighting)
+
+
+# Matchers by identifier of factories and pattern weighting flag. Entries
+# keep a reference to the factories, thus identifiers are not reused while
+# cached, and the keys and values the matcher has been compiled from.
+_matchers = dict()
+_MATCHERS_SIZE = 128
+
+
+def compile_factories(factories, pattern_weighting=True):
+    """Return ``FactoryMatcher`` for factories.
+
+    Matchers are cached by the factories object and are valid as long as
+    its items are unchanged, thus changing factories in place as well as
+    reassigning them is considered. Validating the cached matcher only
+    compares keys and values, patterns are not compiled again. Matchers are shared
+    between equal factories.
+    """
+    key = (id(factories), pattern_weighting)
+    # Comparing keys and values separately avoids creating item tuples
+    keys = tuple(factories)
+    values = tuple(factories.values())
+    cached = _matchers.get(key)
+    if (
+        cached is not None
+        and cached[0] is factories
+        and cached[1] == keys
+        and cached[2] == values
+    ):
+        return cached[3]
+    items = tuple(zip(keys, values))
+    try:
+        matcher = _cached_matcher(items, pattern_weighting)
+    except TypeError:
+        # unhashable factories
+        matcher = FactoryMatcher(dict(items), pattern_weighting)
+    if len(_matchers) >= _MATCHERS_SIZE:
+        _matchers.clear()
+    _matchers[key] = (factories, keys, values, matcher)
+    return matcher
@@ -1,79 +1,500 @@
 from contextlib import contextmanager
 from node.behaviors import DefaultInit
 from node.behaviors import Node
+from node.ext.fs.aio import AsyncFileNode
+from node.ext.fs.backend import os_backend
+from node.ext.fs.cache import fs_signature
+from node.ext.fs.cache import stat_signature
+from node.ext.fs.dirty import mark_clean
+from node.ext.fs.dirty import mark_dirty
 from node.ext.fs.interfaces import IFileIO
 from node.ext.fs.interfaces import IFileNode
 from node.ext.fs.interfaces import MODE_BINARY
 from node.ext.fs.interfaces import MODE_TEXT
 from node.ext.fs.location import FSLocation
 from node.ext.fs.location import join_fs_path
+from node.ext.fs.locking import file_lock
+from node.ext.fs.locking import locksubtree
+from node.ext.fs.locking import mutation_lock
 from node.ext.fs.mode import FSMode
-from node.locking import locktree
 from node.utils import UNSET
 from plumber import default
 from plumber import finalize
 from plumber import plumbing
 from zope.interface import implementer
+import locale
 import os
+import shutil
+import stat
+import threading
+import uuid
 
 
 @contextmanager
-def open_file(path, mode):
-    fd = open(path, mode)
+def open_file(path, mode, backend=os_backend):
+    fd = backend.open(path, mode)
     try:
         yield fd
     finally:
         fd.close()
 
 
+@contextmanager
+def open_atomic_file(path, mode, backend=os_backend):
+    """Open temporary file in the directory of path for writing, which
+    gets synced to disk and replaces the file at path with ``os.replace`` on
+    successful close. This way the file at path either contains the old or
+    the new contents after a crash.
+
+    Permissions of an existing file are preserved.
+    """
+    dirname, basename = os.path.split(path)
+    tmp_path = os.path.join(
+        dirname,
+        '.{}.{}.tmp'.format(basename, uuid.uuid4().hex)
+    )
+    f = backend.open(tmp_path, mode.replace('w', 'x'))
+    try:
+        try:
+            fs_mode = stat.S_IMODE(backend.stat(path).st_mode)
+        except OSError:
+            pass
+        else:
+            backend.chmod(tmp_path, fs_mode)
+        yield f
+    except BaseException:
+        f.close()
+        backend.remove(tmp_path)
+        raise
+    try:
+        backend.fsync(f)
+    finally:
+        f.close()
+    backend.replace(tmp_path, path)
+
+
+class SyncContext(threading.local):
+    directories = None
+
+
+_sync_context = SyncContext()
+
+
+def sync_directory(path, backend=os_backend):
+    """Sync directory at path to disk. If called inside
+    ``batch_directory_sync``, syncing is deferred until the batch ends.
+    """
+    directories = _sync_context.directories
+    if directories is not None:
+        directories.add((backend, path))
+        return
+    backend.fsync_directory(path)
+
+
+@contextmanager
+def batch_directory_sync(directories=None):
+    """Context manager for syncing each directory only once on exit no matter
+    how many files were written to it. Nested usage joins the outer batch.
+
+    Yields the set of ``(backend, path)`` tuples to be synced. If
+    ``directories`` is given, directories get collected in this set and
+    syncing is left to the caller. This way worker threads can join the batch
+    of another thread.
+    """
+    if directories is not None:
+        _sync_context.directories = directories
+        try:
+            yield directories
+        finally:
+            _sync_context.directories = None
+        return
+    if _sync_context.directories is not None:
+        yield _sync_context.directories
+        return
+    _sync_context.directories = directories = set()
+    try:
+        yield directories
+    finally:
+        _sync_context.directories = None
+    for backend, path in directories:
+        backend.fsync_directory(path)
+
+
+class WriteContext(threading.local):
+    written = None
+
+
+_write_context = WriteContext()
+
+
+def record_write(path):
+    """Record path of written file if inside ``track_writes``."""
+    written = _write_context.written
+    if written is not None:
+        written.append(path)
+
+
+@contextmanager
+def track_writes(written=None):
+    """Context manager for recording file system paths of files written by
+    ``__call__``. Files skipped due to ``skip_unchanged`` are not recorded.
+    Nested usage joins the outer context.
+
+    Yields the list of written paths. If ``written`` is given, paths get
+    appended to this list. This way worker threads can join the context of
+    another thread.
+    """
+    outer = _write_context.written
+    if written is None:
+        written = outer if outer is not None else list()
+    _write_context.written = written
+    try:
+        yield written
+    finally:
+        _write_context.written = outer
+
+
+def _is_stream(data):
+    """Check whether data is a file like object or an iterable of chunks."""
+    if isinstance(data, (str, bytes, bytearray, memoryview)):
+        return False
+    return hasattr(data, 'read') or hasattr(data, '__iter__')
+
+
+def _read_stream(stream, empty):
+    """Read all data from file like object or iterable of chunks."""
+    if hasattr(stream, 'read'):
+        return stream.read()
+    return empty.join(stream)
+
+
+def _release_mmap(node):
+    """Close memory maps of file node if present.
+
+    If memoryviews of a mapping are still exported, the mapping cannot be
+    closed. It is kept as exported mapping and closing is retried on next
+    call. Returns whether exported mappings are left. In this case the file
+    must not be written in place, which would change the contents of the
+    views or make accessing them fault if the file gets truncated.
+    """
+    mapped = getattr(node, '_mmap', None)
+    exported = getattr(node, '_fs_exported_mmaps', None)
+    if mapped is None and not exported:
+        return False
+    node._mmap = None
+    left = list()
+    for mapping in (exported or ()) + (
+        (mapped,) if mapped is not None else ()
+    ):
+        try:
+            mapping.close()
+        except BufferError:
+            left.append(mapping)
+    node._fs_exported_mmaps = tuple(left) if left else None
+    return bool(left)
+
+
+@contextmanager
+def open_write_file(node, path=None):
+    """Open file of node for writing. ``path`` defaults to the path of node.
+
+    If memory maps of the file are still in use, the file gets replaced like
+    with ``atomic_write`` instead of getting written in place. Otherwise
+    ``write_fd`` of node is used if writing to the path of node.
+    """
+    backend = node.fs_backend
+    mode = 'wb' if node.mode == MODE_BINARY else 'w'
+    exported = _release_mmap(node)
+    if path is None and not exported:
+        with node.write_fd as f:
+            yield f
+        return
+    path = path if path is not None else join_fs_path(node)
+    if not node.atomic_write and not exported:
+        with open_file(path, mode, backend) as f:
+            yield f
+        return
+    with open_atomic_file(path, mode, backend) as f:
+        yield f
+    # Exported memory maps refer to the replaced file
+    node._fs_exported_mmaps = None
+    if not node.atomic_write and node.direct_sync:
+        sync_directory(os.path.dirname(path), backend)
+
+
+def drop_file_cache(node):
+    """Drop cached content and memory map of file node."""
+    node._fs_content = None
+    _release_mmap(node)
+
+
+def cached_data(node):
+    """Return data from content cache of file node or ``UNSET``."""
+    content = getattr(node, '_fs_content', None)
+    if content is None or content[1] != node.mode:
+        return UNSET
+    return content[2]
+
+
+def read_file_content(node):
+    """Read data of file node from file system into it's content cache.
+
+    Returns the data read. Non existing files result in empty data.
+    """
+    data = b'' if node.mode == MODE_BINARY else ''
+    # Stat before reading, thus the signature is outdated rather than the
+    # content if the file gets changed meanwhile
+    signature = stat_signature(node.fs_backend, join_fs_path(node))
+    if signature is not None:
+        with node.read_fd as f:
+            data = f.read()
+    node._fs_content = (signature, node.mode, data)
+    return data
+
+
+def _encode_data(node, data):
+    """Return data as written to file system by file node."""
+    if node.mode == MODE_BINARY:
+        return data
+    if os.linesep != '\n':
+        data = data.replace('\n', os.linesep)
+    return data.encode(locale.getpreferredencoding(False))
+
+
+def data_size(node, data):
+    """Return number of bytes data of file node occupies on file system or
+    ``None`` for streams.
+    """
+    if _is_stream(data):
+        return None
+    if node.mode != MODE_BINARY and data.isascii() and os.linesep == '\n':
+        return len(data)
+    return memoryview(_encode_data(node, data)).nbytes
+
+
+def unchanged_signature(node, data, path=None):
+    """Compare data with contents of file node on file system.
+
+    Returns the stat signature of the file if contents are equal, otherwise
+    ``None``. Sizes are compared first, contents only get read if sizes
+    match. Cached contents with a valid signature are compared directly.
+    ``path`` defaults to the file system path of node.
+    """
+    if _is_stream(data):
+        return None
+    backend = node.fs_backend
+    path = join_fs_path(node) if path is None else path
+    try:
+        stat_result = backend.stat(path)
+    except OSError:
+        return None
+    signature = fs_signature(stat_result)
+    content = getattr(node, '_fs_content', None)
+    if (
+        content is not None
+        and content[0] == signature
+        and content[1] == node.mode
+    ):
+        return signature if content[2] == data else None
+    expected = memoryview(_encode_data(node, data)).cast('B')
+    size = len(expected)
+    if stat_result.st_size != size:
+        return None
+    with open_file(path, 'rb', backend) as f:
+        offset = 0
+        while offset < size:
+            chunk = f.read(node.chunk_size)
+            if not chunk or expected[offset:offset + len(chunk)] != chunk:
+                return None
+            offset += len(chunk)
+    return signature
+
+
+def _iter_split_lines(data):
+    if not data:
+        return
+    for line in data.split('\n'):
+        yield line
+
+
+def _iter_file_lines(node):
+    """Lazily iterate lines of file without trailing newline characters.
+
+    Result is equivalent to ``data.split('\\n')``.
+    """
+    if not node.fs_backend.exists(join_fs_path(node)):
+        return
+    with node.read_fd as f:
+        line = None
+        for line in f:
+            yield line[:-1] if line.endswith('\n') else line
+        # Trailing newline results in trailing empty line
+        if line is not None and line.endswith('\n'):
+            yield ''
+
+
+def write_data(node, f, data):
+    """Write data of file node to file like object. Data is either string,
+    bytes, a file like object or an iterable of chunks.
+    """
+    if hasattr(data, 'read'):
+        shutil.copyfileobj(data, f, node.chunk_size)
+    elif _is_stream(data):
+        for chunk in data:
+            f.write(chunk)
+    else:
+        f.write(data)
+
+
+def persist_file(node):
+    """Write file node to file system if it's data has changed or the file not
+    exists yet.
+    """
+    path = join_fs_path(node)
+    backend = node.fs_backend
+    data = getattr(node, '_data', UNSET)
+    if data is not UNSET and node.skip_unchanged:
+        signature = unchanged_signature(node, data)
+        if signature is not None:
+            node._data = UNSET
+            if node.content_cache:
+                node._fs_content = (signature, node.mode, data)
+            mark_clean(node)
+            return
+    if data is not UNSET or not backend.exists(path):
+        if data is UNSET:
+            # Read before opening, otherwise the created file gets read
+            data = node.data
+        # Memory map gets invalid when file gets written
+        with open_write_file(node) as f:
+            write_data(node, f, data)
+            # Atomic writes always get synced before replacing the file
+            if node.direct_sync and not node.atomic_write:
+                backend.fsync(f)
+        node._data = UNSET
+        record_write(path)
+        if node.content_cache and not _is_stream(data):
+            node._fs_content = (stat_signature(backend, path), node.mode, data)
+        else:
+            node._fs_content = None
+        # Atomic writes replace the directory entry, which needs to be synced
+        # as well to be durable
+        if node.atomic_write and node.direct_sync:
+            sync_directory(os.path.dirname(path), backend)
+    mark_clean(node)
+
+
 @implementer(IFileIO)
 class FileIO(FSLocation):
     mode = default(MODE_TEXT)
+    atomic_write = default(False)
 
     @default
     @property
     def read_fd(self):
         return open_file(
             join_fs_path(self),
-            'rb' if self.mode == MODE_BINARY else 'r'
+            'rb' if self.mode == MODE_BINARY else 'r',
+            self.fs_backend
         )
 
     @default
     @property
     def write_fd(self):
-        return open_file(
+        return (open_atomic_file if self.atomic_write else open_file)(
             join_fs_path(self),
-            'wb' if self.mode == MODE_BINARY else 'w'
+            'wb' if self.mode == MODE_BINARY else 'w',
+            self.fs_backend
         )
 
 
 @implementer(IFileNode)
 class FileNode(Node, FileIO):
     direct_sync = default(False)
+    chunk_size = default(65536)
+    content_cache = default(False)
+    skip_unchanged = default(False)
 
     @property
     def data(self):
         data = getattr(self, '_data', UNSET)
         if data is UNSET:
+            data = cached_data(self)
+            if data is not UNSET:
+                return data
+            if self.content_cache:
+                return read_file_content(self)
             data = b'' if self.mode == MODE_BINARY else ''
-            if os.path.exists(join_fs_path(self)):
+            if self.fs_backend.exists(join_fs_path(self)):
                 with self.read_fd as f:
                     data = f.read()
+        elif _is_stream(data):
+            # Pending stream gets consumed, keep result as pending data
+            empty = b'' if self.mode == MODE_BINARY else ''
+            data = self._data = _read_stream(data, empty)
         return data
 
     @default
     @data.setter
     def data(self, data):
-        self._data = data
+        with mutation_lock(self):
+            self._data = data
+            mark_dirty(self)
+
+    @default
+    def iter_data(self, size=None):
+        size = size if size is not None else self.chunk_size
+        data = getattr(self, '_data', UNSET)
+        if data is not UNSET or cached_data(self) is not UNSET:
+            data = self.data
+            for i in range(0, len(data), size):
+                yield data[i:i + size]
+            return
+        if not self.fs_backend.exists(join_fs_path(self)):
+            return
+        with self.read_fd as f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                yield chunk
+
+    @default
+    @property
+    def buffer(self):
+        if self.mode != MODE_BINARY:
+            raise RuntimeError('Cannot map text file.')
+        if getattr(self, '_data', UNSET) is not UNSET:
+            return memoryview(self.data)
+        data = cached_data(self)
+        if data is not UNSET:
+            return memoryview(data)
+        mapped = getattr(self, '_mmap', None)
+        if mapped is None:
+            path = join_fs_path(self)
+            backend = self.fs_backend
+            signature = stat_signature(backend, path)
+            if signature is None:
+                return memoryview(b'')
+            mapped = backend.mmap(path)
+            # Empty files cannot be mapped
+            if mapped is None:
+                return memoryview(b'')
+            self._mmap = mapped
+            self._fs_mmap_signature = signature
+        return memoryview(mapped)
 
     @property
     def lines(self):
         if self.mode == MODE_BINARY:
             raise RuntimeError('Cannot read lines from binary file.')
-        data = self.data
-        if not data:
-            return []
-        return data.split('\n')
+        if (
+            self.content_cache
+            or getattr(self, '_data', UNSET) is not UNSET
+            or cached_data(self) is not UNSET
+        ):
+            return _iter_split_lines(self.data)
+        return _iter_file_lines(self)
 
     @default
     @lines.setter
@@ -82,23 +503,29 @@ class FileNode(Node, FileIO):
             raise RuntimeError('Cannot write lines to binary file.')
         self.data = '\n'.join(lines)
 
+    @default
+    def refresh(self):
+        content = getattr(self, '_fs_content', None)
+        mapped = getattr(self, '_mmap', None)
+        if content is None and mapped is None:
+            return
+        signature = stat_signature(self.fs_backend, join_fs_path(self))
+        if content is not None and content[0] != signature:
+            self._fs_content = None
+        if mapped is not None and self._fs_mmap_signature != signature:
+            _release_mmap(self)
+
     @finalize
-    @locktree
+    @locksubtree
     def __call__(self):
-        # Only write file if it's data has changed or not exists yet
-        exists = os.path.exists(join_fs_path(self))
-        if getattr(self, '_data', UNSET) is not UNSET or not exists:
-            with self.write_fd as f:
-                f.write(self.data)
-                if self.direct_sync:
-                    f.flush()
-                    os.fsync(f.fileno())
-            self._data = UNSET
+        with file_lock(self):
+            persist_file(self)
 
 
 @plumbing(
     DefaultInit,
     FSMode,
-    FileNode)
+    FileNode,
+    AsyncFileNode)
 class File(object):
     pass
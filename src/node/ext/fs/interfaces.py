@@ -6,11 +6,83 @@ from zope.interface import Attribute
 from zope.interface import Interface
 
 
+class IFSBackend(Interface):
+    """File system backend performing all I/O operations of nodes."""
+
+    native = Attribute(
+        'Flag whether paths handled by this backend are paths of the '
+        'operating system file system. Cross process file locks are only '
+        'supported for trees on native backends.'
+    )
+
+    def exists(path):
+        """Check whether path exists."""
+
+    def isdir(path):
+        """Check whether path is a directory."""
+
+    def stat(path):
+        """Return ``os.stat_result`` of path."""
+
+    def scandir(path):
+        """Return iterator of ``os.DirEntry`` like objects of directory."""
+
+    def open(path, mode):
+        """Open file at path with mode. Returns file like object."""
+
+    def mkdir(path):
+        """Create directory at path."""
+
+    def chmod(path, mode):
+        """Change file system mode of path."""
+
+    def rename(src, dst):
+        """Rename src to dst."""
+
+    def replace(src, dst):
+        """Rename src to dst, replacing dst if exists."""
+
+    def remove(path):
+        """Remove file at path."""
+
+    def rmtree(path):
+        """Remove directory at path recursively."""
+
+    def fsync(f):
+        """Flush and sync file object opened by this backend to disk."""
+
+    def fsync_directory(path):
+        """Sync directory at path to disk."""
+
+    def mmap(path):
+        """Return read only memory map of file at path or None if the file
+        is empty.
+        """
+
+
 class IFSLocation(Interface):
     """Plumbing behavior for providing a file system location."""
 
     fs_path = Attribute('Filesystem location of this object')
 
+    fs_path_cache = Attribute(
+        'Flag whether to cache the resolved ``fs_path`` and the joined path '
+        'on this object. Disabling saves memory per node at the cost of '
+        'resolving the path on each access'
+    )
+
+    fs_backend = Attribute(
+        'File system backend used for I/O operations of this object. '
+        'Acquired from parent if not set. Defaults to ``os_backend``.'
+    )
+
+    fs_locks = Attribute(
+        '``node.ext.fs.locking.FileLocks`` instance used for locking against '
+        'other processes on ``__call__``. Acquired from parent if not set. '
+        'Defaults to ``None``, which means no cross process locking. '
+        'Requires a ``native`` file system backend.'
+    )
+
 
 class IFSMode(Interface):
     """Plumbing behavior for managing file system mode."""
@@ -26,6 +98,20 @@ MODE_TEXT = 0
 MODE_BINARY = 1
 
 
+CACHE_UNBOUNDED = 0
+CACHE_NONE = 1
+CACHE_LRU = 2
+
+
+LOCK_ROOT = 'root'
+LOCK_DIRECTORY = 'directory'
+LOCK_FILE = 'file'
+
+
+FS_FILE = 'file'
+FS_DIRECTORY = 'directory'
+
+
 class IFileIO(IFSLocation):
     """File IO interface."""
 
@@ -41,22 +127,77 @@ class IFileIO(IFSLocation):
         'Context manager providing the file descriptor in write mode'
     )
 
+    atomic_write = Attribute(
+        'Flag whether to write to a temporary file in the same directory, '
+        'which gets synced with ``os.fsync`` and replaces the file with '
+        '``os.replace`` once written completely'
+    )
+
 
 class IFileNode(IFile, IFileIO, ILeaf):
     """Basic file node interface."""
 
     direct_sync = Attribute(
         'Flag whether to directly sync filesystem with ``os.fsync`` on '
-        '``__call__``'
+        '``__call__``. If ``atomic_write`` is set, the containing directory '
+        'gets synced as well. Directories get synced only once per '
+        '``Directory.__call__``'
+    )
+
+    chunk_size = Attribute(
+        'Size of chunks used when streaming file data'
     )
 
-    data = Attribute('Data of the file')
+    data = Attribute(
+        'Data of the file. Either string or bytes, depending on file mode. '
+        'A file like object or an iterable of chunks can be set as well, '
+        'which gets streamed to file system on ``__call__``. Reading '
+        '``data`` while a stream is pending consumes the stream'
+    )
 
     lines = Attribute(
-        'Data of the file as list of lines. Can only be used if file mode is '
-        '``MODE_TEXT``'
+        'Data of the file as lazy iterator of lines. Accepts a list of lines '
+        'on write. Can only be used if file mode is ``MODE_TEXT``'
     )
 
+    buffer = Attribute(
+        'Read only ``memoryview`` of file data backed by a memory map, which '
+        'allows zero copy slicing. The memory map gets created on first '
+        'access and released when file gets written on ``__call__``. Views '
+        'should be released before writing, otherwise the mapping stays '
+        'alive until all views are gone and the file gets replaced instead '
+        'of written in place, thus the views keep the former contents. If '
+        'data has been changed, a view of '
+        'pending data is returned. Can only be used if file mode is '
+        '``MODE_BINARY``'
+    )
+
+    content_cache = Attribute(
+        'Flag whether to keep data read from or written to file system in '
+        'memory. Cached data is served without file system access until '
+        '``refresh`` detects a change of the file by comparing modification '
+        'time, size and inode'
+    )
+
+    skip_unchanged = Attribute(
+        'Flag whether to skip writing pending data on ``__call__`` if it '
+        'equals the file contents on file system. Sizes are compared first, '
+        'contents get compared in chunks only if sizes match. File system '
+        'mode is not changed either if it already matches ``fs_mode``. '
+        'Streams are always written'
+    )
+
+    def iter_data(size=None):
+        """Iterate file data in chunks.
+
+        :param size: Chunk size. Defaults to ``chunk_size``.
+        """
+
+    def refresh():
+        """Drop cached content and memory map if file has been changed on
+        file system.
+        """
+
 
 class IDirectory(INode, ICallable, IWildcardFactory, IFSLocation):
     """Directory interface."""
@@ -73,9 +214,200 @@ class IDirectory(INode, ICallable, IWildcardFactory, IFSLocation):
 
     ignores = Attribute('Child keys to ignore')
 
+    child_cache = Attribute(
+        'Caching policy for children loaded from file system. Either '
+        '``CACHE_UNBOUNDED``, ``CACHE_NONE`` or ``CACHE_LRU``. If ``None``, '
+        'policy is inherited from parent directory, defaulting to '
+        '``CACHE_UNBOUNDED``. Dirty children are never evicted from cache '
+        'until they get persisted'
+    )
+
+    child_cache_size = Attribute(
+        'Maximum number of loaded nodes kept in memory if ``child_cache`` is '
+        '``CACHE_LRU``. The LRU cache is shared with all directories '
+        'inheriting the policy'
+    )
+
+    flush_workers = Attribute(
+        'Number of worker threads used to write files on ``__call__``. '
+        'Directory creation, deletes and renames are done in order, while '
+        'dirty ``IFileNode`` descendants get written concurrently. ``0`` '
+        'means sequential processing'
+    )
+
+    transactional = Attribute(
+        'Flag whether to persist changes as a single transaction on '
+        '``__call__``. New file contents get staged and a write ahead '
+        'journal gets written before changes are applied. If applying fails, '
+        'applied changes get reverted. Transactions interrupted by a crash '
+        'get finished before the file system gets accessed first. '
+        '``flush_workers``, ``atomic_write`` and '
+        '``direct_sync`` are not considered'
+    )
+
+    listing_cache = Attribute(
+        'Flag whether to serve the cached directory listing without file '
+        'system access until ``refresh`` or ``__call__``. Otherwise the '
+        'cached listing gets revalidated by comparing modification time, '
+        'size and inode of the directory on each access. Children missing '
+        'in the listing are looked up with ``stat`` in both cases'
+    )
+
+    prefetch_workers = Attribute(
+        'Maximum number of worker threads used to read file contents when '
+        'prefetching data. Defaults to 4'
+    )
+
     def rename(name, new_name):
         """Rename child
 
         :param name: Name of the child to rename
         :param new_name: New name of the child
         """
+
+    def walk(
+        depth=None,
+        patterns=None,
+        materialize=False,
+        followlinks=False
+    ):
+        """Iterate descendants read from file system top down without
+        creating nodes.
+
+        Yields ``WalkEntry`` objects providing ``path``, ``names``, ``type``,
+        ``stat`` and ``node``. Ignored children and their descendants are
+        skipped. For directories not loaded yet, ``ignores`` of a directory
+        node created by the factories of its parent, but not added to the
+        tree, are used. Listing caches of loaded directories are used and pending
+        deletes and renames are considered. Children which have not been
+        persisted yet are not contained.
+
+        :param depth: Maximum depth. ``1`` means direct children only.
+            ``None`` means unlimited.
+        :param patterns: Iterable of ``fnmatch`` patterns. If given, only
+            entries with matching names are yielded. E.g. pass ``factories``
+            for entries with a dedicated factory. Subdirectories are walked
+            regardless.
+        :param materialize: Flag whether to create nodes for yielded entries.
+            Nodes are created by regular child access, only for yielded
+            entries and their ancestors.
+        :param followlinks: Flag whether to walk into symlinked directories.
+        """
+
+    def plan():
+        """Return ``node.ext.fs.plan.Plan`` containing the ordered file
+        system operations ``__call__`` would perform.
+
+        The file system is only accessed to stat entries. Operations provide
+        ``kind`` (``mkdir``, ``delete``, ``rename``, ``write`` or ``chmod``),
+        ``path``, ``target`` of renames and ``size`` of writes in bytes.
+        Paths are valid at execution time, after the renames planned before
+        have been applied. Nodes added under a name which gets renamed away
+        get created after the rename. Writes of files with ``skip_unchanged`` and matching size are
+        flagged with ``verify`` and skipped on execution if contents are
+        equal. Children with custom ``__call__`` implementations not based
+        on ``DirectoryStorage`` or ``FileNode`` are called after execution.
+        """
+
+    def apply_plan(plan):
+        """Execute plan created by ``plan`` and mark nodes in sync with
+        file system.
+
+        Transactional directories commit the plan using the journal. Raises
+        ``RuntimeError`` if file data, modes, deletes, renames or dirty
+        children of planned nodes have been changed after planning, or if
+        an interrupted transaction had to be recovered.
+        """
+
+    def load(depth=1, data=False, workers=None):
+        """Create nodes for all children not loaded yet.
+
+        Children of each directory are created from a single listing with
+        factories resolved in one go. Pending deletes and ignores are
+        considered. Loaded children are subject to the child cache policy,
+        except files which contents have been read with ``data`` and their
+        ancestors. They are kept until the child cache evicts them after
+        being accessed or persisted.
+
+        :param depth: Directory levels to load. ``1`` means direct children
+            only. ``None`` means unlimited.
+        :param data: Flag whether to read the contents of loaded
+            ``IFileNode`` children into their content cache concurrently.
+        :param workers: Number of worker threads for reading contents.
+            Defaults to ``prefetch_workers``.
+        """
+
+    def prefetch_data(patterns=None, depth=None, workers=None):
+        """Read contents of ``IFileNode`` descendants into their content
+        cache concurrently.
+
+        Nodes get created for matching files and their ancestors. Files with
+        pending or already cached data are skipped. Subsequent ``data`` and
+        ``lines`` access is served from memory until the content gets
+        invalidated. Prefetched files and their ancestors are kept regardless
+        of the child cache policy until the child cache evicts them after
+        being accessed or persisted, together with their cached content.
+
+        :param patterns: Iterable of file name patterns. ``None`` means all
+            files.
+        :param depth: Maximum depth. ``None`` means unlimited.
+        :param workers: Number of worker threads. Defaults to
+            ``prefetch_workers``.
+        """
+
+    def refresh():
+        """Revalidate caches of directory and loaded descendants.
+
+        The listing cache gets dropped if the directory has been changed on
+        file system. Unmodified children not existing on file system any
+        longer get removed from memory.
+        """
+
+
+class IAsyncNode(Interface):
+    """Plumbing behavior providing asyncio support.
+
+    Blocking operations are run in an executor. Each method call results in
+    a single executor hop, no matter how many blocking system calls are
+    involved.
+    """
+
+    async_executor = Attribute(
+        'Executor used for running blocking operations. Gets acquired from '
+        'parents if ``None``. Defaults to default executor of event loop'
+    )
+
+    async def acall():
+        """Persist node. Asynchronous version of ``__call__``."""
+
+
+class IAsyncFileNode(IAsyncNode):
+    """Asyncio support for file nodes."""
+
+    async def aread():
+        """Read and return file data."""
+
+    async def awrite(data):
+        """Set file data and persist file.
+
+        :param data: File data.
+        """
+
+
+class IAsyncDirectory(IAsyncNode):
+    """Asyncio support for directories."""
+
+    def __aiter__():
+        """Asynchronous iteration of child keys. Keys are read at once."""
+
+    async def aitems():
+        """Return list of ``(key, child)`` tuples. All children are loaded at
+        once.
+        """
+
+    async def aget(name, default=None):
+        """Return child by name or default if child not exists.
+
+        :param name: Child name.
+        :param default: Default value.
+        """
@@ -0,0 +1,180 @@
+from node.ext.fs.backend import os_backend
+import json
+import os
+
+
+# Name of the staging directory created in the directory being committed
+JOURNAL_NAME = '.node.ext.fs.journal'
+# Name of the journal file inside the staging directory. It only exists once
+# all changes have been staged, thus it marks the transaction as committed
+JOURNAL_FILE = 'journal.json'
+
+MKDIR = 'mkdir'
+DELETE = 'delete'
+RENAME = 'rename'
+WRITE = 'write'
+CHMOD = 'chmod'
+
+
+def journal_path(path):
+    """Return path of staging directory for directory at path."""
+    return os.path.join(path, JOURNAL_NAME)
+
+
+def apply_operation(backend, operation):
+    """Apply journal operation.
+
+    Operations are idempotent, thus they can be applied again after an
+    interruption.
+    """
+    kind = operation[0]
+    if kind == MKDIR:
+        path = operation[1]
+        if not backend.exists(path):
+            backend.mkdir(path)
+    elif kind == DELETE:
+        path, trash = operation[1:]
+        # Deleted entries are moved to the staging directory, thus they can
+        # be restored on rollback
+        if backend.exists(path) and not backend.exists(trash):
+            backend.rename(path, trash)
+    elif kind == RENAME:
+        src, dst = operation[1:]
+        if backend.exists(src) and not backend.exists(dst):
+            backend.rename(src, dst)
+    elif kind == WRITE:
+        path, stage, backup = operation[1:]
+        if backend.exists(stage):
+            if backend.exists(path) and not backend.exists(backup):
+                backend.rename(path, backup)
+            backend.replace(stage, path)
+    elif kind == CHMOD:
+        path, mode = operation[1:3]
+        backend.chmod(path, mode)
+    else:
+        raise ValueError('Unknown journal operation "{}"'.format(kind))
+
+
+def undo_operation(backend, operation):
+    """Revert journal operation. Reverting operations not applied yet is a
+    no-op.
+    """
+    kind = operation[0]
+    if kind == MKDIR:
+        path = operation[1]
+        if backend.exists(path):
+            backend.rmtree(path)
+    elif kind == DELETE:
+        path, trash = operation[1:]
+        if backend.exists(trash):
+            backend.rename(trash, path)
+    elif kind == RENAME:
+        src, dst = operation[1:]
+        if backend.exists(dst) and not backend.exists(src):
+            backend.rename(dst, src)
+    elif kind == WRITE:
+        path, stage, backup = operation[1:]
+        if backend.exists(backup):
+            backend.replace(backup, path)
+        elif not backend.exists(stage) and backend.exists(path):
+            backend.remove(path)
+    elif kind == CHMOD:
+        path, old_mode = operation[1], operation[3]
+        if old_mode is not None and backend.exists(path):
+            backend.chmod(path, old_mode)
+    else:
+        raise ValueError('Unknown journal operation "{}"'.format(kind))
+
+
+class Journal(object):
+    """Write ahead journal of changes to a directory tree.
+
+    New file contents get staged in a staging directory inside the directory
+    at ``path``. Once all changes are staged, the journal gets written, which
+    commits the transaction. Afterwards operations get applied. If applying
+    gets interrupted, ``recover`` applies the remaining operations. If it
+    fails, applied operations get reverted.
+    """
+
+    def __init__(self, path, backend=os_backend):
+        self.path = journal_path(path)
+        self.backend = backend
+        self.operations = list()
+        self._counter = 0
+
+    def begin(self):
+        """Create staging directory."""
+        self.backend.mkdir(self.path)
+
+    def stage_path(self, suffix):
+        """Return new unique path inside staging directory."""
+        self._counter += 1
+        return os.path.join(
+            self.path,
+            '{}.{}'.format(self._counter, suffix)
+        )
+
+    def add(self, *operation):
+        self.operations.append(list(operation))
+
+    def commit(self):
+        """Write journal, which commits the transaction."""
+        backend = self.backend
+        tmp_path = os.path.join(self.path, JOURNAL_FILE + '.tmp')
+        with backend.open(tmp_path, 'w') as f:
+            json.dump(self.operations, f)
+            backend.fsync(f)
+        backend.rename(tmp_path, os.path.join(self.path, JOURNAL_FILE))
+        backend.fsync_directory(self.path)
+
+    def apply(self):
+        """Apply operations. If an operation fails, operations applied so far
+        get reverted and the staging directory gets removed.
+        """
+        backend = self.backend
+        for index, operation in enumerate(self.operations):
+            try:
+                apply_operation(backend, operation)
+            except BaseException:
+                self.rollback(self.operations[:index + 1])
+                raise
+
+    def rollback(self, operations=None):
+        """Revert operations in reverse order and remove staging directory.
+        """
+        if operations is None:
+            operations = self.operations
+        for operation in reversed(operations):
+            undo_operation(self.backend, operation)
+        self.close()
+
+    def close(self):
+        """Remove journal and staging directory.
+
+        The journal gets removed first, thus an interrupted cleanup never
+        results in applying operations again.
+        """
+        backend = self.backend
+        path = os.path.join(self.path, JOURNAL_FILE)
+        if backend.exists(path):
+            backend.remove(path)
+        if backend.exists(self.path):
+            backend.rmtree(self.path)
+
+
+def recover(path, backend=os_backend):
+    """Finish interrupted transaction of directory at path.
+
+    Committed transactions are rolled forward, transactions interrupted while
+    staging are rolled back. Returns whether a transaction was pending.
+    """
+    journal = Journal(path, backend)
+    if not backend.exists(journal.path):
+        return False
+    journal_file = os.path.join(journal.path, JOURNAL_FILE)
+    if backend.exists(journal_file):
+        with backend.open(journal_file, 'r') as f:
+            journal.operations = json.load(f)
+        journal.apply()
+    journal.close()
+    return True
@@ -1,3 +1,6 @@
+from node.ext.fs.backend import acquire
+from node.ext.fs.backend import get_fs_backend
+from node.ext.fs.backend import invalidate_acquired
 from node.ext.fs.interfaces import IFSLocation
 from plumber import Behavior
 from plumber import default
@@ -6,38 +9,108 @@ import os
 
 
 def get_fs_name(directory, name):
-    renamed = getattr(directory, '_renamed_fs_children', {})
-    for old_name, new_name in renamed.items():
-        if name == new_name:
-            name = old_name
-            break
-    return name
+    renamed = getattr(directory, '_renamed_fs_names', None)
+    if not renamed:
+        return name
+    return renamed.get(name, name)
+
+
+def get_fs_locks(ob):
+    """Lookup cross process file locks of object. Locks are acquired from
+    parents if not set on object. Returns tuple of ``FileLocks`` instance and
+    the object it has been set on or ``(None, None)``.
+    """
+    return acquire(ob, '_fs_locks', '_fs_locks_cache')
 
 
 def get_fs_path(ob, child_path=[]):
     # Use fs_path if provided by ob, otherwise fallback to path
-    if hasattr(ob, 'fs_path'):
-        return ob.fs_path + child_path
-    return ob.path + child_path
+    try:
+        fs_path = ob.fs_path
+    except AttributeError:
+        fs_path = ob.path
+    return fs_path + child_path
 
 
 def join_fs_path(ob, child_path=[]):
-    return os.path.join(*get_fs_path(ob, child_path))
+    try:
+        fs_path = ob.fs_path
+    except AttributeError:
+        return os.path.join(*ob.path + child_path)
+    # Joined path is cached as long as ``fs_path`` returns the same list
+    joined = getattr(ob, '_fs_path_joined', None)
+    if joined is not None and joined[0] is fs_path:
+        path = joined[1]
+    else:
+        path = os.path.join(*fs_path)
+        if getattr(ob, 'fs_path_cache', True):
+            try:
+                ob._fs_path_joined = (fs_path, path)
+            except AttributeError:
+                pass
+    if child_path:
+        return os.path.join(path, *child_path)
+    return path
 
 
 @implementer(IFSLocation)
 class FSLocation(Behavior):
+    fs_path_cache = default(True)
 
     @property
     def fs_path(self):
-        if getattr(self, '_fs_path', None) is not None:
-            return self._fs_path
+        # The resolved path is cached. The cache is valid as long as the
+        # parent returns the identical path list and the file system name of
+        # this object is unchanged. This way renaming and moving objects and
+        # their ancestors invalidates the cache. Returned lists must not be
+        # modified.
+        fs_path = getattr(self, '_fs_path', None)
+        if fs_path is not None:
+            return fs_path
         parent = self.parent
-        if parent is not None and hasattr(parent, 'fs_path'):
-            return self.parent.fs_path + [get_fs_name(self.parent, self.name)]
-        return self.path
+        if not self.fs_path_cache:
+            try:
+                parent_path = parent.fs_path
+            except AttributeError:
+                return self.path
+            return parent_path + [get_fs_name(parent, self.name)]
+        cache = getattr(self, '_fs_path_cache', None)
+        try:
+            parent_path = parent.fs_path
+        except AttributeError:
+            path = self.path
+            if cache is not None and cache[0] is None and cache[2] == path:
+                return cache[2]
+            self._fs_path_cache = (None, None, path)
+            return path
+        name = get_fs_name(parent, self.name)
+        if cache is not None and cache[0] is parent_path and cache[1] == name:
+            return cache[2]
+        fs_path = parent_path + [name]
+        self._fs_path_cache = (parent_path, name, fs_path)
+        return fs_path
 
     @default
     @fs_path.setter
     def fs_path(self, path):
         self._fs_path = path
+
+    @property
+    def fs_backend(self):
+        return get_fs_backend(self)
+
+    @default
+    @fs_backend.setter
+    def fs_backend(self, backend):
+        self._fs_backend = backend
+        invalidate_acquired()
+
+    @property
+    def fs_locks(self):
+        return get_fs_locks(self)[0]
+
+    @default
+    @fs_locks.setter
+    def fs_locks(self, locks):
+        self._fs_locks = locks
+        invalidate_acquired()
@@ -0,0 +1,516 @@
+from contextlib import contextmanager
+from node.ext.fs.backend import get_fs_backend
+from node.ext.fs.interfaces import IDirectory
+from node.ext.fs.interfaces import LOCK_FILE
+from node.ext.fs.interfaces import LOCK_ROOT
+from node.ext.fs.location import get_fs_locks
+from node.ext.fs.location import join_fs_path
+import errno
+import os
+import threading
+import time
+import zlib
+
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+# Name of the lock file created in directories locked against other processes
+LOCK_NAME = '.node.ext.fs.lock'
+
+
+class RWLock(object):
+    """Reentrant readers-writer lock.
+
+    Multiple threads can hold the read lock at once, the write lock is
+    exclusive. Both locks are reentrant and the thread holding the write lock
+    can acquire the read lock as well. Waiting writers take precedence over
+    threads acquiring the read lock for the first time. Upgrading a read lock
+    to a write lock raises a ``RuntimeError``, as it would deadlock.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        # Read lock counts by thread identifier
+        self._readers = dict()
+        self._writer = None
+        self._writes = 0
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        ident = threading.get_ident()
+        with self._condition:
+            if self._writer != ident and ident not in self._readers:
+                while self._writer is not None or self._waiting_writers:
+                    self._condition.wait()
+            self._readers[ident] = self._readers.get(ident, 0) + 1
+
+    def release_read(self):
+        ident = threading.get_ident()
+        with self._condition:
+            count = self._readers[ident] - 1
+            if count:
+                self._readers[ident] = count
+                return
+            del self._readers[ident]
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        ident = threading.get_ident()
+        with self._condition:
+            if self._writer == ident:
+                self._writes += 1
+                return
+            if ident in self._readers:
+                raise RuntimeError('Cannot upgrade read lock to write lock')
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = ident
+            self._writes = 1
+
+    def release_write(self):
+        with self._condition:
+            self._writes -= 1
+            if not self._writes:
+                self._writer = None
+                self._condition.notify_all()
+
+
+_lock_creation = threading.Lock()
+
+
+def node_lock(node):
+    """Return ``RWLock`` of node. The lock gets created on first use."""
+    lock = getattr(node, '_fs_lock', None)
+    if lock is None:
+        with _lock_creation:
+            lock = getattr(node, '_fs_lock', None)
+            if lock is None:
+                lock = node._fs_lock = RWLock()
+    return lock
+
+
+class LockContext(threading.local):
+
+    def __init__(self):
+        # Identifiers of nodes locked exclusively by the current thread
+        self.exclusive = set()
+        # Identifiers of nodes locked against other processes by the current
+        # thread
+        self.file_locked = set()
+
+
+_lock_context = LockContext()
+
+
+def _lock_target(node):
+    """Return node holding the lock for node. Locks are held by directories,
+    files are locked by their parent directory.
+    """
+    if IDirectory.providedBy(node):
+        return node
+    parent = getattr(node, 'parent', None)
+    if IDirectory.providedBy(parent):
+        return parent
+    return node
+
+
+@contextmanager
+def subtree_lock(node, exclusive=True):
+    """Context manager for locking node and it's descendants.
+
+    The lock of node gets acquired for writing if ``exclusive`` is set,
+    otherwise for reading. Files are locked by the lock of their parent
+    directory. Locks of directory ancestors get acquired for reading top
+    down. This way independent subtrees can be locked exclusively at the same
+    time, while locking a subtree exclusively waits for locks held inside
+    this subtree to be released and vice versa. Ancestors of a node inside a
+    subtree locked exclusively by the current thread are not locked again.
+    """
+    target = _lock_target(node)
+    locked = _lock_context.exclusive
+    if id(target) in locked:
+        yield
+        return
+    ancestors = list()
+    current = getattr(target, 'parent', None)
+    while IDirectory.providedBy(current):
+        if id(current) in locked:
+            # Ancestors are locked exclusively by this thread already
+            ancestors = list()
+            break
+        ancestors.append(current)
+        current = current.parent
+    ancestors.reverse()
+    acquired = list()
+    try:
+        for ancestor in ancestors:
+            lock = node_lock(ancestor)
+            lock.acquire_read()
+            acquired.append(lock.release_read)
+        lock = node_lock(target)
+        if exclusive:
+            lock.acquire_write()
+            acquired.append(lock.release_write)
+            locked.add(id(target))
+        else:
+            lock.acquire_read()
+            acquired.append(lock.release_read)
+        try:
+            yield
+        finally:
+            if exclusive:
+                locked.discard(id(target))
+    finally:
+        for release in reversed(acquired):
+            release()
+
+
+def locksubtree(fn):
+    """Decorator for locking node and it's descendants exclusively while
+    calling a method. See ``subtree_lock``.
+    """
+    def _locksubtree_decorator(self, *args, **kwargs):
+        with subtree_lock(self):
+            return fn(self, *args, **kwargs)
+    return _locksubtree_decorator
+
+
+@contextmanager
+def mutation_lock(node):
+    """Context manager for locking node while changing it.
+
+    Only the lock of node, or of the parent directory of a file, gets
+    acquired exclusively. Ancestors are not locked, thus changing a node
+    does not depend on the depth of the tree. Persisting a directory holds
+    its lock while processing it and marks it clean before processing its
+    children, thus changes made concurrently are either persisted or leave
+    the directory dirty for the next call.
+    """
+    lock = node_lock(_lock_target(node))
+    lock.acquire_write()
+    try:
+        yield
+    finally:
+        lock.release_write()
+
+
+def lockmutation(fn):
+    """Decorator for locking node while calling a method changing it. See
+    ``mutation_lock``.
+    """
+    def _lockmutation_decorator(self, *args, **kwargs):
+        with mutation_lock(self):
+            return fn(self, *args, **kwargs)
+    return _lockmutation_decorator
+
+
+class _HeldLock(object):
+    """Lock on a lock file held by this process."""
+
+    __slots__ = ('lock', 'count', 'users', 'exclusive', 'covered')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.users = 0
+        self.exclusive = False
+        self.covered = False
+
+
+# POSIX record locks are held per process and get released as soon as any
+# file descriptor of the lock file gets closed. Thus lock files are opened
+# once per process and held locks are counted.
+_registry_lock = threading.Lock()
+# Held locks by directory path and start offset. Offset ``0`` locks the whole
+# lock file.
+_held_locks = dict()
+# File descriptor and number of held locks by directory path
+_lock_files = dict()
+
+
+def _open_lock_file(path):
+    with _registry_lock:
+        entry = _lock_files.get(path)
+        if entry is None:
+            fd = os.open(
+                os.path.join(path, LOCK_NAME),
+                os.O_RDWR | os.O_CREAT,
+                0o644
+            )
+            entry = _lock_files[path] = [fd, 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def _close_lock_file(path):
+    with _registry_lock:
+        entry = _lock_files[path]
+        entry[1] -= 1
+        if not entry[1]:
+            del _lock_files[path]
+            os.close(entry[0])
+
+
+def _existing_directory(path):
+    while path and not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path or os.curdir
+
+
+class FileLocks(object):
+    """Advisory locks synchronizing ``__call__`` of nodes between processes.
+
+    Set an instance as ``fs_locks`` on the root node of a tree. Locks are
+    ``fcntl`` record locks on lock files named ``LOCK_NAME``, which are
+    hidden from directory listings. ``policy`` defines the lock granularity:
+
+    ``LOCK_ROOT``
+        Persisting any node locks the lock file in the directory of the node
+        ``fs_locks`` is set on.
+
+    ``LOCK_DIRECTORY``
+        Persisting a directory locks the lock file in this directory, writing
+        a file locks the lock file of its parent directory. Lock files of
+        ancestor directories get locked shared, thus renaming or deleting a
+        directory waits for writes inside of it.
+
+    ``LOCK_FILE``
+        Like ``LOCK_DIRECTORY``, but writing a file only locks a byte range
+        of the lock file of its parent directory, thus different files of
+        the same directory can be written concurrently.
+
+    Directories not existing yet are covered by the lock of the nearest
+    existing ancestor. If ``timeout`` is ``None``, acquiring waits until the
+    lock is available, otherwise a ``TimeoutError`` is raised after
+    ``timeout`` seconds. Contention is recorded in ``acquired``,
+    ``contended``, ``timeouts`` and ``wait_seconds``.
+
+    Lock files are created with ``os`` functions, thus persisting nodes
+    using a backend which is not ``native``, like ``MemoryBackend``, raises a
+    ``RuntimeError`` instead of creating lock files on the real file system.
+    """
+
+    def __init__(self, policy=LOCK_ROOT, timeout=None, poll_interval=0.01):
+        if fcntl is None:
+            raise RuntimeError('File locking requires ``fcntl``')
+        self.policy = policy
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._stats_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.acquired = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.
+
+    def as_dict(self):
+        return dict(
+            acquired=self.acquired,
+            contended=self.contended,
+            timeouts=self.timeouts,
+            wait_seconds=self.wait_seconds
+        )
+
+    def locks_for(self, node, root):
+        """Return list of ``(path, start, exclusive)`` tuples of locks to
+        acquire for persisting node. ``root`` is the node locks are set on.
+        """
+        if self.policy == LOCK_ROOT:
+            path = join_fs_path(root)
+            if not IDirectory.providedBy(root):
+                path = os.path.dirname(path)
+            return [(_existing_directory(path), 0, True)]
+        is_dir = IDirectory.providedBy(node)
+        current = node if is_dir else node.parent
+        paths = list()
+        if IDirectory.providedBy(current):
+            while True:
+                paths.append(join_fs_path(current))
+                if current is root:
+                    break
+                current = current.parent
+                if not IDirectory.providedBy(current):
+                    break
+        else:
+            paths.append(os.path.dirname(join_fs_path(node)))
+        paths.reverse()
+        exists = os.path.isdir(paths[-1])
+        if not exists:
+            while len(paths) > 1 and not os.path.isdir(paths[-1]):
+                paths.pop()
+            paths[-1] = _existing_directory(paths[-1])
+        locks = [(path, 0, False) for path in paths[:-1]]
+        if exists and not is_dir and self.policy == LOCK_FILE:
+            name = os.path.basename(join_fs_path(node))
+            start = zlib.crc32(name.encode('utf-8', 'surrogateescape')) + 1
+            locks.append((paths[-1], start, True))
+        else:
+            locks.append((paths[-1], 0, True))
+        return locks
+
+    def acquire(self, path, start=0, exclusive=True):
+        """Lock lock file in directory at path. ``start`` ``0`` locks the
+        whole file, other values lock one byte at ``start``.
+        """
+        key = (path, start)
+        with _registry_lock:
+            held = _held_locks.get(key)
+            if held is None:
+                held = _held_locks[key] = _HeldLock()
+            held.users += 1
+        try:
+            with held.lock:
+                if held.count and (held.exclusive or not exclusive):
+                    held.count += 1
+                    return
+                if not held.count and start:
+                    with _registry_lock:
+                        whole = _held_locks.get((path, 0))
+                        covered = (
+                            whole is not None
+                            and whole.count
+                            and whole.exclusive
+                        )
+                    # Locking and unlocking a range would split the lock on
+                    # the whole file held by this process
+                    if covered:
+                        held.covered = True
+                        held.exclusive = True
+                        held.count = 1
+                        return
+                fd = _open_lock_file(path)
+                try:
+                    self._lock(fd, start, exclusive)
+                except BaseException:
+                    _close_lock_file(path)
+                    raise
+                if held.count:
+                    # Lock got converted to exclusive, keep one open count
+                    _close_lock_file(path)
+                held.exclusive = held.exclusive or exclusive
+                held.count += 1
+        except BaseException:
+            self._drop(key, held)
+            raise
+
+    def release(self, path, start=0):
+        """Release lock acquired by ``acquire``."""
+        key = (path, start)
+        with _registry_lock:
+            held = _held_locks[key]
+        with held.lock:
+            held.count -= 1
+            if not held.count:
+                if held.covered:
+                    held.covered = False
+                else:
+                    with _registry_lock:
+                        fd = _lock_files[path][0]
+                    fcntl.lockf(fd, fcntl.LOCK_UN, 1 if start else 0, start)
+                    _close_lock_file(path)
+                held.exclusive = False
+        self._drop(key, held)
+
+    def _drop(self, key, held):
+        with _registry_lock:
+            held.users -= 1
+            if not held.users:
+                del _held_locks[key]
+
+    def _lock(self, fd, start, exclusive):
+        length = 1 if start else 0
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.lockf(fd, operation | fcntl.LOCK_NB, length, start)
+        except OSError as e:
+            if e.errno not in (errno.EACCES, errno.EAGAIN):
+                raise
+        else:
+            self._record(0.)
+            return
+        with self._stats_lock:
+            self.contended += 1
+        begin = time.monotonic()
+        if self.timeout is None:
+            fcntl.lockf(fd, operation, length, start)
+            self._record(time.monotonic() - begin)
+            return
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                fcntl.lockf(fd, operation | fcntl.LOCK_NB, length, start)
+            except OSError as e:
+                if e.errno not in (errno.EACCES, errno.EAGAIN):
+                    raise
+                waited = time.monotonic() - begin
+                if waited >= self.timeout:
+                    with self._stats_lock:
+                        self.timeouts += 1
+                        self.wait_seconds += waited
+                    raise TimeoutError(
+                        'Lock not acquired within {} seconds'.format(
+                            self.timeout
+                        )
+                    )
+            else:
+                self._record(time.monotonic() - begin)
+                return
+
+    def _record(self, seconds):
+        with self._stats_lock:
+            self.acquired += 1
+            self.wait_seconds += seconds
+
+
+@contextmanager
+def file_lock(node):
+    """Context manager locking node against other processes while it gets
+    persisted. Does nothing if no ``fs_locks`` are set. See ``FileLocks``.
+    """
+    locks, root = get_fs_locks(node)
+    if locks is None:
+        yield
+        return
+    # Lock files are created with ``os``, never on behalf of virtual trees
+    if not (get_fs_backend(node).native and get_fs_backend(root).native):
+        raise RuntimeError(
+            'File locks require a native file system backend'
+        )
+    locked = _lock_context.file_locked
+    if id(node) in locked:
+        yield
+        return
+    parent = getattr(node, 'parent', None)
+    # Nodes inside a directory locked by the current thread are covered by
+    # its lock, except subdirectories having their own lock files
+    covered = id(parent) in locked and (
+        locks.policy == LOCK_ROOT or not IDirectory.providedBy(node)
+    )
+    acquired = list()
+    try:
+        if not covered:
+            for path, start, exclusive in locks.locks_for(node, root):
+                locks.acquire(path, start, exclusive)
+                acquired.append((path, start))
+        locked.add(id(node))
+        try:
+            yield
+        finally:
+            locked.discard(id(node))
+    finally:
+        for path, start in reversed(acquired):
+            locks.release(path, start)
@@ -1,17 +1,39 @@
+from node.ext.fs.backend import get_fs_backend
+from node.ext.fs.dirty import mark_dirty
 from node.ext.fs.interfaces import IFSMode
 from node.ext.fs.location import join_fs_path
+from node.ext.fs.locking import file_lock
+from node.ext.fs.locking import mutation_lock
+from node.ext.fs.locking import subtree_lock
 from plumber import Behavior
 from plumber import default
 from plumber import plumb
 from zope.interface import implementer
-import os
 
 
 def get_fs_mode(node):
     fs_path = join_fs_path(node)
-    if not os.path.exists(fs_path):
+    backend = get_fs_backend(node)
+    if not backend.exists(fs_path):
         return None
-    return os.stat(fs_path).st_mode & 0o777
+    return backend.stat(fs_path).st_mode & 0o777
+
+
+def apply_fs_mode(node):
+    """Change file system mode of node if it has been set to a new value.
+
+    Nodes with ``skip_unchanged`` set are only changed if the mode on file
+    system differs.
+    """
+    if not getattr(node, '_fs_mode_changed', False):
+        return
+    fs_mode = node._fs_mode
+    if fs_mode is not None and not (
+        getattr(node, 'skip_unchanged', False)
+        and get_fs_mode(node) == fs_mode
+    ):
+        get_fs_backend(node).chmod(join_fs_path(node), fs_mode)
+    node._fs_mode_changed = False
 
 
 @implementer(IFSMode)
@@ -29,12 +51,16 @@ class FSMode(Behavior):
     @default
     @fs_mode.setter
     def fs_mode(self, mode):
-        self._fs_mode = mode
+        # If mode has not been read from file system yet, we cannot know
+        # whether it changes and treat it as changed.
+        with mutation_lock(self):
+            if getattr(self, '_fs_mode', None) != mode:
+                self._fs_mode_changed = True
+                mark_dirty(self)
+            self._fs_mode = mode
 
     @plumb
     def __call__(next_, self):
-        # Change file system mode if set
-        next_(self)
-        fs_mode = self.fs_mode
-        if fs_mode is not None:
-            os.chmod(join_fs_path(self), fs_mode)
+        with subtree_lock(self), file_lock(self):
+            next_(self)
+            apply_fs_mode(self)
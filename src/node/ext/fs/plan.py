@@ -0,0 +1,193 @@
+from node.ext.fs.file import batch_directory_sync
+from node.ext.fs.file import open_write_file
+from node.ext.fs.file import sync_directory
+from node.ext.fs.file import unchanged_signature
+from node.ext.fs.file import write_data
+from node.ext.fs.journal import CHMOD
+from node.ext.fs.journal import DELETE
+from node.ext.fs.journal import MKDIR
+from node.ext.fs.journal import RENAME
+from node.ext.fs.journal import WRITE
+import os
+
+
+class Operation(object):
+    """File system operation contained in a ``Plan``.
+
+    ``path`` is the path the operation applies to at the time it gets
+    executed, thus renames planned before are considered.
+    """
+
+    __slots__ = (
+        'kind',
+        'path',
+        'target',
+        'node',
+        'data',
+        'size',
+        'mode',
+        'old_mode',
+        'is_dir',
+        'verify',
+        'written'
+    )
+
+    def __init__(
+        self,
+        kind,
+        path,
+        target=None,
+        node=None,
+        data=None,
+        size=None,
+        mode=None,
+        old_mode=None,
+        is_dir=False,
+        verify=False
+    ):
+        self.kind = kind
+        self.path = path
+        self.target = target
+        self.node = node
+        self.data = data
+        self.size = size
+        self.mode = mode
+        self.old_mode = old_mode
+        self.is_dir = is_dir
+        self.verify = verify
+        self.written = False
+
+    def __repr__(self):
+        if self.kind == RENAME:
+            return '<{} {} -> {}>'.format(self.kind, self.path, self.target)
+        if self.kind == WRITE:
+            return '<{} {} ({} bytes)>'.format(self.kind, self.path, self.size)
+        if self.kind == CHMOD:
+            return '<{} {} {:o}>'.format(self.kind, self.path, self.mode)
+        return '<{} {}>'.format(self.kind, self.path)
+
+
+class Plan(object):
+    """Ordered file system operations persisting a directory tree.
+
+    Besides the operations, the plan keeps the nodes which get in sync with
+    the file system once the plan has been executed.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.operations = list()
+        # Tuples of planned directories and their persisted children
+        self.directories = list()
+        # Tuples of planned file nodes and their pending data
+        self.files = list()
+        # Nodes persisting themselves
+        self.nodes = list()
+        # Nodes with changed file system mode
+        self.modes = list()
+        # Tuples of planned nodes and their state, which must not change
+        # until the plan gets executed
+        self.states = list()
+
+    def __iter__(self):
+        return iter(self.operations)
+
+    def __len__(self):
+        return len(self.operations)
+
+    def add(self, kind, path, **kw):
+        operation = Operation(kind, path, **kw)
+        self.operations.append(operation)
+        return operation
+
+    @property
+    def size(self):
+        """Number of bytes to write. Streams of unknown size are not
+        considered.
+        """
+        return sum(
+            operation.size for operation in self.operations
+            if operation.kind == WRITE and operation.size is not None
+        )
+
+    def count(self, kind):
+        """Return number of operations of kind."""
+        return len([
+            operation for operation in self.operations
+            if operation.kind == kind
+        ])
+
+    def coalesce(self):
+        """Remove redundant operations. Returns number of removed operations.
+
+        Mode changes to the current mode and all but the last mode change of
+        a path get removed. Deletes of files which get written afterwards are
+        removed, as the write replaces the file.
+        """
+        operations = self.operations
+        written = set()
+        chmods = set()
+        keep = list()
+        for operation in reversed(operations):
+            kind = operation.kind
+            if kind == WRITE:
+                written.add(operation.path)
+            elif kind == CHMOD:
+                if (
+                    operation.mode == operation.old_mode
+                    or operation.path in chmods
+                ):
+                    continue
+                chmods.add(operation.path)
+            elif kind == DELETE:
+                if not operation.is_dir and operation.path in written:
+                    continue
+            elif kind in (MKDIR, RENAME):
+                # Paths get reused, thus stop coalescing across them
+                written.clear()
+                chmods.clear()
+            keep.append(operation)
+        keep.reverse()
+        removed = len(operations) - len(keep)
+        self.operations = keep
+        return removed
+
+    def apply(self):
+        """Execute operations in order.
+
+        Writes honor ``atomic_write`` and ``direct_sync`` of file nodes.
+        Writes flagged for verification are skipped if the file contents are
+        unchanged.
+        """
+        backend = self.backend
+        with batch_directory_sync():
+            for operation in self.operations:
+                kind = operation.kind
+                path = operation.path
+                if kind == MKDIR:
+                    backend.mkdir(path)
+                elif kind == DELETE:
+                    if operation.is_dir:
+                        backend.rmtree(path)
+                    else:
+                        backend.remove(path)
+                elif kind == RENAME:
+                    backend.rename(path, operation.target)
+                elif kind == WRITE:
+                    _write(backend, operation)
+                elif kind == CHMOD:
+                    backend.chmod(path, operation.mode)
+
+
+def _write(backend, operation):
+    node = operation.node
+    data = operation.data
+    if operation.verify and unchanged_signature(node, data, operation.path):
+        return
+    with open_write_file(node, operation.path) as f:
+        write_data(node, f, data)
+        if node.direct_sync and not node.atomic_write:
+            backend.fsync(f)
+    if node.atomic_write and node.direct_sync:
+        sync_directory(os.path.dirname(operation.path), backend)
+    operation.written = True
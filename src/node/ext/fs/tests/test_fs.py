@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
 from node.behaviors import DefaultInit
 from node.behaviors import MappingAdopt
 from node.behaviors import MappingNode
@@ -16,16 +17,57 @@ from node.ext.fs import get_fs_path
 from node.ext.fs import join_fs_path
 from node.ext.fs import MODE_BINARY
 from node.ext.fs import MODE_TEXT
+from node.ext.fs import track_writes
+from node.ext.fs.aio import get_async_executor
+from node.ext.fs.backend import get_fs_backend
+from node.ext.fs.backend import InstrumentedBackend
+from node.ext.fs.backend import IOStats
+from node.ext.fs.backend import MemoryBackend
+from node.ext.fs.backend import os_backend
+from node.ext.fs.backend import OSBackend
+from node.ext.fs.cache import LRUChildCache
+from node.ext.fs.cache import NoChildCache
+from node.ext.fs.compact import CompactDirectory
+from node.ext.fs.compact import CompactFile
+from node.ext.fs.directory import _child_cache
+from node.ext.fs.dirty import is_dirty
+from node.ext.fs.factory import compile_factories
+from node.ext.fs.interfaces import CACHE_LRU
+from node.ext.fs.interfaces import CACHE_NONE
+from node.ext.fs.interfaces import IAsyncDirectory
+from node.ext.fs.interfaces import IAsyncFileNode
 from node.ext.fs.interfaces import IDirectory
 from node.ext.fs.interfaces import IFile
 from node.ext.fs.interfaces import IFSLocation
 from node.ext.fs.interfaces import IFSMode
+from node.ext.fs.interfaces import LOCK_DIRECTORY
+from node.ext.fs.interfaces import LOCK_FILE
+from node.ext.fs.journal import apply_operation
+from node.ext.fs.journal import Journal
+from node.ext.fs.journal import JOURNAL_NAME
+from node.ext.fs.journal import RENAME
+from node.ext.fs.journal import WRITE
+from node.ext.fs.locking import FileLocks
+from node.ext.fs.locking import LOCK_NAME
+from node.ext.fs.locking import RWLock
+from node.ext.fs.locking import subtree_lock
+from node.ext.fs.watch import create_watcher
+from node.ext.fs.watch import inotify_available
+from node.ext.fs.watch import InotifyWatcher
+from node.ext.fs.watch import PollingWatcher
 from node.tests import NodeTestCase
 from node.utils import UNSET
 from plumber import plumbing
+import asyncio
 import os
+import re
 import shutil
+import subprocess
+import sys
 import tempfile
+import threading
+import time
+import zlib
 
 
 ###############################################################################
@@ -114,6 +156,57 @@ class Tests(NodeTestCase):
         ob.fs_path = ['path', 'to', 'ob']
         self.assertEqual(ob.fs_path, ['path', 'to', 'ob'])
 
+    def test_fs_path_cache(self):
+        os.mkdir(os.path.join(self.tempdir, 'a'))
+        os.mkdir(os.path.join(self.tempdir, 'a', 'b'))
+        directory = Directory(name=self.tempdir)
+        dir_b = directory['a']['b']
+        fs_path = dir_b.fs_path
+        self.assertEqual(fs_path[1:], ['a', 'b'])
+        self.assertIs(dir_b.fs_path, fs_path)
+        joined = join_fs_path(dir_b)
+        self.assertEqual(joined, os.path.join(self.tempdir, 'a', 'b'))
+        self.assertIs(join_fs_path(dir_b), joined)
+        self.assertEqual(
+            join_fs_path(dir_b, ['c']),
+            os.path.join(self.tempdir, 'a', 'b', 'c')
+        )
+
+        # Ancestor rename invalidates cache
+        directory.rename('a', 'x')
+        self.assertEqual(dir_b.fs_path[1:], ['a', 'b'])
+        self.assertIs(dir_b.fs_path, fs_path)
+        directory()
+        self.assertEqual(dir_b.fs_path[1:], ['x', 'b'])
+        self.assertEqual(dir_b.path[1:], ['x', 'b'])
+        self.assertEqual(
+            join_fs_path(dir_b),
+            os.path.join(self.tempdir, 'x', 'b')
+        )
+
+        # Rename invalidates cache
+        dir_x = directory['x']
+        dir_x.rename('b', 'y')
+        self.assertEqual(dir_b.fs_path[1:], ['x', 'b'])
+        dir_x()
+        self.assertEqual(dir_b.fs_path[1:], ['x', 'y'])
+
+        # Reparenting invalidates cache
+        other = Directory(name=os.path.join(self.tempdir, 'other'))
+        other['y'] = dir_b
+        other_path = os.path.join(self.tempdir, 'other')
+        self.assertEqual(dir_b.fs_path, [other_path, 'y'])
+        self.assertEqual(
+            join_fs_path(dir_b),
+            os.path.join(self.tempdir, 'other', 'y')
+        )
+
+        # Setting fs_path explicit
+        dir_b.fs_path = ['path']
+        self.assertEqual(join_fs_path(dir_b), 'path')
+        dir_b.fs_path = None
+        self.assertEqual(dir_b.fs_path, [other_path, 'y'])
+
     def test_get_fs_mode(self):
         path = os.path.join(self.tempdir, 'file')
         with open(path, 'w') as f:
@@ -158,7 +251,7 @@ class Tests(NodeTestCase):
 
         self.assertEqual(file.mode, MODE_TEXT)
         self.assertEqual(file.data, '')
-        self.assertEqual(file.lines, [])
+        self.assertEqual(list(file.lines), [])
 
         self.assertFalse(hasattr(file, '_data'))
         file.data = 'abc\ndef'
@@ -173,7 +266,7 @@ class Tests(NodeTestCase):
 
         file = File(name=filepath)
         self.assertEqual(file.data, 'abc\ndef')
-        self.assertEqual(file.lines, ['abc', 'def'])
+        self.assertEqual(list(file.lines), ['abc', 'def'])
 
         file.lines = ['a', 'b', 'c']
         file()
@@ -215,6 +308,1731 @@ class Tests(NodeTestCase):
             out = f.read()
         self.assertEqual(out, '\x00\x00')
 
+    def test_file_lines(self):
+        filepath = os.path.join(self.tempdir, 'file.txt')
+        file = File(name=filepath)
+        for data, lines in [
+            ('', []),
+            ('a', ['a']),
+            ('a\n', ['a', '']),
+            ('\n', ['', '']),
+            ('a\n\nb', ['a', '', 'b'])
+        ]:
+            file.data = data
+            # lines from pending data
+            lines_iter = file.lines
+            self.assertFalse(isinstance(lines_iter, list))
+            self.assertEqual(list(lines_iter), lines)
+            file()
+            # lines read lazily from file system
+            self.assertEqual(list(File(name=filepath).lines), lines)
+
+    def test_file_streaming(self):
+        filepath = os.path.join(self.tempdir, 'file.bin')
+
+        class BinaryFile(File):
+            mode = MODE_BINARY
+            chunk_size = 4
+
+        # iterate inexistent file
+        file = BinaryFile(name=filepath)
+        self.assertEqual(list(file.iter_data()), [])
+
+        # write from file like object
+        source_path = os.path.join(self.tempdir, 'source.bin')
+        with open(source_path, 'wb') as f:
+            f.write(b'0123456789')
+        with open(source_path, 'rb') as source:
+            file.data = source
+            file()
+        self.assertEqual(file._data, UNSET)
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+
+        # iterate chunks from file system
+        file = BinaryFile(name=filepath)
+        self.assertEqual(
+            list(file.iter_data()),
+            [b'0123', b'4567', b'89']
+        )
+        self.assertEqual(
+            list(file.iter_data(size=6)),
+            [b'012345', b'6789']
+        )
+
+        # write from iterable of chunks
+        file.data = iter([b'abc', b'def'])
+        file()
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), b'abcdef')
+
+        # iterate pending data
+        file.data = b'abcdefghij'
+        self.assertEqual(
+            list(file.iter_data()),
+            [b'abcd', b'efgh', b'ij']
+        )
+
+        # reading data consumes pending stream
+        file.data = iter([b'x', b'y'])
+        self.assertEqual(file.data, b'xy')
+        self.assertEqual(file._data, b'xy')
+        file()
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), b'xy')
+
+        # text files
+        filepath = os.path.join(self.tempdir, 'file.txt')
+        file = File(name=filepath)
+        file.data = (line + '\n' for line in ['a', 'b'])
+        file()
+        self.assertEqual(list(File(name=filepath).lines), ['a', 'b', ''])
+        self.assertEqual(list(File(name=filepath).iter_data()), ['a\nb\n'])
+
+    def test_file_buffer(self):
+        filepath = os.path.join(self.tempdir, 'file.bin')
+
+        class BinaryFile(File):
+            mode = MODE_BINARY
+
+        with self.assertRaises(RuntimeError) as arc:
+            File(name=filepath).buffer
+        self.assertEqual(str(arc.exception), 'Cannot map text file.')
+
+        # inexistent file
+        file = BinaryFile(name=filepath)
+        buffer = file.buffer
+        self.assertIsInstance(buffer, memoryview)
+        self.assertEqual(buffer.tobytes(), b'')
+
+        # empty file
+        file()
+        self.assertEqual(file.buffer.tobytes(), b'')
+        self.assertFalse(hasattr(file, '_mmap'))
+
+        # memory mapped file
+        file.data = b'0123456789'
+        file()
+        buffer = file.buffer
+        self.assertEqual(buffer[2:5].tobytes(), b'234')
+        self.assertIs(file.buffer.obj, file._mmap)
+        self.assertTrue(buffer.readonly)
+        buffer.release()
+
+        # pending data
+        file.data = b'abc'
+        self.assertEqual(file.buffer.tobytes(), b'abc')
+
+        # mapping gets released on write
+        mapped = file._mmap
+        file()
+        self.assertTrue(mapped.closed)
+        self.assertEqual(file._mmap, None)
+        self.assertEqual(file.buffer.tobytes(), b'abc')
+
+        # mapping with exported views gets dropped
+        view = file.buffer[:1]
+        mapped = file._mmap
+        file.data = b'abcdef'
+        file()
+        self.assertFalse(mapped.closed)
+        self.assertEqual(file._mmap, None)
+        view.release()
+        self.assertEqual(file.buffer.tobytes(), b'abcdef')
+
+        # File gets replaced instead of truncated while views are exported,
+        # thus views keep the former contents
+        path = os.path.join(self.tempdir, 'large.bin')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 100000)
+        file = File(name=path)
+        file.mode = MODE_BINARY
+        view = file.buffer
+        inode = os.stat(path).st_ino
+        file.data = b'ab'
+        file()
+        self.assertNotEqual(os.stat(path).st_ino, inode)
+        self.assertEqual(view[90000:90005].tobytes(), b'xxxxx')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'ab')
+        self.assertEqual(len(file._fs_exported_mmaps or ()), 0)
+
+        # Plans replace files with exported views as well
+        directory = Directory(name=self.tempdir)
+        directory['large.bin'].mode = MODE_BINARY
+        view = directory['large.bin'].buffer
+        inode = os.stat(path).st_ino
+        directory['large.bin'].data = b'cd'
+        directory.apply_plan(directory.plan())
+        self.assertNotEqual(os.stat(path).st_ino, inode)
+        self.assertEqual(view.tobytes(), b'ab')
+        view.release()
+
+        # Without exported views, files get written in place
+        inode = os.stat(path).st_ino
+        file = File(name=path)
+        file.mode = MODE_BINARY
+        file.buffer.release()
+        file.data = b'ef'
+        file()
+        self.assertEqual(os.stat(path).st_ino, inode)
+
+    def test_file_atomic_write(self):
+        filepath = os.path.join(self.tempdir, 'file.txt')
+
+        class AtomicFile(File):
+            atomic_write = True
+
+        stats = IOStats()
+        file = AtomicFile(name=filepath)
+        file.fs_backend = InstrumentedBackend(os_backend, [stats])
+        file.data = 'abc'
+        file()
+        with open(filepath) as f:
+            self.assertEqual(f.read(), 'abc')
+        self.assertEqual(os.listdir(self.tempdir), ['file.txt'])
+        # temporary file gets synced before replacing the file, the directory
+        # only with ``direct_sync``
+        self.assertEqual(stats.count('fsync'), 1)
+        self.assertEqual(stats.count('replace'), 1)
+        self.assertEqual(stats.count('fsync_directory'), 0)
+
+        # permissions of existing file are preserved
+        os.chmod(filepath, 0o640)
+        inode = os.stat(filepath).st_ino
+        file.data = 'def'
+        file()
+        with open(filepath) as f:
+            self.assertEqual(f.read(), 'def')
+        self.assertEqual(os.stat(filepath).st_mode & 0o777, 0o640)
+        self.assertNotEqual(os.stat(filepath).st_ino, inode)
+
+        # failing write leaves existing file untouched
+        class FailingStream(object):
+            def __iter__(self):
+                yield 'partial'
+                raise ValueError('Failed')
+
+        file.data = FailingStream()
+        with self.assertRaises(ValueError):
+            file()
+        with open(filepath) as f:
+            self.assertEqual(f.read(), 'def')
+        self.assertEqual(os.listdir(self.tempdir), ['file.txt'])
+
+    def test_skip_unchanged(self):
+        class SkippingFile(File):
+            skip_unchanged = True
+
+        class BinarySkippingFile(SkippingFile):
+            mode = MODE_BINARY
+
+        stats = IOStats()
+        backend = InstrumentedBackend(os_backend, [stats])
+        directory = Directory(name=self.tempdir, fs_backend=backend)
+        directory.default_file_factory = SkippingFile
+        directory['a.txt'] = SkippingFile()
+        directory['a.txt'].data = 'a\nb'
+        directory['a.txt'].fs_mode = 0o640
+        directory['b.bin'] = BinarySkippingFile()
+        directory['b.bin'].data = b'\x00' * 100
+        with track_writes() as written:
+            directory()
+        self.assertEqual(sorted(written), [
+            os.path.join(self.tempdir, 'a.txt'),
+            os.path.join(self.tempdir, 'b.bin')
+        ])
+        mtime = os.stat(os.path.join(self.tempdir, 'a.txt')).st_mtime_ns
+
+        # Identical data and mode are not written
+        directory = Directory(name=self.tempdir, fs_backend=backend)
+        directory.default_file_factory = SkippingFile
+        directory.factories = {'*.bin': BinarySkippingFile}
+        directory['a.txt'].data = 'a\nb'
+        directory['a.txt'].fs_mode = 0o640
+        directory['b.bin'].data = b'\x00' * 100
+        stats.reset()
+        with track_writes() as written:
+            directory()
+        self.assertEqual(written, [])
+        self.assertEqual(stats.count('chmod'), 0)
+        self.assertEqual(stats.count('open'), 2)
+        self.assertFalse(is_dirty(directory['a.txt']))
+        self.assertEqual(
+            os.stat(os.path.join(self.tempdir, 'a.txt')).st_mtime_ns,
+            mtime
+        )
+
+        # Different sizes are detected without reading the file
+        directory['a.txt'].data = 'a\nbc'
+        directory['b.bin'].data = b'\x00' * 99 + b'\x01'
+        stats.reset()
+        with track_writes() as written:
+            directory()
+        self.assertEqual(sorted(written), [
+            os.path.join(self.tempdir, 'a.txt'),
+            os.path.join(self.tempdir, 'b.bin')
+        ])
+        self.assertEqual(stats.count('open'), 3)
+        with open(os.path.join(self.tempdir, 'a.txt')) as f:
+            self.assertEqual(f.read(), 'a\nbc')
+
+        # Changed mode gets applied
+        directory['a.txt'].fs_mode = 0o600
+        directory()
+        self.assertEqual(
+            os.stat(os.path.join(self.tempdir, 'a.txt')).st_mode & 0o777,
+            0o600
+        )
+
+        # Cached contents are compared without reading the file
+        directory['a.txt'].content_cache = True
+        directory['a.txt'].data
+        directory['a.txt'].data = 'a\nbc'
+        stats.reset()
+        directory()
+        self.assertEqual(stats.count('open'), 0)
+
+        # Parallel flushing reports written files as well
+        directory = Directory(
+            name=self.tempdir,
+            fs_backend=backend,
+            flush_workers=2
+        )
+        directory.default_file_factory = SkippingFile
+        directory['a.txt'].data = 'a\nbc'
+        directory['c.txt'] = SkippingFile()
+        with track_writes() as written:
+            directory()
+        self.assertEqual(written, [os.path.join(self.tempdir, 'c.txt')])
+
+        # Without skip_unchanged, files are always written
+        directory = Directory(name=self.tempdir)
+        directory['a.txt'].data = 'a\nbc'
+        with track_writes() as written:
+            directory()
+        self.assertEqual(written, [os.path.join(self.tempdir, 'a.txt')])
+
+    def test_transactional_commit(self):
+        root = os.path.join(self.tempdir, 'root')
+        directory = Directory(name=root)
+        directory['a.txt'] = File()
+        directory['a.txt'].data = 'a'
+        directory['b.txt'] = File()
+        directory['b.txt'].data = 'b'
+        directory['sub'] = Directory()
+        directory['sub']['c.txt'] = File()
+        directory['sub']['c.txt'].data = 'c'
+        directory()
+
+        class FailingBackend(OSBackend):
+            fail = False
+
+            def replace(self, src, dst):
+                if self.fail and dst.endswith('c.txt'):
+                    self.fail = False
+                    raise OSError('replace failed')
+                os.replace(src, dst)
+
+        backend = FailingBackend()
+        directory = Directory(
+            name=root,
+            fs_backend=backend,
+            transactional=True
+        )
+        directory['a.txt'].data = 'changed'
+        directory['a.txt'].fs_mode = 0o600
+        del directory['b.txt']
+        directory.rename('sub', 'renamed')
+        directory['renamed']['c.txt'].data = 'changed'
+        directory['renamed']['d.txt'] = File()
+        directory['new'] = Directory()
+        directory['new']['e.txt'] = File()
+        directory['new']['e.txt'].data = 'e'
+
+        # Failure while applying reverts all changes and keeps pending
+        # changes in memory
+        backend.fail = True
+        with self.assertRaises(OSError):
+            directory()
+        self.assertEqual(sorted(os.listdir(root)), ['a.txt', 'b.txt', 'sub'])
+        self.assertEqual(os.listdir(os.path.join(root, 'sub')), ['c.txt'])
+        with open(os.path.join(root, 'a.txt')) as f:
+            self.assertEqual(f.read(), 'a')
+        self.assertNotEqual(
+            os.stat(os.path.join(root, 'a.txt')).st_mode & 0o777,
+            0o600
+        )
+        self.assertTrue(is_dirty(directory))
+        self.assertEqual(directory._deleted_fs_children, {'b.txt'})
+
+        with track_writes() as written:
+            directory()
+        self.assertEqual(sorted(written), [
+            os.path.join(root, 'a.txt'),
+            os.path.join(root, 'new', 'e.txt'),
+            os.path.join(root, 'renamed', 'c.txt'),
+            os.path.join(root, 'renamed', 'd.txt'),
+        ])
+        self.assertFalse(is_dirty(directory))
+        self.assertEqual(
+            sorted(os.listdir(root)),
+            ['a.txt', 'new', 'renamed']
+        )
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(root, 'renamed'))),
+            ['c.txt', 'd.txt']
+        )
+        with open(os.path.join(root, 'a.txt')) as f:
+            self.assertEqual(f.read(), 'changed')
+        with open(os.path.join(root, 'renamed', 'c.txt')) as f:
+            self.assertEqual(f.read(), 'changed')
+        self.assertEqual(
+            os.stat(os.path.join(root, 'a.txt')).st_mode & 0o777,
+            0o600
+        )
+        self.assertEqual(directory['new']['e.txt'].data, 'e')
+
+        # Nothing left to commit
+        with track_writes() as written:
+            directory()
+        self.assertEqual(written, [])
+        self.assertFalse(os.path.exists(os.path.join(root, JOURNAL_NAME)))
+
+    def test_plan(self):
+        root = os.path.join(self.tempdir, 'root')
+        directory = Directory(name=root)
+        directory['a.txt'] = File()
+        directory['a.txt'].data = 'a'
+        directory['b.txt'] = File()
+        directory['sub'] = Directory()
+        directory['sub']['c.bin'] = File()
+        directory['sub']['c.bin'].mode = MODE_BINARY
+        directory['sub']['c.bin'].data = b'cc'
+        directory()
+
+        stats = IOStats()
+        backend = InstrumentedBackend(os_backend, [stats])
+        directory = Directory(name=root, fs_backend=backend)
+        directory['a.txt'].data = '\xe4'
+        directory['a.txt'].fs_mode = 0o600
+        del directory['b.txt']
+        directory.rename('sub', 'renamed')
+        directory['renamed']['c.bin'].mode = MODE_BINARY
+        directory['renamed']['c.bin'].data = b'ccc'
+        directory['new'] = Directory()
+        directory['new']['d.txt'] = File()
+        directory['new']['d.txt'].data = 'dddd'
+        stats.reset()
+        plan = directory.plan()
+        # Planning only stats entries
+        self.assertEqual(
+            sorted(stats.operations),
+            ['exists', 'stat']
+        )
+        self.assertEqual(
+            [(op.kind, op.path[len(root):], op.size) for op in plan],
+            [
+                ('delete', '/b.txt', None),
+                ('rename', '/sub', None),
+                ('write', '/a.txt', 2),
+                ('chmod', '/a.txt', None),
+                ('write', '/renamed/c.bin', 3),
+                ('mkdir', '/new', None),
+                ('write', '/new/d.txt', 4),
+            ]
+        )
+        self.assertEqual(plan.operations[1].target, os.path.join(
+            root,
+            'renamed'
+        ))
+        self.assertEqual(plan.size, 9)
+        self.assertEqual(plan.count('write'), 3)
+        self.assertEqual(len(plan), 7)
+        self.checkOutput("""
+        <delete .../root/b.txt>
+        """, repr(plan.operations[0]))
+        self.assertEqual(sorted(os.listdir(root)), ['a.txt', 'b.txt', 'sub'])
+
+        # Redundant operations get removed
+        plan.operations[3].old_mode = 0o600
+        self.assertEqual(plan.coalesce(), 1)
+        self.assertEqual(len(plan), 6)
+
+        # Plan gets outdated if data changes
+        directory['a.txt'].data = 'other'
+        with self.assertRaises(RuntimeError):
+            directory.apply_plan(plan)
+        plan = directory.plan()
+        with track_writes() as written:
+            directory.apply_plan(plan)
+        self.assertEqual(len(written), 3)
+        self.assertFalse(is_dirty(directory))
+        self.assertEqual(
+            sorted(os.listdir(root)),
+            ['a.txt', 'new', 'renamed']
+        )
+        with open(os.path.join(root, 'renamed', 'c.bin'), 'rb') as f:
+            self.assertEqual(f.read(), b'ccc')
+        self.assertEqual(
+            os.stat(os.path.join(root, 'a.txt')).st_mode & 0o777,
+            0o600
+        )
+        self.assertEqual(len(directory.plan()), 0)
+
+        # Writes of unchanged files with equal size get verified on execution
+        directory['a.txt'].skip_unchanged = True
+        directory['a.txt'].data = 'other'
+        directory['new']['d.txt'].skip_unchanged = True
+        directory['new']['d.txt'].data = 'ddd'
+        plan = directory.plan()
+        self.assertEqual(
+            [(op.path[len(root):], op.verify) for op in plan],
+            [('/a.txt', True), ('/new/d.txt', False)]
+        )
+        with track_writes() as written:
+            directory.apply_plan(plan)
+        self.assertEqual(written, [os.path.join(root, 'new', 'd.txt')])
+
+        # Transactional directories commit plans using the journal
+        directory = Directory(name=root, transactional=True)
+        directory.rename('renamed', 'sub')
+        directory['sub']['c.bin'].mode = MODE_BINARY
+        directory['sub']['c.bin'].data = b'c'
+        plan = directory.plan()
+        directory.apply_plan(plan)
+        self.assertEqual(
+            sorted(os.listdir(root)),
+            ['a.txt', 'new', 'sub']
+        )
+        with open(os.path.join(root, 'sub', 'c.bin'), 'rb') as f:
+            self.assertEqual(f.read(), b'c')
+
+        # Plan gets outdated if structure or modes change
+        directory = Directory(name=root)
+        plan = directory.plan()
+        del directory['a.txt']
+        with self.assertRaises(RuntimeError):
+            directory.apply_plan(plan)
+        self.assertTrue(is_dirty(directory))
+        directory.apply_plan(directory.plan())
+        self.assertEqual(sorted(os.listdir(root)), ['new', 'sub'])
+
+        plan = directory.plan()
+        directory['sub']['y.txt'] = File()
+        with self.assertRaises(RuntimeError):
+            directory.apply_plan(plan)
+        self.assertTrue(is_dirty(directory['sub']))
+
+        directory['sub']['y.txt'].data = 'y'
+        plan = directory.plan()
+        directory['sub']['y.txt'].fs_mode = 0o600
+        with self.assertRaises(RuntimeError):
+            directory.apply_plan(plan)
+        directory.apply_plan(directory.plan())
+        self.assertFalse(is_dirty(directory))
+        self.assertEqual(
+            os.stat(os.path.join(root, 'sub', 'y.txt')).st_mode & 0o777,
+            0o600
+        )
+
+    def test_rename_and_add_same_name(self):
+        # Nodes added under a name which gets renamed away are created after
+        # the rename. Plans and ``__call__`` give the same result.
+        def tree(path):
+            result = dict()
+            for dirpath, dirnames, filenames in os.walk(path):
+                for name in filenames:
+                    with open(os.path.join(dirpath, name)) as f:
+                        result[os.path.relpath(
+                            os.path.join(dirpath, name),
+                            path
+                        )] = f.read()
+                for name in dirnames:
+                    result[os.path.relpath(
+                        os.path.join(dirpath, name),
+                        path
+                    )] = None
+            return result
+
+        results = list()
+        for mode in ['call', 'transactional', 'plan']:
+            root = os.path.join(self.tempdir, mode)
+            os.makedirs(os.path.join(root, 'a'))
+            with open(os.path.join(root, 'a', 'g'), 'w') as f:
+                f.write('old')
+            with open(os.path.join(root, 'f.txt'), 'w') as f:
+                f.write('old')
+            directory = Directory(
+                name=root,
+                transactional=mode == 'transactional'
+            )
+            directory.rename('a', 'A')
+            directory['a'] = Directory()
+            directory['a']['g'] = File()
+            directory['a']['g'].data = 'new'
+            directory.rename('f.txt', 'F.txt')
+            directory['f.txt'] = File()
+            directory['f.txt'].data = 'new'
+            if mode == 'plan':
+                plan = directory.plan()
+                self.assertEqual(
+                    [(op.kind, op.path[len(root):]) for op in plan],
+                    [
+                        ('rename', '/a'),
+                        ('rename', '/f.txt'),
+                        ('mkdir', '/a'),
+                        ('write', '/a/g'),
+                        ('write', '/f.txt'),
+                    ]
+                )
+                directory.apply_plan(plan)
+            else:
+                directory()
+            self.assertFalse(is_dirty(directory))
+            results.append(tree(root))
+        self.assertEqual(results[0], {
+            'A': None,
+            'A/g': 'old',
+            'F.txt': 'old',
+            'a': None,
+            'a/g': 'new',
+            'f.txt': 'new',
+        })
+        self.assertEqual(results[1], results[0])
+        self.assertEqual(results[2], results[0])
+
+    def test_subtree_lock(self):
+        root = os.path.join(self.tempdir, 'root')
+        directory = Directory(root)
+        directory['a'] = Directory()
+        directory['b'] = Directory()
+        directory['a']['a.txt'] = File()
+        directory['b']['b.txt'] = File()
+        directory()
+
+        def run(fn):
+            thread = threading.Thread(target=fn)
+            thread.start()
+            return thread
+
+        # Independent subtrees can be locked at the same time, locking an
+        # ancestor or descendant waits
+        events = list()
+        with subtree_lock(directory['a']):
+
+            def flush_b():
+                directory['b']['b.txt'].data = 'b'
+                directory['b']()
+                events.append('b')
+
+            thread_b = run(flush_b)
+            thread_b.join(1)
+            self.assertFalse(thread_b.is_alive())
+
+            def write():
+                directory['a']['a.txt'].data = 'a'
+                events.append('file')
+
+            def flush():
+                directory()
+                events.append('root')
+
+            thread_file = run(write)
+            thread_root = run(flush)
+            time.sleep(0.1)
+            self.assertEqual(events, ['b'])
+            # Locks are reentrant
+            with subtree_lock(directory['a']):
+                directory['a']['a.txt'].data = 'locked'
+            events.append('a')
+        thread_file.join()
+        thread_root.join()
+        self.assertEqual(events[:2], ['b', 'a'])
+        self.assertEqual(sorted(events[2:]), ['file', 'root'])
+
+        # Sibling subtrees get flushed concurrently
+        def flush_subtree(name):
+            for i in range(20):
+                directory[name]['{}.txt'.format(name)].data = str(i)
+                directory[name]()
+
+        threads = [run(lambda name=name: flush_subtree(name)) for name in 'ab']
+        for thread in threads:
+            thread.join()
+        for name in 'ab':
+            with open(os.path.join(root, name, name + '.txt')) as f:
+                self.assertEqual(f.read(), '19')
+
+        # Changing nodes only locks the parent directory, not the ancestors
+        directory['a']['sub'] = Directory()
+        directory['a']['sub']['c.txt'] = File()
+        directory()
+        with subtree_lock(directory['a']):
+            thread = run(
+                lambda: setattr(directory['a']['sub']['c.txt'], 'data', 'c')
+            )
+            thread.join(1)
+            self.assertFalse(thread.is_alive())
+            self.assertTrue(is_dirty(directory))
+
+        # Changes made after a directory has been processed while flushing
+        # leave it dirty
+        directory()
+
+        def late_change():
+            yield 'b'
+            directory['a']['a.txt'].data = 'late'
+
+        directory['b']['b.txt'].data = late_change()
+        directory()
+        self.assertTrue(is_dirty(directory))
+        self.assertTrue(is_dirty(directory['a']))
+        self.assertFalse(is_dirty(directory['b']))
+        directory()
+        self.assertFalse(is_dirty(directory))
+        with open(os.path.join(root, 'a', 'a.txt')) as f:
+            self.assertEqual(f.read(), 'late')
+
+        # Read locks cannot be upgraded
+        lock = RWLock()
+        lock.acquire_read()
+        with self.assertRaises(RuntimeError):
+            lock.acquire_write()
+        lock.release_read()
+        lock.acquire_write()
+        lock.acquire_read()
+        lock.release_read()
+        lock.release_write()
+
+    def test_file_locks(self):
+        root = os.path.join(self.tempdir, 'root')
+        os.mkdir(root)
+        locks = FileLocks(timeout=0.1)
+        directory = Directory(root, fs_locks=locks)
+        directory['sub'] = Directory()
+        directory['sub']['a.txt'] = File()
+        directory['sub']['b.txt'] = File()
+        directory()
+        self.assertEqual(locks.acquired, 1)
+        self.assertEqual(locks.contended, 0)
+        self.assertIs(directory['sub']['a.txt'].fs_locks, locks)
+        # Lock files are hidden
+        self.assertTrue(os.path.exists(os.path.join(root, LOCK_NAME)))
+        self.assertEqual(list(directory), ['sub'])
+        self.assertEqual(len(list(directory.walk())), 3)
+
+        def hold(path, start=0):
+            # Lock lock file in other process until stdin gets closed
+            process = subprocess.Popen(
+                [sys.executable, '-c', (
+                    'import fcntl, os, sys\n'
+                    'fd = os.open(sys.argv[1], os.O_RDWR | os.O_CREAT)\n'
+                    'start = int(sys.argv[2])\n'
+                    'fcntl.lockf(fd, fcntl.LOCK_EX, 1 if start else 0, start)\n'
+                    'print("locked", flush=True)\n'
+                    'sys.stdin.read()\n'
+                ), os.path.join(path, LOCK_NAME), str(start)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE
+            )
+            self.assertEqual(process.stdout.readline(), b'locked\n')
+            return process
+
+        def release(process):
+            process.stdin.close()
+            process.wait()
+            process.stdout.close()
+
+        # Root lock
+        process = hold(root)
+        directory['sub']['a.txt'].data = 'a'
+        with self.assertRaises(TimeoutError):
+            directory['sub']['a.txt']()
+        self.assertEqual(locks.contended, 1)
+        self.assertEqual(locks.timeouts, 1)
+        self.assertTrue(is_dirty(directory))
+        release(process)
+        directory()
+        with open(os.path.join(root, 'sub', 'a.txt')) as f:
+            self.assertEqual(f.read(), 'a')
+        self.assertEqual(locks.as_dict()['acquired'], 2)
+
+        # File locks
+        locks.policy = LOCK_FILE
+        locks.reset()
+        sub = os.path.join(root, 'sub')
+        name = 'a.txt'.encode('utf-8')
+        process = hold(sub, zlib.crc32(name) + 1)
+        directory['sub']['b.txt'].data = 'b'
+        directory['sub']['b.txt']()
+        directory['sub']['a.txt'].data = 'other'
+        with self.assertRaises(TimeoutError):
+            directory['sub']['a.txt']()
+        with self.assertRaises(TimeoutError):
+            directory()
+        self.assertEqual(locks.timeouts, 2)
+        release(process)
+        directory()
+        with open(os.path.join(sub, 'a.txt')) as f:
+            self.assertEqual(f.read(), 'other')
+
+        # Directory locks. Parent directories are locked shared
+        locks.policy = LOCK_DIRECTORY
+        process = hold(root)
+        directory['sub']['a.txt'].data = 'a'
+        with self.assertRaises(TimeoutError):
+            directory['sub']['a.txt']()
+        release(process)
+        directory['sub']['a.txt']()
+        directory['new'] = Directory()
+        directory['new']['c.txt'] = File()
+        directory['new']()
+        self.assertTrue(os.path.exists(os.path.join(root, 'new', 'c.txt')))
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(root, 'new'))),
+            ['c.txt']
+        )
+
+        # Instrumented OS backends are native
+        directory['new'].fs_backend = InstrumentedBackend(os_backend, [])
+        directory['new']['c.txt'].data = 'c'
+        directory['new']()
+
+        # No lock files get created on behalf of trees on virtual backends
+        locks = FileLocks(timeout=0.1)
+        virtual = os.path.join(self.tempdir, 'virtual', 'tree')
+        backend = MemoryBackend()
+        backend.makedirs(virtual)
+        directory = Directory(virtual, fs_backend=backend, fs_locks=locks)
+        directory['a.txt'] = File()
+        with self.assertRaises(RuntimeError):
+            directory()
+        self.assertFalse(backend.exists(os.path.join(virtual, 'a.txt')))
+        self.assertEqual(
+            sorted(os.listdir(self.tempdir)),
+            ['root']
+        )
+        self.assertEqual(locks.acquired, 0)
+
+    def test_transaction_recovery(self):
+        root = os.path.join(self.tempdir, 'root')
+        os.mkdir(root)
+        with open(os.path.join(root, 'a.txt'), 'w') as f:
+            f.write('a')
+
+        # Transaction interrupted after journal has been written gets rolled
+        # forward
+        journal = Journal(root)
+        journal.begin()
+        stage = journal.stage_path('stage')
+        with open(stage, 'w') as f:
+            f.write('changed')
+        journal.add(
+            WRITE,
+            os.path.join(root, 'a.txt'),
+            stage,
+            journal.stage_path('backup')
+        )
+        journal.add(
+            RENAME,
+            os.path.join(root, 'a.txt'),
+            os.path.join(root, 'b.txt')
+        )
+        journal.commit()
+        apply_operation(os_backend, journal.operations[0])
+
+        # Staging directory is never contained in listings
+        directory = Directory(name=root)
+        self.assertEqual(list(directory), ['a.txt'])
+
+        directory = Directory(name=root, transactional=True)
+        self.assertEqual(list(directory), ['b.txt'])
+        self.assertEqual(directory['b.txt'].data, 'changed')
+        self.assertEqual(os.listdir(root), ['b.txt'])
+
+        # Transaction interrupted while staging gets rolled back
+        journal = Journal(root)
+        journal.begin()
+        with open(journal.stage_path('stage'), 'w') as f:
+            f.write('staged')
+        directory = Directory(name=root, transactional=True)
+        directory['c.txt'] = File()
+        directory()
+        self.assertEqual(sorted(os.listdir(root)), ['b.txt', 'c.txt'])
+
+        # Transaction gets recovered on first access, also if the listing is
+        # not read. Crash happened after the original file has been moved to
+        # backup
+        def crash(data):
+            journal = Journal(root)
+            journal.begin()
+            stage = journal.stage_path('stage')
+            with open(stage, 'w') as f:
+                f.write(data)
+            backup = journal.stage_path('backup')
+            journal.add(WRITE, os.path.join(root, 'b.txt'), stage, backup)
+            journal.commit()
+            os.rename(os.path.join(root, 'b.txt'), backup)
+
+        crash('recovered')
+        directory = Directory(name=root, transactional=True)
+        self.assertEqual(directory['b.txt'].data, 'recovered')
+        self.assertEqual(sorted(os.listdir(root)), ['b.txt', 'c.txt'])
+
+        crash('contained')
+        directory = Directory(name=root, transactional=True)
+        self.assertTrue('b.txt' in directory)
+        self.assertEqual(sorted(os.listdir(root)), ['b.txt', 'c.txt'])
+
+        # Planning does not recover, applying an outdated plan fails
+        crash('planned')
+        directory = Directory(name=root, transactional=True)
+        plan = directory.plan()
+        self.assertEqual(sorted(os.listdir(root)), [JOURNAL_NAME, 'c.txt'])
+        with self.assertRaises(RuntimeError):
+            directory.apply_plan(plan)
+        self.assertEqual(sorted(os.listdir(root)), ['b.txt', 'c.txt'])
+
+    def test_directory_sync_batching(self):
+        class SyncRecordingBackend(OSBackend):
+            def __init__(self):
+                self.synced = []
+
+            def fsync_directory(self, path):
+                self.synced.append(path)
+
+        class AtomicFile(File):
+            atomic_write = True
+            direct_sync = True
+
+        backend = SyncRecordingBackend()
+        file = AtomicFile(name=os.path.join(self.tempdir, 'file.txt'))
+        file.fs_backend = backend
+        file()
+        self.assertEqual(backend.synced, [self.tempdir])
+
+        backend = SyncRecordingBackend()
+        directory = Directory(name=self.tempdir)
+        directory.fs_backend = backend
+        directory['a.txt'] = AtomicFile()
+        directory['b.txt'] = AtomicFile()
+        subdir = directory['subdir'] = Directory()
+        subdir['c.txt'] = AtomicFile()
+        directory['d.txt'] = File()
+        directory()
+        self.assertEqual(
+            sorted(backend.synced),
+            [self.tempdir, os.path.join(self.tempdir, 'subdir')]
+        )
+
+    def test_fs_backend(self):
+        directory = Directory(name=self.tempdir)
+        self.assertTrue(directory.fs_backend is os_backend)
+        file = directory['file.txt'] = File()
+        self.assertTrue(file.fs_backend is os_backend)
+        self.assertTrue(get_fs_backend(FSLocationObject()) is os_backend)
+
+        stats = IOStats()
+        backend = InstrumentedBackend(os_backend, [stats])
+        directory.fs_backend = backend
+        self.assertTrue(file.fs_backend is backend)
+
+        file.data = 'data'
+        file.fs_mode = 0o644
+        directory()
+        self.assertEqual(stats.count('open'), 1)
+        self.assertEqual(stats.count('chmod'), 1)
+        self.assertEqual(stats.count('rename'), 0)
+        self.assertEqual(stats.subtrees, {})
+
+        # Stats per subtree
+        subdir = directory['subdir'] = Directory()
+        subdir.fs_backend = InstrumentedBackend(
+            os_backend,
+            [stats],
+            label='subdir'
+        )
+        subdir['file.txt'] = File()
+        stats.reset()
+        directory()
+        self.assertEqual(stats.count('mkdir'), 1)
+        self.assertEqual(stats.count('mkdir', label='subdir'), 1)
+        self.assertEqual(stats.count('open'), 1)
+        self.assertEqual(stats.count('open', label='subdir'), 1)
+        self.assertEqual(stats.count('open', label='other'), 0)
+
+        directory = Directory(name=self.tempdir)
+        directory.fs_backend = backend
+        stats.reset()
+        self.assertEqual(sorted(directory.keys()), ['file.txt', 'subdir'])
+        self.assertEqual(directory['file.txt'].data, 'data')
+        self.assertEqual(stats.count('scandir'), 1)
+        self.assertEqual(stats.count('open'), 1)
+
+        exported = stats.as_dict()
+        self.assertEqual(sorted(exported), ['operations', 'subtrees'])
+        self.assertEqual(exported['operations']['open']['count'], 1)
+        self.assertTrue(exported['operations']['open']['seconds'] >= 0)
+
+        # Hooks are called for failing operations as well
+        calls = []
+        backend = InstrumentedBackend(
+            os_backend,
+            [lambda *args: calls.append(args[:2])],
+            label='label'
+        )
+        with self.assertRaises(OSError):
+            backend.stat(os.path.join(self.tempdir, 'inexistent'))
+        self.assertEqual(calls, [('stat', 'label')])
+
+        # Resolved backends are cached and invalidated if a backend gets set
+        # or a subtree gets moved
+        directory = Directory(name=self.tempdir)
+        sub = directory['sub'] = Directory()
+        file = sub['file.txt'] = File()
+        self.assertTrue(file.fs_backend is os_backend)
+        self.assertEqual(file._fs_backend_cache[1:], (sub, (os_backend, None)))
+        sub.fs_backend = backend
+        self.assertTrue(file.fs_backend is backend)
+
+        tree = Directory()
+        tree['nested'] = Directory()
+        file = tree['nested']['file.txt'] = File()
+        self.assertTrue(file.fs_backend is os_backend)
+        memory_backend = MemoryBackend()
+        other = Directory(name='/other', fs_backend=memory_backend)
+        other['tree'] = tree
+        self.assertTrue(file.fs_backend is memory_backend)
+
+    def test_memory_backend(self):
+        backend = MemoryBackend()
+        root = os.path.join(self.tempdir, 'root')
+        self.assertFalse(backend.exists(root))
+        backend.makedirs(self.tempdir)
+        self.assertTrue(backend.isdir(self.tempdir))
+
+        directory = Directory(name=root, fs_backend=backend)
+        directory['file.txt'] = File()
+        directory['file.txt'].lines = ['a', 'b']
+        directory['file.bin'] = File()
+        directory['file.bin'].mode = MODE_BINARY
+        directory['file.bin'].data = b'\x00\x01'
+        subdir = directory['subdir'] = Directory()
+        subdir['sub.txt'] = File()
+        subdir['sub.txt'].fs_mode = 0o600
+        directory()
+
+        # Nothing written to disk
+        self.assertEqual(os.listdir(self.tempdir), [])
+        self.assertTrue(backend.isdir(root))
+        self.assertEqual(
+            sorted(entry.name for entry in backend.scandir(root)),
+            ['file.bin', 'file.txt', 'subdir']
+        )
+        sub_path = os.path.join(root, 'subdir', 'sub.txt')
+        self.assertEqual(backend.stat(sub_path).st_mode & 0o777, 0o600)
+
+        directory = Directory(name=root, fs_backend=backend)
+        self.assertEqual(
+            sorted(directory.keys()),
+            ['file.bin', 'file.txt', 'subdir']
+        )
+        self.assertIsInstance(directory['subdir'], Directory)
+        self.assertEqual(directory['file.txt'].data, 'a\nb')
+        self.assertEqual(list(directory['file.txt'].lines), ['a', 'b'])
+        binfile = directory['file.bin']
+        binfile.mode = MODE_BINARY
+        self.assertEqual(binfile.data, b'\x00\x01')
+        self.assertEqual(binfile.buffer[1:].tobytes(), b'\x01')
+        self.assertEqual(directory['subdir']['sub.txt'].fs_mode, 0o600)
+
+        directory.rename('file.txt', 'renamed.txt')
+        del directory['subdir']
+        directory()
+        self.assertEqual(
+            sorted(entry.name for entry in backend.scandir(root)),
+            ['file.bin', 'renamed.txt']
+        )
+
+        class AtomicFile(File):
+            atomic_write = True
+            direct_sync = True
+
+        directory['atomic.txt'] = AtomicFile()
+        directory['atomic.txt'].data = 'atomic'
+        directory()
+        with backend.open(os.path.join(root, 'atomic.txt')) as f:
+            self.assertEqual(f.read(), 'atomic')
+        self.assertEqual(
+            sorted(entry.name for entry in backend.scandir(root)),
+            ['atomic.txt', 'file.bin', 'renamed.txt']
+        )
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+        # Errors are raised like by ``os``
+        path = os.path.join(root, 'inexistent')
+        with self.assertRaises(FileNotFoundError):
+            backend.stat(path)
+        with self.assertRaises(FileNotFoundError):
+            backend.open(os.path.join(path, 'file.txt'), 'w')
+        with self.assertRaises(FileExistsError):
+            backend.mkdir(root)
+        with self.assertRaises(FileExistsError):
+            backend.open(os.path.join(root, 'renamed.txt'), 'x')
+        with self.assertRaises(IsADirectoryError):
+            backend.remove(root)
+        with self.assertRaises(NotADirectoryError):
+            backend.rmtree(os.path.join(root, 'renamed.txt'))
+        with self.assertRaises(ValueError):
+            backend.open(os.path.join(root, 'renamed.txt'), 'a')
+
+        # Modification time and size change on write
+        path = os.path.join(root, 'renamed.txt')
+        before = backend.stat(path)
+        with backend.open(path, 'w') as f:
+            f.write('changed')
+        after = backend.stat(path)
+        self.assertTrue(after.st_mtime_ns > before.st_mtime_ns)
+        self.assertEqual(after.st_size, 7)
+        self.assertEqual(after.st_ino, before.st_ino)
+
+    def test_content_cache(self):
+        stats = IOStats()
+        memory = MemoryBackend()
+        memory.makedirs(self.tempdir)
+        backend = InstrumentedBackend(memory, [stats])
+        path = os.path.join(self.tempdir, 'file.txt')
+        with memory.open(path, 'w') as f:
+            f.write('a\nb')
+
+        class CachedFile(File):
+            content_cache = True
+
+        # Without content cache data gets read on each access
+        file = File(name=path)
+        file.fs_backend = backend
+        self.assertEqual(file.data, 'a\nb')
+        self.assertEqual(file.data, 'a\nb')
+        self.assertEqual(stats.count('open'), 2)
+
+        stats.reset()
+        file = CachedFile(name=path)
+        file.fs_backend = backend
+        self.assertEqual(file.data, 'a\nb')
+        self.assertEqual(file.data, 'a\nb')
+        self.assertEqual(list(file.lines), ['a', 'b'])
+        self.assertEqual(list(file.iter_data(size=2)), ['a\n', 'b'])
+        self.assertEqual(stats.count('open'), 1)
+        self.assertEqual(stats.count('stat'), 1)
+
+        # Refresh does not drop unchanged content
+        stats.reset()
+        file.refresh()
+        self.assertEqual(file.data, 'a\nb')
+        self.assertEqual(stats.count('stat'), 1)
+        self.assertEqual(stats.count('open'), 0)
+
+        # External change is detected on refresh
+        with memory.open(path, 'w') as f:
+            f.write('changed')
+        self.assertEqual(file.data, 'a\nb')
+        file.refresh()
+        self.assertEqual(file.data, 'changed')
+
+        # Written data is cached
+        stats.reset()
+        file.data = 'written'
+        file()
+        self.assertEqual(file.data, 'written')
+        self.assertEqual(stats.count('open'), 1)
+        file.refresh()
+        self.assertEqual(file.data, 'written')
+        self.assertEqual(stats.count('open'), 1)
+
+        # Inexistent file
+        file = CachedFile(name=os.path.join(self.tempdir, 'inexistent.txt'))
+        file.fs_backend = backend
+        self.assertEqual(file.data, '')
+        with memory.open(join_fs_path(file), 'w') as f:
+            f.write('created')
+        self.assertEqual(file.data, '')
+        file.refresh()
+        self.assertEqual(file.data, 'created')
+
+        # Binary buffer is served from cache and memory map gets released
+        # on refresh if file has changed
+        path = os.path.join(self.tempdir, 'file.bin')
+        with memory.open(path, 'wb') as f:
+            f.write(b'abc')
+        file = File(name=path)
+        file.fs_backend = backend
+        file.mode = MODE_BINARY
+        self.assertEqual(file.buffer.tobytes(), b'abc')
+        file.refresh()
+        self.assertEqual(file.buffer.tobytes(), b'abc')
+        with memory.open(path, 'wb') as f:
+            f.write(b'abcd')
+        file.refresh()
+        self.assertEqual(file.buffer.tobytes(), b'abcd')
+
+        stats.reset()
+        file = CachedFile(name=path)
+        file.fs_backend = backend
+        file.mode = MODE_BINARY
+        self.assertEqual(file.data, b'abcd')
+        self.assertEqual(file.buffer.tobytes(), b'abcd')
+        self.assertEqual(stats.count('mmap'), 0)
+
+    def test_directory_refresh(self):
+        stats = IOStats()
+        memory = MemoryBackend()
+        memory.makedirs(self.tempdir)
+        backend = InstrumentedBackend(memory, [stats])
+
+        class CachedFile(File):
+            content_cache = True
+
+        root = os.path.join(self.tempdir, 'root')
+        directory = Directory(name=root, fs_backend=backend)
+        directory.default_file_factory = CachedFile
+        directory['file.txt'] = CachedFile()
+        directory['file.txt'].data = 'data'
+        directory['subdir'] = Directory()
+        directory['subdir']['other.txt'] = CachedFile()
+        directory()
+
+        directory = Directory(name=root, fs_backend=backend)
+        directory.default_file_factory = CachedFile
+        self.assertEqual(sorted(directory), ['file.txt', 'subdir'])
+        self.assertEqual(directory['file.txt'].data, 'data')
+        subdir = directory['subdir']
+        subdir.default_file_factory = CachedFile
+        self.assertEqual(list(subdir), ['other.txt'])
+
+        # Unchanged tree gets revalidated by stat calls of directories and
+        # loaded files only
+        stats.reset()
+        directory.refresh()
+        self.assertEqual(stats.count('scandir'), 0)
+        self.assertEqual(stats.count('open'), 0)
+        self.assertEqual(stats.count('stat'), 3)
+        self.assertEqual(sorted(directory), ['file.txt', 'subdir'])
+        self.assertEqual(directory['file.txt'].data, 'data')
+        self.assertEqual(stats.count('open'), 0)
+
+        # External changes
+        memory.remove(os.path.join(root, 'file.txt'))
+        memory.mkdir(os.path.join(root, 'new'))
+        with memory.open(os.path.join(root, 'subdir', 'other.txt'), 'w') as f:
+            f.write('changed')
+        stats.reset()
+        directory.refresh()
+        self.assertEqual(stats.count('scandir'), 1)
+        self.assertEqual(sorted(directory), ['new', 'subdir'])
+        self.assertEqual(sorted(directory.storage), ['subdir'])
+        self.assertFalse('file.txt' in directory)
+        self.assertEqual(directory['subdir']['other.txt'].data, 'changed')
+
+        # Modified children are kept
+        directory['new']['file.txt'] = CachedFile()
+        memory.rmtree(os.path.join(root, 'new'))
+        directory.refresh()
+        self.assertEqual(sorted(directory.storage), ['new', 'subdir'])
+
+    def test_inotify_watcher(self):
+        if not inotify_available():
+            self.skipTest('inotify not available')
+
+        class CachedFile(File):
+            content_cache = True
+
+        root = os.path.join(self.tempdir, 'root')
+        os.mkdir(root)
+        os.mkdir(os.path.join(root, 'subdir'))
+        with open(os.path.join(root, 'file.txt'), 'w') as f:
+            f.write('data')
+        with open(os.path.join(root, 'subdir', 'sub.txt'), 'w') as f:
+            f.write('sub')
+
+        directory = Directory(name=root)
+        directory.default_file_factory = CachedFile
+        watcher = create_watcher(directory)
+        self.assertIsInstance(watcher, InotifyWatcher)
+        self.assertEqual(
+            sorted(watcher._watches.values()),
+            [(), ('subdir',)]
+        )
+        try:
+            self.assertEqual(sorted(directory), ['file.txt', 'subdir'])
+            file = directory['file.txt']
+            self.assertEqual(file.data, 'data')
+            subdir = directory['subdir']
+            sub = subdir['sub.txt']
+            self.assertNotEqual(sub.fs_mode, 0o600)
+            self.assertEqual(watcher.process_events(), 0)
+
+            # Content changes drop content cache
+            with open(os.path.join(root, 'file.txt'), 'w') as f:
+                f.write('changed')
+            self.assertTrue(watcher.process_events(timeout=1))
+            self.assertEqual(file.data, 'changed')
+            self.assertTrue(directory['file.txt'] is file)
+
+            # Mode changes drop cached mode
+            os.chmod(os.path.join(root, 'subdir', 'sub.txt'), 0o600)
+            self.assertTrue(watcher.process_events(timeout=1))
+            self.assertEqual(sub.fs_mode, 0o600)
+
+            # Structural changes drop listing and evict removed children
+            os.remove(os.path.join(root, 'file.txt'))
+            os.mkdir(os.path.join(root, 'new'))
+            self.assertTrue(watcher.process_events(timeout=1))
+            self.assertEqual(sorted(directory), ['new', 'subdir'])
+            self.assertEqual(sorted(directory.storage), ['subdir'])
+
+            # New directories get watched
+            self.assertEqual(
+                sorted(watcher._watches.values()),
+                [(), ('new',), ('subdir',)]
+            )
+            new = directory['new']
+            self.assertEqual(list(new), [])
+            with open(os.path.join(root, 'new', 'file.txt'), 'w') as f:
+                f.write('new')
+            self.assertTrue(watcher.process_events(timeout=1))
+            self.assertEqual(list(new), ['file.txt'])
+
+            # Moved directories
+            os.rename(os.path.join(root, 'new'), os.path.join(root, 'moved'))
+            self.assertTrue(watcher.process_events(timeout=1))
+            self.assertEqual(
+                sorted(watcher._watches.values()),
+                [(), ('moved',), ('subdir',)]
+            )
+            self.assertEqual(sorted(directory), ['moved', 'subdir'])
+
+            # Modified children are kept
+            subdir['other.txt'] = CachedFile()
+            shutil.rmtree(os.path.join(root, 'moved'))
+            shutil.rmtree(os.path.join(root, 'subdir'))
+            self.assertTrue(watcher.process_events(timeout=1))
+            self.assertEqual(sorted(directory.storage), ['subdir'])
+        finally:
+            watcher.stop()
+        self.assertEqual(watcher.process_events(), 0)
+
+        # Background thread
+        directory = Directory(name=root)
+        directory.default_file_factory = CachedFile
+        directory['file.txt'] = CachedFile()
+        directory['file.txt'].data = 'data'
+        directory()
+        with create_watcher(directory, interval=0.01):
+            with open(os.path.join(root, 'file.txt'), 'w') as f:
+                f.write('changed')
+            for _ in range(100):
+                if directory['file.txt'].data == 'changed':
+                    break
+                time.sleep(0.01)
+        self.assertEqual(directory['file.txt'].data, 'changed')
+
+    def test_polling_watcher(self):
+        backend = MemoryBackend()
+        backend.makedirs(self.tempdir)
+
+        class CachedFile(File):
+            content_cache = True
+
+        directory = Directory(name=self.tempdir, fs_backend=backend)
+        directory.default_file_factory = CachedFile
+        directory['file.txt'] = CachedFile()
+        directory['file.txt'].data = 'data'
+        directory()
+
+        watcher = create_watcher(directory)
+        self.assertIsInstance(watcher, PollingWatcher)
+        path = os.path.join(self.tempdir, 'file.txt')
+        with backend.open(path, 'w') as f:
+            f.write('changed')
+        self.assertEqual(directory['file.txt'].data, 'data')
+        watcher.process_events()
+        self.assertEqual(directory['file.txt'].data, 'changed')
+
+        with create_watcher(directory, interval=0.01):
+            backend.remove(path)
+            for _ in range(100):
+                if 'file.txt' not in directory:
+                    break
+                time.sleep(0.01)
+        self.assertEqual(list(directory), [])
+
+    def test_walk(self):
+        root = os.path.join(self.tempdir, 'root')
+        os.makedirs(os.path.join(root, 'a', 'aa'))
+        os.mkdir(os.path.join(root, 'b'))
+        os.mkdir(os.path.join(root, 'ignored'))
+        for path in [
+            ['file.txt'],
+            ['file.py'],
+            ['a', 'file.txt'],
+            ['a', 'aa', 'file.py'],
+            ['b', 'file.txt'],
+            ['ignored', 'file.txt'],
+        ]:
+            with open(os.path.join(root, *path), 'w') as f:
+                f.write('data')
+        os.symlink(os.path.join(root, 'a'), os.path.join(root, 'link'))
+
+        directory = Directory(name=root, ignores=['ignored'])
+        entries = sorted(directory.walk(), key=lambda entry: entry.names)
+        self.assertEqual([(entry.names, entry.type) for entry in entries], [
+            (('a',), 'directory'),
+            (('a', 'aa'), 'directory'),
+            (('a', 'aa', 'file.py'), 'file'),
+            (('a', 'file.txt'), 'file'),
+            (('b',), 'directory'),
+            (('b', 'file.txt'), 'file'),
+            (('file.py',), 'file'),
+            (('file.txt',), 'file'),
+            (('link',), 'directory'),
+        ])
+        entry = entries[3]
+        self.assertEqual(entry.path, os.path.join(root, 'a', 'file.txt'))
+        self.assertEqual(entry.stat.st_size, 4)
+        self.assertEqual(entry.node, None)
+        # No nodes created
+        self.assertEqual(list(directory.storage), [])
+
+        # Depth
+        self.assertEqual(
+            sorted(entry.names for entry in directory.walk(depth=1)),
+            [('a',), ('b',), ('file.py',), ('file.txt',), ('link',)]
+        )
+
+        # Symlinks
+        self.assertEqual(
+            sorted(
+                entry.names
+                for entry in directory.walk(depth=2, followlinks=True)
+                if entry.names[0] == 'link'
+            ),
+            [('link',), ('link', 'aa'), ('link', 'file.txt')]
+        )
+
+        # Patterns
+        self.assertEqual(
+            sorted(entry.names for entry in directory.walk(patterns=['*.py'])),
+            [('a', 'aa', 'file.py'), ('file.py',)]
+        )
+
+        # Materialize nodes of matching entries
+        entries = sorted(
+            directory.walk(patterns=['*.py'], materialize=True),
+            key=lambda entry: entry.names
+        )
+        self.assertIsInstance(entries[0].node, File)
+        self.assertEqual(entries[0].node.path, [root, 'a', 'aa', 'file.py'])
+        self.assertEqual(entries[0].node.data, 'data')
+        self.assertEqual(entries[1].node.path, [root, 'file.py'])
+        self.assertEqual(sorted(directory.storage), ['a', 'file.py'])
+        self.assertEqual(list(directory['a'].storage), ['aa'])
+
+        # Pending deletes and renames of loaded directories are considered
+        del directory['b']
+        directory['a'].rename('file.txt', 'renamed.txt')
+        self.assertEqual(
+            sorted(entry.names for entry in directory.walk(depth=2)),
+            [
+                ('a',),
+                ('a', 'aa'),
+                ('a', 'renamed.txt'),
+                ('file.py',),
+                ('file.txt',),
+                ('link',),
+            ]
+        )
+        entries = [
+            entry for entry in directory.walk(
+                patterns=['renamed.txt'],
+                materialize=True
+            )
+        ]
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].node.name, 'renamed.txt')
+        self.assertEqual(
+            entries[0].path,
+            os.path.join(root, 'a', 'file.txt')
+        )
+
+        # Ignores are the ones of the directory node, whether loaded or not
+        class IgnoringDirectory(Directory):
+            ignores = ['y.pyc']
+
+        root = os.path.join(self.tempdir, 'ignores')
+        os.makedirs(os.path.join(root, 'sub', 'child'))
+        for path in [
+            ['x.pyc'],
+            ['sub', 'x.pyc'],
+            ['sub', 'y.pyc'],
+            ['sub', 'child', 'y.pyc'],
+        ]:
+            with open(os.path.join(root, *path), 'w') as f:
+                f.write('data')
+        directory = Directory(
+            name=root,
+            ignores=['x.pyc'],
+            factories={'sub': IgnoringDirectory}
+        )
+        expected = [
+            ('sub',),
+            ('sub', 'child'),
+            ('sub', 'child', 'y.pyc'),
+            ('sub', 'x.pyc'),
+        ]
+        self.assertEqual(
+            sorted(entry.names for entry in directory.walk()),
+            expected
+        )
+        self.assertEqual(list(directory.storage), [])
+        self.assertEqual(
+            sorted(directory['sub']),
+            ['child', 'x.pyc']
+        )
+        self.assertEqual(
+            sorted(entry.names for entry in directory.walk()),
+            expected
+        )
+
+    def test_load(self):
+        class TextFile(File):
+            pass
+
+        root = os.path.join(self.tempdir, 'root')
+        os.makedirs(os.path.join(root, 'a', 'aa'))
+        os.mkdir(os.path.join(root, 'b'))
+        for path in [
+            ('file.txt',),
+            ('file.bin',),
+            ('ignored',),
+            ('a', 'file.txt'),
+            ('a', 'aa', 'file.txt'),
+        ]:
+            with open(os.path.join(root, *path), 'w') as f:
+                f.write('/'.join(path))
+
+        stats = IOStats()
+        backend = InstrumentedBackend(os_backend, [stats])
+        directory = Directory(
+            name=root,
+            fs_backend=backend,
+            factories={'*.txt': TextFile},
+            ignores=['ignored']
+        )
+        del directory['b']
+        directory.load()
+        self.assertEqual(stats.count('scandir'), 1)
+        self.assertEqual(
+            sorted(directory.storage),
+            ['a', 'file.bin', 'file.txt']
+        )
+        self.assertIsInstance(directory.storage['file.txt'], TextFile)
+        self.assertFalse(is_dirty(directory.storage['file.txt']))
+        self.assertEqual(len(directory['a'].storage), 0)
+
+        # Recursive loading with prefetched data
+        stats.reset()
+        directory.load(depth=None, data=True, workers=2)
+        self.assertEqual(stats.count('scandir'), 2)
+        self.assertEqual(stats.count('open'), 4)
+        self.assertEqual(
+            sorted(directory['a'].storage),
+            ['aa', 'file.txt']
+        )
+        # Factories apply to direct children only
+        self.assertIsInstance(directory['a']['aa']['file.txt'], File)
+        self.assertNotIsInstance(directory['a']['aa']['file.txt'], TextFile)
+        stats.reset()
+        self.assertEqual(
+            directory['a']['aa']['file.txt'].data,
+            'a/aa/file.txt'
+        )
+        self.assertEqual(directory['file.bin'].data, 'file.bin')
+        self.assertEqual(stats.count('open'), 0)
+
+        # Already loaded and cached children are kept
+        file = directory['file.txt']
+        directory.load(depth=2, data=True)
+        self.assertTrue(directory['file.txt'] is file)
+        self.assertEqual(stats.count('open'), 0)
+        self.assertEqual(stats.count('scandir'), 0)
+
+        # Loaded children are subject to the child cache policy
+        directory = Directory(name=root, child_cache=CACHE_NONE)
+        directory.load(depth=None)
+        self.assertEqual(len(directory.storage), 0)
+
+        # Files with prefetched data and their ancestors are pinned
+        stats.reset()
+        directory = Directory(
+            name=root,
+            fs_backend=backend,
+            ignores=['ignored'],
+            child_cache=CACHE_NONE
+        )
+        directory.load(depth=None, data=True)
+        self.assertEqual(stats.count('open'), 4)
+        self.assertEqual(
+            sorted(directory.storage),
+            ['a', 'file.bin', 'file.txt']
+        )
+        self.assertEqual(sorted(directory['a'].storage), ['aa', 'file.txt'])
+        self.assertEqual(
+            directory['a']['aa']['file.txt'].data,
+            'a/aa/file.txt'
+        )
+        self.assertEqual(directory['file.txt'].data, 'file.txt')
+        self.assertEqual(stats.count('open'), 4)
+
+    def test_prefetch_data(self):
+        root = os.path.join(self.tempdir, 'root')
+        os.makedirs(os.path.join(root, 'a', 'aa'))
+        for path in [
+            ('1.cfg',),
+            ('2.cfg',),
+            ('other.txt',),
+            ('a', '3.cfg'),
+            ('a', 'aa', '4.cfg'),
+        ]:
+            with open(os.path.join(root, *path), 'w') as f:
+                f.write('line 1\n{}'.format(path[-1]))
+
+        stats = IOStats()
+        backend = InstrumentedBackend(os_backend, [stats])
+        directory = Directory(name=root, fs_backend=backend)
+        directory['1.cfg'].data = 'pending'
+        stats.reset()
+        directory.prefetch_data(patterns=['*.cfg'], depth=2, workers=2)
+        self.assertEqual(stats.count('open'), 2)
+        self.assertEqual(sorted(directory.storage), ['1.cfg', '2.cfg', 'a'])
+        self.assertEqual(sorted(directory['a'].storage), ['3.cfg'])
+
+        stats.reset()
+        self.assertEqual(directory['1.cfg'].data, 'pending')
+        self.assertEqual(directory['2.cfg'].data, 'line 1\n2.cfg')
+        self.assertEqual(list(directory['a']['3.cfg'].lines), [
+            'line 1',
+            '3.cfg'
+        ])
+        self.assertEqual(stats.count('open'), 0)
+
+        # Already cached contents are not read again
+        directory.prefetch_data(workers=1)
+        self.assertEqual(stats.count('open'), 2)
+        self.assertEqual(
+            directory['a']['aa']['4.cfg'].data,
+            'line 1\n4.cfg'
+        )
+        self.assertEqual(directory['other.txt'].data, 'line 1\nother.txt')
+        self.assertEqual(stats.count('open'), 2)
+
+        # Prefetched contents get invalidated on refresh
+        with open(os.path.join(root, '2.cfg'), 'w') as f:
+            f.write('changed')
+        directory.refresh()
+        self.assertEqual(directory['2.cfg'].data, 'changed')
+
+        # Prefetched files are not evicted by small child caches
+        directory = Directory(
+            name=root,
+            fs_backend=backend,
+            child_cache=CACHE_LRU,
+            child_cache_size=1
+        )
+        stats.reset()
+        directory.prefetch_data(patterns=['*.cfg'])
+        self.assertEqual(stats.count('open'), 4)
+        self.assertEqual(sorted(directory.storage), ['1.cfg', '2.cfg', 'a'])
+        self.assertEqual(directory['1.cfg'].data, 'line 1\n1.cfg')
+        self.assertEqual(directory['2.cfg'].data, 'changed')
+        self.assertEqual(
+            directory['a']['aa']['4.cfg'].data,
+            'line 1\n4.cfg'
+        )
+        self.assertEqual(stats.count('open'), 4)
+
+    def test_lazy_bookkeeping(self):
+        directory = Directory(name=self.tempdir)
+        other = Directory(name=self.tempdir)
+        # Unmodified directories share immutable empty containers
+        self.assertTrue(
+            directory._deleted_fs_children is other._deleted_fs_children
+        )
+        self.assertTrue(
+            directory._renamed_fs_children is other._renamed_fs_children
+        )
+        self.assertFalse('_deleted_fs_children' in directory.__dict__)
+
+        directory['a.txt'] = File()
+        directory['b.txt'] = File()
+        directory()
+        del directory['a.txt']
+        directory.rename('b.txt', 'c.txt')
+        self.assertEqual(directory._deleted_fs_children, {'a.txt'})
+        self.assertEqual(directory._renamed_fs_children, {'b.txt': 'c.txt'})
+        self.assertEqual(other._deleted_fs_children, set())
+        self.assertEqual(other._renamed_fs_children, {})
+        directory()
+        self.assertTrue(
+            directory._deleted_fs_children is other._deleted_fs_children
+        )
+        self.assertTrue(
+            directory._renamed_fs_children is other._renamed_fs_children
+        )
+        self.assertEqual(os.listdir(self.tempdir), ['c.txt'])
+
+    def test_compact_nodes(self):
+        directory = CompactDirectory(name=self.tempdir)
+        directory['file.txt'] = CompactFile()
+        directory['file.txt'].data = 'data'
+        directory['file.bin'] = CompactFile()
+        directory['file.bin'].mode = MODE_BINARY
+        directory['file.bin'].data = b'data'
+        directory['subdir'] = CompactDirectory()
+        directory['subdir']['sub.txt'] = CompactFile()
+        directory['subdir']['sub.txt'].fs_mode = 0o600
+        directory()
+
+        directory = CompactDirectory(name=self.tempdir)
+        self.assertEqual(directory.name, self.tempdir)
+        self.assertEqual(directory.parent, None)
+        self.assertEqual(
+            sorted(directory),
+            ['file.bin', 'file.txt', 'subdir']
+        )
+        file = directory['file.txt']
+        self.assertIsInstance(file, CompactFile)
+        self.assertIsInstance(directory['subdir'], CompactDirectory)
+        self.assertEqual(file.data, 'data')
+        self.assertEqual(file.fs_path, [self.tempdir, 'file.txt'])
+        self.assertFalse(file.fs_path is file.fs_path)
+        self.assertEqual(
+            directory['subdir']['sub.txt'].path,
+            [self.tempdir, 'subdir', 'sub.txt']
+        )
+        self.assertEqual(directory['subdir']['sub.txt'].fs_mode, 0o600)
+
+        directory.rename('file.txt', 'renamed.txt')
+        del directory['file.bin']
+        directory()
+        self.assertEqual(
+            sorted(os.listdir(self.tempdir)),
+            ['renamed.txt', 'subdir']
+        )
+        self.assertEqual(directory['renamed.txt'].data, 'data')
+        self.assertTrue(IDirectory.providedBy(directory))
+        self.assertTrue(IFile.providedBy(directory['renamed.txt']))
+
     def test_file_permissions(self):
         filepath = os.path.join(self.tempdir, 'file.txt')
         file = File(name=filepath)
@@ -288,6 +2106,106 @@ class Tests(NodeTestCase):
         __<class 'node.ext.fs.directory.Directory'>: other
         """, dir.treerepr(prefix='_'))
 
+    def test_compiled_factories(self):
+        class TextFile(File):
+            pass
+
+        class ArchiveFile(File):
+            pass
+
+        class LogFile(File):
+            pass
+
+        class AnyFile(File):
+            pass
+
+        factories = {
+            '*': AnyFile,
+            '*.gz': File,
+            '*.tar.gz': ArchiveFile,
+            '*.txt': TextFile,
+            're?dme.txt': File,
+            re.compile(r'log\d+', re.IGNORECASE): LogFile,
+            'readme.txt': AnyFile
+        }
+        dir = Directory(name=self.tempdir, factories=factories)
+        # exact names, regular expressions and most specific wildcard wins
+        self.assertEqual(dir.factory_for_pattern('readme.txt'), AnyFile)
+        self.assertEqual(dir.factory_for_pattern('rexdme.txt'), File)
+        self.assertEqual(dir.factory_for_pattern('foo.txt'), TextFile)
+        self.assertEqual(dir.factory_for_pattern('a.tar.gz'), ArchiveFile)
+        self.assertEqual(dir.factory_for_pattern('a.gz'), File)
+        self.assertEqual(dir.factory_for_pattern('LOG12'), LogFile)
+        self.assertEqual(dir.factory_for_pattern('log12.txt'), TextFile)
+        self.assertEqual(dir.factory_for_pattern('other'), AnyFile)
+
+        # without pattern weighting, first matching pattern wins
+        dir.pattern_weighting = False
+        self.assertEqual(dir.factory_for_pattern('readme.txt'), AnyFile)
+        self.assertEqual(dir.factory_for_pattern('a.tar.gz'), AnyFile)
+        dir.factories = {
+            '*.gz': File,
+            '*.tar.gz': ArchiveFile,
+            re.compile('log.*'): LogFile,
+            '*.txt': TextFile
+        }
+        self.assertEqual(dir.factory_for_pattern('a.tar.gz'), File)
+        self.assertEqual(dir.factory_for_pattern('log.txt'), LogFile)
+        self.assertEqual(dir.factory_for_pattern('other'), None)
+
+        # matchers are cached by factories object and compiled again once
+        # factories get changed in place or reassigned
+        matcher = compile_factories(dir.factories, False)
+        self.assertIs(compile_factories(dir.factories, False), matcher)
+        dir.factories['*.cfg'] = TextFile
+        self.assertIsNot(compile_factories(dir.factories, False), matcher)
+        self.assertEqual(dir.factory_for_pattern('a.cfg'), TextFile)
+        dir.factories['*.cfg'] = LogFile
+        self.assertEqual(dir.factory_for_pattern('a.cfg'), LogFile)
+        del dir.factories['*.cfg']
+        self.assertEqual(dir.factory_for_pattern('a.cfg'), None)
+        matcher = compile_factories(dir.factories, False)
+        dir.factories = {'*.txt': LogFile}
+        self.assertIsNot(compile_factories(dir.factories, False), matcher)
+        self.assertEqual(dir.factory_for_pattern('log.txt'), LogFile)
+        self.assertEqual(dir.factory_for_pattern('a.tar.gz'), None)
+        dir.factories = {
+            '*.gz': File,
+            '*.tar.gz': ArchiveFile,
+            re.compile('log.*'): LogFile,
+            '*.txt': TextFile
+        }
+
+        # regular expression factories are also accepted by walk
+        with open(os.path.join(self.tempdir, 'log1'), 'w') as f:
+            f.write('')
+        with open(os.path.join(self.tempdir, 'other'), 'w') as f:
+            f.write('')
+        self.assertEqual(
+            [entry.names for entry in dir.walk(patterns=dir.factories)],
+            [('log1',)]
+        )
+        self.assertIsInstance(dir['log1'], LogFile)
+
+        # class of non class factories gets resolved once per pattern
+        created = []
+
+        def log_factory(name, parent):
+            created.append(name)
+            return LogFile(name=name, parent=parent)
+
+        dir = Directory(
+            name=self.tempdir,
+            factories={'log*': log_factory}
+        )
+        self.assertIsInstance(dir['log1'], LogFile)
+        self.assertEqual(created, ['log1'])
+        dir['log2'] = LogFile()
+        dir['log3'] = LogFile()
+        with self.assertRaises(ValueError):
+            dir['log4'] = File()
+        self.assertEqual(created, ['log1'])
+
     def test_file_fs_path_fallback(self):
         # Path lookup on ``File`` implementations without ``fs_path`` property
         # falls back to ``path`` property
@@ -401,28 +2319,28 @@ class Tests(NodeTestCase):
         del directory['file.txt']
         with self.assertRaises(KeyError):
             directory['file.txt']
-        self.assertEqual(directory._deleted_fs_children, ['file.txt'])
+        self.assertEqual(directory._deleted_fs_children, {'file.txt'})
         self.assertEqual(
             sorted(os.listdir(self.tempdir)),
             ['file.txt', 'subdir']
         )
         directory()
-        self.assertEqual(directory._deleted_fs_children, [])
+        self.assertEqual(directory._deleted_fs_children, set())
         self.assertEqual(sorted(os.listdir(self.tempdir)), ['subdir'])
 
         del directory['subdir']
-        self.assertEqual(directory._deleted_fs_children, ['subdir'])
+        self.assertEqual(directory._deleted_fs_children, {'subdir'})
         self.assertEqual(sorted(os.listdir(self.tempdir)), ['subdir'])
         directory()
-        self.assertEqual(directory._deleted_fs_children, [])
+        self.assertEqual(directory._deleted_fs_children, set())
         self.assertEqual(sorted(os.listdir(self.tempdir)), [])
 
         directory['file.txt'] = File()
         directory()
         del directory['file.txt']
-        self.assertEqual(directory._deleted_fs_children, ['file.txt'])
+        self.assertEqual(directory._deleted_fs_children, {'file.txt'})
         directory['file.txt'] = File()
-        self.assertEqual(directory._deleted_fs_children, [])
+        self.assertEqual(directory._deleted_fs_children, set())
 
     def test_directory___getitem__(self):
         directory = Directory(name=os.path.join(self.tempdir))
@@ -442,6 +2360,285 @@ class Tests(NodeTestCase):
             directory['inexistent']
         self.assertEqual(str(arc.exception), '\'inexistent\'')
 
+    def test_directory_listing_cache(self):
+        with open(os.path.join(self.tempdir, 'file.txt'), 'w') as f:
+            f.write('')
+        os.mkdir(os.path.join(self.tempdir, 'subdir'))
+
+        # Lookup without listing falls back to stat
+        directory = Directory(name=self.tempdir)
+        self.assertEqual(directory._fs_listing, None)
+        self.assertTrue('file.txt' in directory)
+        self.assertFalse('inexistent' in directory)
+        self.assertEqual(directory.storage, {})
+        self.assertIsInstance(directory['subdir'], Directory)
+        self.assertEqual(directory._fs_listing, None)
+
+        # Iteration reads listing once
+        directory = Directory(name=self.tempdir)
+        self.assertEqual(sorted(directory), ['file.txt', 'subdir'])
+        listing = directory._fs_listing
+        self.assertEqual(sorted(listing), ['file.txt', 'subdir'])
+        self.assertTrue(listing['subdir'].is_dir())
+        self.assertFalse(listing['file.txt'].is_dir())
+        self.assertTrue('file.txt' in directory)
+        self.assertEqual(directory.storage, {})
+
+        # Children created by other processes are found, missing children
+        # are looked up with stat
+        with open(os.path.join(self.tempdir, 'other.txt'), 'w') as f:
+            f.write('')
+        self.assertTrue('other.txt' in directory)
+        self.assertIsInstance(directory['other.txt'], File)
+        self.assertIsInstance(directory['file.txt'], File)
+        self.assertIsInstance(directory['subdir'], Directory)
+        os.remove(os.path.join(self.tempdir, 'other.txt'))
+
+        # Listing gets revalidated by signature of directory
+        stats = IOStats()
+        backend = InstrumentedBackend(os_backend, [stats])
+        directory = Directory(name=self.tempdir, fs_backend=backend)
+        self.assertEqual(sorted(directory), ['file.txt', 'subdir'])
+        stats.reset()
+        # Length hint of ``sorted`` would iterate directory twice
+        self.assertEqual(sorted(iter(directory)), ['file.txt', 'subdir'])
+        self.assertEqual(list(stats.operations), ['stat'])
+        self.assertEqual(stats.operations['stat'][0], 1)
+        with open(os.path.join(self.tempdir, 'other.txt'), 'w') as f:
+            f.write('')
+        # Make sure the change is detected within timestamp granularity
+        os.utime(self.tempdir, ns=(0, 0))
+        self.assertEqual(
+            sorted(directory),
+            ['file.txt', 'other.txt', 'subdir']
+        )
+        os.remove(os.path.join(self.tempdir, 'other.txt'))
+
+        # With ``listing_cache``, listing is served without file system access
+        directory = Directory(
+            name=self.tempdir,
+            fs_backend=backend,
+            listing_cache=True
+        )
+        self.assertEqual(sorted(directory), ['file.txt', 'subdir'])
+        stats.reset()
+        self.assertEqual(sorted(directory), ['file.txt', 'subdir'])
+        self.assertEqual(stats.operations, {})
+        with open(os.path.join(self.tempdir, 'other.txt'), 'w') as f:
+            f.write('')
+        self.assertEqual(sorted(directory), ['file.txt', 'subdir'])
+        self.assertTrue('other.txt' in directory)
+
+        # Listing gets invalidated on persist
+        directory['new.txt'] = File()
+        directory()
+        self.assertEqual(directory._fs_listing, None)
+        self.assertEqual(
+            sorted(directory),
+            ['file.txt', 'new.txt', 'other.txt', 'subdir']
+        )
+
+    def test_child_cache_none(self):
+        for name in ['file1.txt', 'file2.txt']:
+            with open(os.path.join(self.tempdir, name), 'w') as f:
+                f.write(name)
+        os.mkdir(os.path.join(self.tempdir, 'subdir'))
+
+        directory = Directory(name=self.tempdir, child_cache=CACHE_NONE)
+        self.assertEqual(directory.child_cache, CACHE_NONE)
+        self.assertEqual(len(directory.values()), 3)
+        self.assertEqual(directory.storage, {})
+
+        # Policy is inherited by subdirectories
+        subdir = directory['subdir']
+        self.assertIsInstance(_child_cache(subdir), NoChildCache)
+        self.assertIs(_child_cache(subdir), _child_cache(directory))
+
+        # Dirty children are put back to storage
+        file1 = directory['file1.txt']
+        self.assertEqual(directory.storage, {})
+        file1.data = 'changed'
+        self.assertEqual(list(directory.storage), ['file1.txt'])
+        self.assertIs(directory['file1.txt'], file1)
+
+        # Dirty children get evicted after persisting
+        directory()
+        self.assertEqual(directory.storage, {})
+        with open(os.path.join(self.tempdir, 'file1.txt')) as f:
+            self.assertEqual(f.read(), 'changed')
+
+        # Added children are kept until persisted
+        directory['file3.txt'] = File()
+        self.assertEqual(list(directory.storage), ['file3.txt'])
+        directory()
+        self.assertEqual(directory.storage, {})
+        self.assertTrue(
+            os.path.exists(os.path.join(self.tempdir, 'file3.txt'))
+        )
+
+    def test_child_cache_lru(self):
+        for name in ['a', 'b']:
+            os.mkdir(os.path.join(self.tempdir, name))
+            for i in range(3):
+                path = os.path.join(self.tempdir, name, str(i))
+                with open(path, 'w') as f:
+                    f.write(path)
+
+        directory = Directory(
+            name=self.tempdir,
+            child_cache=CACHE_LRU,
+            child_cache_size=4
+        )
+        cache = _child_cache(directory)
+        self.assertIsInstance(cache, LRUChildCache)
+        self.assertEqual(cache.size, 4)
+
+        # LRU cache is shared across the tree
+        dir_a = directory['a']
+        self.assertIs(_child_cache(dir_a), cache)
+        for i in range(3):
+            dir_a[str(i)]
+        self.assertEqual(len(cache), 4)
+        self.assertEqual(sorted(directory.storage), ['a'])
+        self.assertEqual(sorted(dir_a.storage), ['0', '1', '2'])
+
+        # Least recently used nodes get evicted
+        dir_a['0']
+        dir_b = directory['b']
+        self.assertEqual(sorted(directory.storage), ['b'])
+        self.assertEqual(sorted(dir_a.storage), ['0', '1', '2'])
+        dir_b['0']
+        self.assertEqual(sorted(dir_a.storage), ['0', '2'])
+        dir_b['1']
+        dir_b['2']
+        self.assertEqual(dir_a.storage, {})
+        self.assertEqual(len(cache), 4)
+
+        # Dirty nodes are pinned
+        file_b0 = dir_b['0']
+        file_b0.data = 'changed'
+        for i in range(3):
+            dir_a[str(i)]
+        self.assertEqual(sorted(dir_b.storage), ['0'])
+        self.assertEqual(sorted(directory.storage), ['b'])
+        directory()
+        with open(os.path.join(self.tempdir, 'b', '0')) as f:
+            self.assertEqual(f.read(), 'changed')
+        self.assertFalse(is_dirty(file_b0))
+
+        # Evicted nodes are put back to storage when they get modified
+        file_a1 = dir_a['1']
+        directory['b']
+        for i in range(3):
+            dir_b[str(i)]
+        self.assertFalse('1' in dir_a.storage)
+        self.assertTrue(file_a1._fs_evicted)
+        file_a1.data = 'changed'
+        self.assertFalse(file_a1._fs_evicted)
+        self.assertIs(dir_a.storage['1'], file_a1)
+        self.assertIs(directory.storage['a'], dir_a)
+        directory()
+        with open(os.path.join(self.tempdir, 'a', '1')) as f:
+            self.assertEqual(f.read(), 'changed')
+
+    def test_child_cache_evicted_ancestors(self):
+        # Evicted nodes still referenced get reused on lookup, thus changes
+        # of siblings looked up via different paths are never lost
+        os.makedirs(os.path.join(self.tempdir, 'a', 'b'))
+        for policy, factory in [
+            (CACHE_NONE, Directory),
+            (CACHE_LRU, Directory),
+            (CACHE_NONE, CompactDirectory),
+        ]:
+            for name in ['f0', 'f1']:
+                path = os.path.join(self.tempdir, 'a', 'b', name)
+                with open(path, 'w') as f:
+                    f.write('x')
+            root = factory(
+                name=self.tempdir,
+                child_cache=policy,
+                child_cache_size=1
+            )
+            f0 = root['a']['b']['f0']
+            f1 = root['a']['b']['f1']
+            self.assertIs(f0.parent, f1.parent)
+            f1.data = 'A'
+            f0.data = 'B'
+            root()
+            for name, data in [('f0', 'B'), ('f1', 'A')]:
+                path = os.path.join(self.tempdir, 'a', 'b', name)
+                with open(path) as f:
+                    self.assertEqual(f.read(), data)
+
+        # Evicted nodes replaced meanwhile are not put back
+        root = Directory(name=self.tempdir, child_cache=CACHE_NONE)
+        f0 = root['a']['b']['f0']
+        root['a']['b']['f0'] = File()
+        root['a']['b']['f0'].data = 'new'
+        f0.data = 'old'
+        root()
+        with open(os.path.join(self.tempdir, 'a', 'b', 'f0')) as f:
+            self.assertEqual(f.read(), 'new')
+
+    def test_parallel_flush(self):
+        directory = Directory(name=os.path.join(self.tempdir, 'root'))
+        directory.flush_workers = 4
+        for i in range(10):
+            directory['file{}.txt'.format(i)] = File()
+            directory['file{}.txt'.format(i)].data = str(i)
+        subdir = directory['subdir'] = Directory()
+        subdir.fs_mode = 0o500
+        subsubdir = subdir['subsubdir'] = Directory()
+        for i in range(10):
+            subsubdir['file{}.txt'.format(i)] = File()
+            subsubdir['file{}.txt'.format(i)].fs_mode = 0o600
+        directory()
+        self.assertFalse(is_dirty(directory))
+        self.assertFalse(is_dirty(subdir))
+        self.assertFalse(is_dirty(subsubdir['file0.txt']))
+
+        dir_path = os.path.join(self.tempdir, 'root')
+        for i in range(10):
+            with open(os.path.join(dir_path, 'file{}.txt'.format(i))) as f:
+                self.assertEqual(f.read(), str(i))
+        subdir_path = os.path.join(dir_path, 'subdir')
+        self.assertEqual(os.stat(subdir_path).st_mode & 0o777, 0o500)
+        subsubdir_path = os.path.join(subdir_path, 'subsubdir')
+        self.assertEqual(len(os.listdir(subsubdir_path)), 10)
+        self.assertEqual(
+            os.stat(os.path.join(subsubdir_path, 'file0.txt')).st_mode & 0o777,
+            0o600
+        )
+        os.chmod(subdir_path, 0o700)
+
+        # Deletes and renames are applied before writing children
+        directory = Directory(name=dir_path, flush_workers=2)
+        directory.rename('subdir', 'other')
+        del directory['file0.txt']
+        other = directory['other']
+        other['subsubdir']['file0.txt'].data = 'changed'
+        directory()
+        self.assertEqual(
+            sorted(os.listdir(dir_path))[:2],
+            ['file1.txt', 'file2.txt']
+        )
+        path = os.path.join(dir_path, 'other', 'subsubdir', 'file0.txt')
+        with open(path) as f:
+            self.assertEqual(f.read(), 'changed')
+
+        # First error gets propagated
+        def failing():
+            yield 'partial'
+            raise ValueError('Failed')
+
+        directory = Directory(name=dir_path, flush_workers=2)
+        directory['file1.txt'].data = failing()
+        directory['file2.txt'].data = 'written'
+        with self.assertRaises(ValueError):
+            directory()
+        self.assertTrue(is_dirty(directory))
+        self.assertTrue(is_dirty(directory['file1.txt']))
+
     def test_sub_directory_permissions(self):
         directory = Directory(name=os.path.join(self.tempdir, 'root'))
         directory.fs_mode = 0o777
@@ -594,6 +2791,10 @@ class Tests(NodeTestCase):
             directory._renamed_fs_children,
             {'dir1': 'dir3', 'file1.txt': 'file3.txt'}
         )
+        self.assertEqual(
+            directory._renamed_fs_names,
+            {'dir3': 'dir1', 'file3.txt': 'file1.txt'}
+        )
         self.assertEqual(
             sorted(directory),
             ['dir2', 'dir3', 'file2.txt', 'file3.txt']
@@ -641,7 +2842,7 @@ class Tests(NodeTestCase):
             sorted(directory),
             ['dir1', 'file2.txt', 'file3.txt']
         )
-        self.assertEqual(directory._deleted_fs_children, ['dir2'])
+        self.assertEqual(directory._deleted_fs_children, {'dir2'})
         directory.rename('dir1', 'dir2')
         self.assertEqual(directory._renamed_fs_children, {'dir1': 'dir2'})
         self.assertEqual(
@@ -684,6 +2885,7 @@ class Tests(NodeTestCase):
         directory.rename('dir1', 'dir2')
         directory.rename('dir2', 'dir3')
         self.assertEqual(directory._renamed_fs_children, {'dir1': 'dir3'})
+        self.assertEqual(directory._renamed_fs_names, {'dir3': 'dir1'})
         directory()
         self.assertEqual(
             sorted(os.listdir(self.tempdir)),
@@ -694,16 +2896,213 @@ class Tests(NodeTestCase):
         directory = Directory(name=self.tempdir)
         directory.rename('dir3', 'dir1')
         self.assertEqual(directory._renamed_fs_children, {'dir3': 'dir1'})
-        self.assertEqual(directory._deleted_fs_children, [])
+        self.assertEqual(directory._deleted_fs_children, set())
         del directory['dir1']
         self.assertEqual(directory._renamed_fs_children, {})
-        self.assertEqual(directory._deleted_fs_children, ['dir3'])
+        self.assertEqual(directory._renamed_fs_names, {})
+        self.assertEqual(directory._deleted_fs_children, {'dir3'})
         directory()
         self.assertEqual(
             sorted(os.listdir(self.tempdir)),
             ['file2.txt', 'file3.txt']
         )
 
+        # Case rename back to name on file system
+        directory = Directory(name=self.tempdir)
+        directory.rename('file2.txt', 'file4.txt')
+        directory.rename('file4.txt', 'file2.txt')
+        self.assertEqual(directory._renamed_fs_children, {})
+        self.assertEqual(directory._renamed_fs_names, {})
+        self.assertEqual(sorted(directory), ['file2.txt', 'file3.txt'])
+        self.assertTrue('file2.txt' in directory)
+        self.assertEqual(directory['file2.txt'].name, 'file2.txt')
+
+        # Case swap names, renames get applied via temporary names
+        with open(os.path.join(self.tempdir, 'file2.txt'), 'w') as f:
+            f.write('2')
+        with open(os.path.join(self.tempdir, 'file3.txt'), 'w') as f:
+            f.write('3')
+        for transactional in (False, True):
+            directory = Directory(
+                name=self.tempdir,
+                transactional=transactional
+            )
+            directory.rename('file2.txt', 'tmp.txt')
+            directory.rename('file3.txt', 'file2.txt')
+            directory.rename('tmp.txt', 'file3.txt')
+            directory()
+            self.assertEqual(
+                sorted(os.listdir(self.tempdir)),
+                ['file2.txt', 'file3.txt']
+            )
+            expected = ['3', '2'] if not transactional else ['2', '3']
+            for name, data in zip(['file2.txt', 'file3.txt'], expected):
+                with open(os.path.join(self.tempdir, name)) as f:
+                    self.assertEqual(f.read(), data)
+
+        # Planned swap of directories maps paths of children correctly
+        os.mkdir(os.path.join(self.tempdir, 'dir1'))
+        os.mkdir(os.path.join(self.tempdir, 'dir2'))
+        directory = Directory(name=self.tempdir)
+        directory.rename('dir1', 'dir2.tmp')
+        directory.rename('dir2', 'dir1')
+        directory.rename('dir2.tmp', 'dir2')
+        directory['dir1']['new.txt'] = File()
+        plan = directory.plan()
+        self.assertEqual(plan.count('rename'), 4)
+        self.assertEqual(plan.operations[-1].path, os.path.join(
+            self.tempdir,
+            'dir1',
+            'new.txt'
+        ))
+        directory.apply_plan(plan)
+        self.assertEqual(
+            os.listdir(os.path.join(self.tempdir, 'dir1')),
+            ['new.txt']
+        )
+        self.assertEqual(os.listdir(os.path.join(self.tempdir, 'dir2')), [])
+
+    def test_dirty_tracking(self):
+        calls = []
+
+        class TrackingFile(File):
+            def __call__(self):
+                calls.append(self.name)
+                super(TrackingFile, self).__call__()
+
+        class TrackingDirectory(Directory):
+            default_file_factory = TrackingFile
+
+        TrackingDirectory.default_directory_factory = TrackingDirectory
+
+        directory = TrackingDirectory(name=self.tempdir)
+        self.assertTrue(is_dirty(directory))
+        directory['file1.txt'] = TrackingFile()
+        subdir = directory['subdir'] = TrackingDirectory()
+        subdir['file2.txt'] = TrackingFile()
+        self.assertTrue(is_dirty(subdir))
+        directory()
+        self.assertEqual(sorted(calls), ['file1.txt', 'file2.txt'])
+        self.assertFalse(is_dirty(directory))
+        self.assertFalse(is_dirty(subdir))
+        self.assertFalse(is_dirty(subdir['file2.txt']))
+
+        # Children read from file system are clean
+        del calls[:]
+        directory = TrackingDirectory(name=self.tempdir)
+        directory.values()
+        subdir = directory['subdir']
+        file2 = subdir['file2.txt']
+        self.assertFalse(is_dirty(directory['file1.txt']))
+        self.assertFalse(is_dirty(subdir))
+        self.assertFalse(is_dirty(file2))
+        directory()
+        self.assertEqual(calls, [])
+        self.assertFalse(is_dirty(directory))
+
+        # Changing data marks file and it's ancestors dirty
+        file2.data = 'data'
+        self.assertTrue(is_dirty(file2))
+        self.assertTrue(is_dirty(subdir))
+        self.assertTrue(is_dirty(directory))
+        self.assertFalse(is_dirty(directory['file1.txt']))
+        directory()
+        self.assertEqual(calls, ['file2.txt'])
+        self.assertFalse(is_dirty(directory))
+
+        # Changing fs mode marks dirty
+        del calls[:]
+        subdir.fs_mode = 0o700
+        self.assertTrue(is_dirty(subdir))
+        self.assertTrue(is_dirty(directory))
+        directory()
+        self.assertEqual(calls, [])
+        dir_path = os.path.join(self.tempdir, 'subdir')
+        self.assertEqual(os.stat(dir_path).st_mode & 0o777, 0o700)
+
+        # Setting an unchanged fs mode neither marks dirty nor calls chmod
+        file1 = directory['file1.txt']
+        file1.fs_mode = file1.fs_mode
+        self.assertFalse(is_dirty(file1))
+        self.assertFalse(is_dirty(directory))
+
+        # Structural changes mark directory dirty
+        del subdir['file2.txt']
+        self.assertTrue(is_dirty(subdir))
+        self.assertTrue(is_dirty(directory))
+        directory()
+        self.assertEqual(os.listdir(dir_path), [])
+        directory.rename('file1.txt', 'file3.txt')
+        self.assertTrue(is_dirty(directory))
+        directory()
+        self.assertEqual(calls, [])
+        self.assertEqual(
+            sorted(os.listdir(self.tempdir)),
+            ['file3.txt', 'subdir']
+        )
+
+    def test_FSMode_unchanged(self):
+        path = os.path.join(self.tempdir, 'file')
+        with open(path, 'w') as f:
+            f.write('')
+        os.chmod(path, 0o644)
+        ob = FSModeObject(path=[self.tempdir, 'file'])
+        self.assertEqual(ob.fs_mode, 0o644)
+        ob.fs_mode = 0o644
+        self.assertFalse(hasattr(ob, '_fs_mode_changed'))
+        os.chmod(path, 0o600)
+        ob()
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        ob.fs_mode = 0o640
+        self.assertTrue(ob._fs_mode_changed)
+        ob()
+        self.assertFalse(ob._fs_mode_changed)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+
+    def test_async(self):
+        directory = Directory(name=os.path.join(self.tempdir, 'root'))
+        self.assertTrue(IAsyncDirectory.providedBy(directory))
+        self.assertEqual(get_async_executor(directory), None)
+
+        async def write():
+            directory['file.txt'] = File()
+            directory['subdir'] = Directory()
+            await directory.acall()
+            await directory['subdir'].aget('inexistent')
+            file = directory['subdir']['other.txt'] = File()
+            self.assertTrue(IAsyncFileNode.providedBy(file))
+            await file.awrite('data')
+
+        asyncio.run(write())
+        dir_path = os.path.join(self.tempdir, 'root')
+        self.assertEqual(sorted(os.listdir(dir_path)), ['file.txt', 'subdir'])
+        with open(os.path.join(dir_path, 'subdir', 'other.txt')) as f:
+            self.assertEqual(f.read(), 'data')
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        directory = Directory(name=dir_path)
+        directory.async_executor = executor
+
+        async def read():
+            keys = [key async for key in directory]
+            items = await directory.aitems()
+            subdir = await directory.aget('subdir')
+            self.assertIs(get_async_executor(subdir), executor)
+            other = await subdir.aget('other.txt')
+            data = await other.aread()
+            inexistent = await directory.aget('inexistent', 'default')
+            return keys, items, data, inexistent
+
+        keys, items, data, inexistent = asyncio.run(read())
+        executor.shutdown()
+        self.assertEqual(sorted(keys), ['file.txt', 'subdir'])
+        self.assertEqual(
+            sorted([(key, type(child)) for key, child in items]),
+            [('file.txt', File), ('subdir', Directory)]
+        )
+        self.assertEqual(data, 'data')
+        self.assertEqual(inexistent, 'default')
+
     def test_node_index(self):
         directory = ReferencingDirectory(
             name=os.path.join(self.tempdir, 'root')
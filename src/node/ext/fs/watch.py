@@ -0,0 +1,295 @@
+from node.ext.fs.backend import os_backend
+from node.ext.fs.cache import evict_child
+from node.ext.fs.directory import loaded_child
+from node.ext.fs.file import drop_file_cache
+from node.ext.fs.interfaces import IDirectory
+from node.ext.fs.interfaces import IFileNode
+from node.ext.fs.location import join_fs_path
+from node.ext.fs.locking import subtree_lock
+import abc
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+IN_STRUCTURE = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+IN_CONTENT = IN_MODIFY | IN_CLOSE_WRITE | IN_ATTRIB
+IN_WATCH_MASK = (
+    IN_STRUCTURE | IN_CONTENT | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+
+_event_header = struct.Struct('iIII')
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+    except (AttributeError, OSError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def inotify_available():
+    """Check whether inotify is available on this system."""
+    return _libc is not None
+
+
+def _loaded_directory(root, fs_names):
+    """Return loaded directory at file system names relative to root or
+    ``None``.
+    """
+    node = root
+    for fs_name in fs_names:
+        node = loaded_child(node, fs_name)
+        if node is None or not IDirectory.providedBy(node):
+            return None
+    return node
+
+
+def invalidate_child(directory, fs_name, mask):
+    """Invalidate caches after child of directory has changed on file system.
+
+    ``mask`` is an inotify event mask. If a child has been created, deleted
+    or moved, the listing of directory gets dropped. Removed children and
+    children replaced by an entry of different type get evicted unless they
+    are modified. Otherwise, cached content and file system mode of the child
+    get dropped.
+    """
+    if mask & IN_STRUCTURE:
+        directory._fs_listing = None
+    child = loaded_child(directory, fs_name)
+    if child is None:
+        return
+    if mask & (IN_DELETE | IN_MOVED_FROM):
+        evict_child(child)
+        return
+    if IDirectory.providedBy(child) != bool(mask & IN_ISDIR):
+        evict_child(child)
+        return
+    if IFileNode.providedBy(child):
+        drop_file_cache(child)
+    if mask & IN_ATTRIB and not getattr(child, '_fs_mode_changed', False):
+        if hasattr(child, '_fs_mode'):
+            del child._fs_mode
+
+
+class Watcher(abc.ABC):
+    """Base class for watchers invalidating caches of a directory tree on
+    file system changes.
+
+    Watchers can either be started as background thread with ``start`` or
+    by using them as context manager, or events can be processed explicitly
+    by calling ``process_events``.
+    """
+
+    def __init__(self, directory, interval=1.0):
+        self.directory = directory
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @abc.abstractmethod
+    def process_events(self, timeout=0):
+        """Wait at most timeout seconds for file system changes and
+        invalidate caches accordingly.
+        """
+
+    def close(self):
+        """Release resources of watcher."""
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.process_events(self.interval)
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class PollingWatcher(Watcher):
+    """Watcher revalidating the tree with ``refresh`` every ``interval``
+    seconds.
+    """
+
+    def process_events(self, timeout=0):
+        if timeout and self._stopped.wait(timeout):
+            return
+        with subtree_lock(self.directory):
+            self.directory.refresh()
+
+
+class InotifyWatcher(Watcher):
+    """Watcher using Linux inotify.
+
+    All directories of the tree get watched. Directories created later on
+    get watched as soon as their creation is noticed. Events only affect
+    nodes which are loaded, thus reading unchanged nodes does not require
+    any file system access. Changes written by the tree itself get noticed
+    as well, which causes the respective caches being read again.
+    """
+
+    def __init__(self, directory, interval=1.0):
+        if _libc is None:
+            raise RuntimeError('inotify is not available on this system')
+        super().__init__(directory, interval=interval)
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self._fd = fd
+        self._watches = dict()
+        self._path = join_fs_path(directory)
+        self._add_watches(())
+
+    def _add_watches(self, fs_names):
+        """Watch directory at file system names relative to root directory
+        and it's subdirectories.
+        """
+        path = os.path.join(self._path, *fs_names)
+        wd = _libc.inotify_add_watch(
+            self._fd,
+            os.fsencode(path),
+            IN_WATCH_MASK
+        )
+        if wd < 0:
+            code = ctypes.get_errno()
+            # Directory has been removed or replaced meanwhile
+            if code in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(code, os.strerror(code), path)
+        self._watches[wd] = fs_names
+        try:
+            with os.scandir(path) as entries:
+                subdirectories = [
+                    entry.name for entry in entries
+                    if entry.is_dir(follow_symlinks=False)
+                ]
+        except OSError:
+            return
+        for name in subdirectories:
+            self._add_watches(fs_names + (name,))
+
+    def _remove_watches(self, fs_names):
+        """Stop watching directory at file system names relative to root
+        directory and it's subdirectories.
+        """
+        count = len(fs_names)
+        for wd, watched in list(self._watches.items()):
+            if watched[:count] == fs_names:
+                del self._watches[wd]
+                _libc.inotify_rm_watch(self._fd, wd)
+
+    def _read_events(self):
+        try:
+            buffer = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, cookie, length = _event_header.unpack_from(
+                buffer,
+                offset
+            )
+            offset += _event_header.size
+            name = buffer[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def _handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # Events got lost, revalidate whole tree
+            self.directory.refresh()
+            return
+        fs_names = self._watches.get(wd)
+        if fs_names is None:
+            return
+        if mask & IN_IGNORED:
+            del self._watches[wd]
+            return
+        if not name:
+            return
+        directory = _loaded_directory(self.directory, fs_names)
+        if directory is not None:
+            invalidate_child(directory, name, mask)
+        if not mask & IN_STRUCTURE or not mask & IN_ISDIR:
+            return
+        if mask & (IN_CREATE | IN_MOVED_TO):
+            self._add_watches(fs_names + (name,))
+        elif mask & IN_MOVED_FROM:
+            self._remove_watches(fs_names + (name,))
+
+    def process_events(self, timeout=0):
+        """Process pending inotify events. Returns number of events."""
+        if self._fd is None:
+            return 0
+        if timeout:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+            if not readable:
+                return 0
+        events = self._read_events()
+        if events:
+            with subtree_lock(self.directory):
+                for wd, mask, name in events:
+                    self._handle_event(wd, mask, name)
+        return len(events)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._watches = dict()
+
+
+def create_watcher(directory, interval=1.0):
+    """Create watcher for directory tree.
+
+    ``InotifyWatcher`` is used if inotify is available and the directory
+    uses the OS file system backend, otherwise ``PollingWatcher``.
+    """
+    if inotify_available() and directory.fs_backend is os_backend:
+        return InotifyWatcher(directory, interval=interval)
+    return PollingWatcher(directory, interval=interval)